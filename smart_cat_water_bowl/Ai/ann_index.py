@@ -0,0 +1,599 @@
+# ann_index.py
+import os
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+from cat_bank import EMB_DIM, file_lock, normalize_rows, open_bank
+from identify_cat import IDENTITY_THRESHOLD, CatMatcher
+
+# Approximate nearest-neighbour index (IVF-flat, pure numpy) over every
+# cat of every user, for identifying uploads against tens of thousands
+# of cats without scanning every row.
+# cat_db/
+#   ann/
+#     centroids.f32   # (nlist, dim) spherical k-means centroids
+#     vectors.f32     # (N, dim) L2-normalised rows
+#     lists.i32       # row -> inverted list (nearest centroid)
+#     labels.i32      # row -> index into index.json["cats"]
+#     index.json      # dim, nlist, nprobe, n_sorted, offsets, cats, users, devices, removed
+#
+# A cat entry is (user, device, cat_uid): two devices may register the
+# same cat_uid, and replacing / removing it on one leaves the other alone.
+#
+# Rows [0, n_sorted) are sorted by (list, cat), so a list is one
+# contiguous memmap slice and a cat is one run inside it: a query scores
+# only the `nprobe` lists nearest to it, reducing each run to a per-cat
+# max (np.maximum.reduceat, like CatMatcher). register_cat keeps the index
+# current without loading it: new rows are appended to the unsorted tail
+# (scanned exhaustively) and replaced / removed cats are tombstoned.
+# `compact` re-sorts the tail in and drops tombstoned rows.
+#
+# nprobe is the recall knob: `tune` picks the smallest nprobe whose
+# recall@1 against the exact scan reaches a target.
+#
+#   python ann_index.py build               # from every bank under cat_db/users
+#   python ann_index.py tune --target 0.99
+#   python ann_index.py compact
+#   python ann_index.py bench --cats 4000   # synthetic recall vs. latency
+
+ANN_DIR = "ann"
+CENTROIDS_FILE = "centroids.f32"
+VECTORS_FILE = "vectors.f32"
+LISTS_FILE = "lists.i32"
+LABELS_FILE = "labels.i32"
+INDEX_FILE = "index.json"
+LOCK_FILE = ".lock"
+
+DEFAULT_NPROBE = 8
+KMEANS_ITERS = 10
+KMEANS_SAMPLE = 256     # training rows per centroid
+COMPACT_TAIL = 0.1      # compact when tail / tombstones exceed this fraction
+
+
+# ---------- files ----------
+def _load_meta(path):
+    with open(os.path.join(path, INDEX_FILE), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    # indexes written before devices were recorded: None matches any device
+    meta.setdefault("devices", [None] * len(meta["cats"]))
+    return meta
+
+
+def _save_meta(path, meta):
+    # write + rename so readers never see a half-written file
+    tmp = os.path.join(path, INDEX_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(path, INDEX_FILE))
+
+
+def _rows(path, name, dtype, width=1):
+    full = os.path.join(path, name)
+    size = os.path.getsize(full) if os.path.exists(full) else 0
+    n = size // (np.dtype(dtype).itemsize * width)
+    if n == 0:
+        return np.empty((0, width) if width > 1 else (0,), dtype=dtype)
+    shape = (n, width) if width > 1 else (n,)
+    return np.memmap(full, dtype=dtype, mode="r", shape=shape)
+
+
+def has_index(path):
+    return os.path.exists(os.path.join(path, INDEX_FILE))
+
+
+def _locked(path):
+    return file_lock(os.path.join(path, LOCK_FILE))
+
+
+# ---------- training ----------
+def train_centroids(vectors, nlist, iters=KMEANS_ITERS, seed=0):
+    """Spherical k-means on (a sample of) normalised rows -> (nlist, dim)."""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    sample = rng.choice(n, size=min(n, nlist * KMEANS_SAMPLE), replace=False)
+    x = np.asarray(vectors[np.sort(sample)], dtype=np.float32)
+    centroids = x[rng.choice(len(x), size=nlist, replace=False)].copy()
+
+    for _ in range(iters):
+        assign = _nearest(x, centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        sums = np.zeros_like(centroids)
+        starts = np.searchsorted(assign[order], np.flatnonzero(~empty))
+        sums[~empty] = np.add.reduceat(x[order], starts, axis=0)
+        # re-seed empty lists with random rows
+        sums[empty] = x[rng.choice(len(x), size=int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def _nearest(x, centroids, chunk=8192):
+    out = np.empty(len(x), dtype=np.int32)
+    for s in range(0, len(x), chunk):
+        out[s:s + chunk] = np.argmax(np.asarray(x[s:s + chunk]) @ centroids.T, axis=1)
+    return out
+
+
+def default_nlist(n_rows):
+    return int(np.clip(4 * np.sqrt(max(n_rows, 1)), 1, 1024))
+
+
+# ---------- build / compact ----------
+def write_index(path, vectors, labels, cats, users, devices, centroids, nprobe=DEFAULT_NPROBE):
+    """Write a fully sorted index (no tail, no tombstones)."""
+    os.makedirs(path, exist_ok=True)
+    vectors = normalize_rows(vectors) if len(vectors) else np.empty((0, centroids.shape[1]), np.float32)
+    labels = np.asarray(labels, dtype=np.int32)
+    lists = _nearest(vectors, centroids) if len(vectors) else np.empty((0,), np.int32)
+
+    order = np.lexsort((labels, lists))
+    vectors, labels, lists = vectors[order], labels[order], lists[order]
+    offsets = np.searchsorted(lists, np.arange(len(centroids) + 1)).tolist()
+
+    for name, arr in (
+        (CENTROIDS_FILE, centroids.astype(np.float32)),
+        (VECTORS_FILE, vectors),
+        (LISTS_FILE, lists),
+        (LABELS_FILE, labels),
+    ):
+        full = os.path.join(path, name)
+        with open(full + ".tmp", "wb") as f:
+            f.write(np.ascontiguousarray(arr).tobytes())
+        os.replace(full + ".tmp", full)
+
+    _save_meta(path, {
+        "dim": int(centroids.shape[1]),
+        "nlist": int(len(centroids)),
+        "nprobe": int(min(nprobe, len(centroids))),
+        "n_sorted": int(len(labels)),
+        "offsets": offsets,
+        "cats": list(cats),
+        "users": list(users),
+        "devices": list(devices),
+        "removed": [],
+    })
+    return len(labels)
+
+
+def build_index(path, cat_rows, nlist=None, nprobe=DEFAULT_NPROBE, seed=0):
+    """cat_rows = { (user_id, device_id, cat_uid): rows } -> rows written."""
+    cats, users, devices, parts, labels = [], [], [], [], []
+    for (user_id, device_id, cat_uid), rows in cat_rows.items():
+        if len(rows) == 0:
+            continue
+        parts.append(normalize_rows(rows))
+        labels.append(np.full(len(rows), len(cats), dtype=np.int32))
+        cats.append(cat_uid)
+        users.append(user_id)
+        devices.append(device_id)
+    if not parts:
+        raise ValueError("❌ No embeddings to index")
+
+    vectors = np.concatenate(parts)
+    nlist = min(nlist or default_nlist(len(vectors)), len(vectors))
+    centroids = train_centroids(vectors, nlist, seed=seed)
+    return write_index(path, vectors, np.concatenate(labels), cats, users, devices, centroids, nprobe)
+
+
+def compact(path, retrain=False):
+    """Sort the tail in, drop tombstoned rows and cats. Returns rows kept."""
+    with _locked(path):
+        meta = _load_meta(path)
+        vectors = _rows(path, VECTORS_FILE, np.float32, meta["dim"])
+        labels = _rows(path, LABELS_FILE, np.int32)
+        n = min(len(vectors), len(labels))
+
+        removed = np.zeros(len(meta["cats"]), dtype=bool)
+        removed[meta["removed"]] = True
+        keep_cats = np.flatnonzero(~removed)
+        remap = np.full(len(removed), -1, dtype=np.int32)
+        remap[keep_cats] = np.arange(len(keep_cats))
+
+        live = ~removed[np.asarray(labels[:n])]
+        vecs = np.asarray(vectors[:n])[live]
+        labs = remap[np.asarray(labels[:n])[live]]
+        centroids = np.fromfile(os.path.join(path, CENTROIDS_FILE), dtype=np.float32)
+        centroids = centroids.reshape(meta["nlist"], meta["dim"])
+        del vectors, labels
+
+        if retrain and len(vecs):
+            centroids = train_centroids(vecs, min(default_nlist(len(vecs)), len(vecs)))
+        return write_index(
+            path, vecs, labs,
+            [meta["cats"][i] for i in keep_cats],
+            [meta["users"][i] for i in keep_cats],
+            [meta["devices"][i] for i in keep_cats],
+            centroids, meta["nprobe"]
+        )
+
+
+# ---------- incremental updates (no full load) ----------
+def _live_entries(meta, cat_uid, user_id, device_id):
+    """Live entry indices of one (user, device, cat)."""
+    removed = set(meta["removed"])
+    return [
+        i for i, (uid, user, device) in enumerate(zip(meta["cats"], meta["users"], meta["devices"]))
+        if uid == cat_uid and user == user_id and device in (device_id, None) and i not in removed
+    ]
+
+
+def add_rows(path, cat_uid, user_id, device_id, rows, replace=False):
+    """
+    Append rows for a user / device's cat; replace=True tombstones its
+    current rows first. Only the centroids are read. Returns rows written.
+    """
+    if len(rows) == 0:
+        if replace:
+            remove_cat(path, cat_uid, user_id, device_id)
+        return 0
+    rows = normalize_rows(rows)
+    with _locked(path):
+        meta = _load_meta(path)
+        cats = meta["cats"]
+        removed = set(meta["removed"])
+        live = _live_entries(meta, cat_uid, user_id, device_id)
+
+        if rows.shape[1] != meta["dim"]:
+            raise ValueError(f"❌ Embedding dim {rows.shape[1]} != index dim {meta['dim']}")
+        if replace or not live:
+            meta["removed"] = sorted(removed | set(live))
+            cats.append(cat_uid)
+            meta["users"].append(user_id)
+            meta["devices"].append(device_id)
+            label = len(cats) - 1
+            _save_meta(path, meta)   # cat entry first: rows never point past it
+        else:
+            label = live[0]
+
+
+        centroids = np.fromfile(os.path.join(path, CENTROIDS_FILE), dtype=np.float32)
+        lists = _nearest(rows, centroids.reshape(meta["nlist"], meta["dim"]))
+
+        # vectors, lists, then labels: readers only see rows present in all three
+        with open(os.path.join(path, VECTORS_FILE), "ab") as f:
+            f.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+        with open(os.path.join(path, LISTS_FILE), "ab") as f:
+            f.write(lists.tobytes())
+        with open(os.path.join(path, LABELS_FILE), "ab") as f:
+            f.write(np.full(len(rows), label, dtype=np.int32).tobytes())
+        return len(rows)
+
+
+def remove_cat(path, cat_uid, user_id, device_id):
+    """Tombstone every row of a user / device's cat. Returns True if it was indexed."""
+    with _locked(path):
+        meta = _load_meta(path)
+        live = _live_entries(meta, cat_uid, user_id, device_id)
+        if live:
+            meta["removed"] = sorted(set(meta["removed"]) | set(live))
+            _save_meta(path, meta)
+        return bool(live)
+
+
+# ---------- register_cat hooks ----------
+def index_dir_for(root):
+    """(ann dir, user_id, device_id) for a data root (next to catalog.db)."""
+    from catalog import scope_for
+    catalog_path, user_id, device_id = scope_for(root)
+    return os.path.join(os.path.dirname(catalog_path), ANN_DIR), user_id, device_id
+
+
+def on_cat_changed(root, cat_uid, rows=None, replace=True):
+    """Keep an existing index in step with a bank change (no-op without one)."""
+    path, user_id, device_id = index_dir_for(root)
+    if not has_index(path):
+        return 0
+    if rows is None:
+        remove_cat(path, cat_uid, user_id, device_id)
+        return 0
+    return add_rows(path, cat_uid, user_id, device_id, rows, replace=replace)
+
+
+# ---------- search ----------
+class IVFIndex:
+    """Read-only IVF view with the CatMatcher identify / top_k interface."""
+
+    def __init__(self, path, nprobe=None):
+        meta = _load_meta(path)
+        self.path = path
+        self.dim = meta["dim"]
+        self.nlist = meta["nlist"]
+        self.nprobe = int(nprobe or meta.get("nprobe", DEFAULT_NPROBE))
+        self.centroids = np.fromfile(
+            os.path.join(path, CENTROIDS_FILE), dtype=np.float32
+        ).reshape(self.nlist, self.dim)
+
+        vectors = _rows(path, VECTORS_FILE, np.float32, self.dim)
+        lists = _rows(path, LISTS_FILE, np.int32)
+        labels = _rows(path, LABELS_FILE, np.int32)
+        n = min(len(vectors), len(lists), len(labels))
+
+        self.cats = meta["cats"]
+        self.users = meta["users"]
+        self._users = np.asarray(self.users, dtype=object)
+        self.removed = np.zeros(len(self.cats), dtype=bool)
+        self.removed[meta["removed"]] = True
+        self.cat_uids = [uid for i, uid in enumerate(self.cats) if not self.removed[i]]
+
+        # sorted part: one memmap slice per list, one run per (list, cat)
+        ns = min(meta["n_sorted"], n)
+        self.vectors = vectors[:ns]
+        self.offsets = np.minimum(np.asarray(meta["offsets"], dtype=np.int64), ns)
+        lab = np.asarray(labels[:ns])
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(lab)) + 1, self.offsets[:-1]])
+        self.run_starts = np.unique(starts[starts < ns]).astype(np.int64)
+        self.run_labels = lab[self.run_starts] if ns else np.empty((0,), np.int32)
+        self.list_runs = np.searchsorted(self.run_starts, self.offsets)
+
+        # tail: appended since the last compaction, scanned exhaustively
+        self.tail_vectors = np.asarray(vectors[ns:n])
+        self.tail_labels = np.asarray(labels[ns:n])
+        self.n_rows = n
+        self.n_dead = int(self.removed[np.asarray(labels[:n])].sum()) if n else 0
+
+    def __len__(self):
+        return len(self.cat_uids)
+
+    def needs_compaction(self):
+        return self.n_rows and (
+            len(self.tail_labels) + self.n_dead > COMPACT_TAIL * self.n_rows
+        )
+
+    def user_of(self, cat_uid):
+        for i in range(len(self.cats) - 1, -1, -1):
+            if self.cats[i] == cat_uid and not self.removed[i]:
+                return self.users[i]
+        return None
+
+    def _searchable(self, user_id=None):
+        """Bool mask over cat labels: not removed (and owned by `user_id`)."""
+        if user_id is None:
+            return ~self.removed
+        return ~self.removed & (self._users == user_id)
+
+    def _candidates(self, q, nprobe, user_id=None):
+        """Per query: (cat labels, per-cat max score) over the probed lists + tail."""
+        nprobe = max(1, min(nprobe, self.nlist))
+        searchable = self._searchable(user_id)
+        labs = [[] for _ in range(len(q))]
+        scores = [[] for _ in range(len(q))]
+
+        if len(self.vectors):
+            coarse = q @ self.centroids.T
+            if nprobe < self.nlist:
+                probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+            else:
+                probes = np.broadcast_to(np.arange(self.nlist), coarse.shape)
+
+            for lst in np.unique(probes):
+                s, e = self.offsets[lst], self.offsets[lst + 1]
+                if s == e:
+                    continue
+                qi = np.flatnonzero((probes == lst).any(axis=1))
+                sims = q[qi] @ self.vectors[s:e].T
+                r0, r1 = self.list_runs[lst], self.list_runs[lst + 1]
+                per_run = np.maximum.reduceat(sims, self.run_starts[r0:r1] - s, axis=1)
+                run_labs = self.run_labels[r0:r1]
+                live = searchable[run_labs]
+                for row, qq in enumerate(qi):
+                    labs[qq].append(run_labs[live])
+                    scores[qq].append(per_run[row, live])
+
+        if len(self.tail_labels):
+            live = searchable[self.tail_labels]
+            sims = q @ self.tail_vectors[live].T
+            for qq in range(len(q)):
+                labs[qq].append(self.tail_labels[live])
+                scores[qq].append(sims[qq])
+
+        return labs, scores
+
+    def top_k_batch(self, queries, k=3, nprobe=None, user_id=None):
+        """
+        Return [[(cat_uid, score), ...], ...] best-first, k per query.
+        user_id: only that user's cats are candidates (None = every user)
+        """
+        q = normalize_rows(queries)
+        labs, scores = self._candidates(q, nprobe or self.nprobe, user_id)
+        results = []
+        for ls, ss in zip(labs, scores):
+            if not ls:
+                results.append([])
+                continue
+            ls, ss = np.concatenate(ls), np.concatenate(ss)
+            order = np.argsort(-ss, kind="stable")
+            # first occurrence of each cat in score order = its max
+            _, first = np.unique(ls[order], return_index=True)
+            best = order[np.sort(first)][:k]
+            results.append([(self.cats[ls[i]], float(ss[i])) for i in best])
+        return results
+
+    def top_k(self, query_emb, k=3, user_id=None):
+        return self.top_k_batch(query_emb, k, user_id=user_id)[0]
+
+    def identify_batch(self, queries, threshold=IDENTITY_THRESHOLD, nprobe=None, user_id=None):
+        """Return [(cat_uid or None, score), ...], one per query."""
+        results = []
+        for top in self.top_k_batch(queries, 1, nprobe, user_id):
+            score = max(top[0][1], 0.0) if top else 0.0
+            if top and score > 0.0 and score >= threshold:
+                results.append((top[0][0], score))
+            else:
+                results.append((None, score))
+        return results
+
+    def identify(self, query_emb, threshold=IDENTITY_THRESHOLD, user_id=None):
+        return self.identify_batch(query_emb, threshold, user_id=user_id)[0]
+
+    # ---------- exact reference / tuning ----------
+    def exact_matcher(self):
+        """CatMatcher over every live row (the exhaustive scan)."""
+        rows, labels = [], []
+        for vecs, labs in ((self.vectors, self.run_labels_per_row()), (self.tail_vectors, self.tail_labels)):
+            live = ~self.removed[labs]
+            rows.append(np.asarray(vecs)[live])
+            labels.append(labs[live])
+        return CatMatcher(np.concatenate(rows), np.concatenate(labels), self.cats)
+
+    def run_labels_per_row(self):
+        counts = np.diff(np.append(self.run_starts, len(self.vectors)))
+        return np.repeat(self.run_labels, counts)
+
+    def tune(self, queries, target=0.99, exact=None):
+        """Smallest nprobe with recall@1 >= target vs. the exact scan."""
+        exact = exact or self.exact_matcher()
+        truth = exact.top_k_batch(queries, 1)
+        nprobe = 1
+        while True:
+            recall = recall_at_1(self.top_k_batch(queries, 1, nprobe), truth)
+            if recall >= target or nprobe >= self.nlist:
+                return nprobe, recall
+            nprobe = min(nprobe * 2, self.nlist)
+
+    def save_nprobe(self, nprobe):
+        with _locked(self.path):
+            meta = _load_meta(self.path)
+            meta["nprobe"] = int(nprobe)
+            _save_meta(self.path, meta)
+        self.nprobe = int(nprobe)
+
+
+def recall_at_1(got, truth, eps=1e-5):
+    """
+    Fraction of queries whose top cat matches the exact scan; a different
+    cat with the same best score (the same photo under two cats) counts.
+    """
+    hits = [
+        bool(t) and bool(g) and (g[0][0] == t[0][0] or g[0][1] >= t[0][1] - eps)
+        for g, t in zip(got, truth)
+    ]
+    return float(np.mean(hits)) if hits else 1.0
+
+
+def load_index(path, nprobe=None):
+    """Open the index, compacting it first when the tail grew too large."""
+    index = IVFIndex(path, nprobe)
+    if index.needs_compaction():
+        compact(path)
+        index = IVFIndex(path, nprobe)
+    return index
+
+
+# ---------- CLI helpers ----------
+def collect_banks(base):
+    """{ (user_id, device_id, cat_uid): rows } from every user / device bank under base."""
+    cat_rows = {}
+    for user_id in sorted(os.listdir(base)):
+        user_root = os.path.join(base, user_id)
+        roots = [("", user_root)]
+        devices_dir = os.path.join(user_root, "devices")
+        if os.path.isdir(devices_dir):
+            roots += [(d, os.path.join(devices_dir, d)) for d in sorted(os.listdir(devices_dir))]
+        for device_id, root in roots:
+            bank = open_bank(root)
+            if bank is None:
+                continue
+            for cat_uid, rows in bank.to_dict().items():
+                cat_rows[(user_id, device_id, cat_uid)] = np.asarray(rows)
+    return cat_rows
+
+
+def synthetic_bank(n_cats, per_cat, dim=EMB_DIM, spread=1.0, seed=0):
+    """Cats as noisy clusters on the sphere (non-negative, like ReLU features)."""
+    rng = np.random.default_rng(seed)
+    centres = np.abs(rng.standard_normal((n_cats, dim), dtype=np.float32))
+    centres = normalize_rows(centres - centres.mean(axis=0))
+    cat_rows = {}
+    for i in range(n_cats):
+        noise = rng.standard_normal((per_cat, dim), dtype=np.float32) * (spread / np.sqrt(dim))
+        cat_rows[(f"user{i // 3:05d}", "", f"cat{i:06d}")] = normalize_rows(centres[i] + noise)
+    return cat_rows, centres
+
+
+def _queries(cat_rows, n, spread, seed=1):
+    rng = np.random.default_rng(seed)
+    groups = list(cat_rows.values())
+    picks = rng.choice(len(groups), size=n)
+    q = np.stack([groups[i][rng.integers(len(groups[i]))] for i in picks])
+    noise = rng.standard_normal(q.shape, dtype=np.float32) * (spread / np.sqrt(q.shape[1]))
+    return normalize_rows(q + noise)
+
+
+def bench(index, queries, nprobes, batch=32):
+    exact = index.exact_matcher()
+    t0 = time.perf_counter()
+    truth = []
+    for s in range(0, len(queries), batch):
+        truth += exact.top_k_batch(queries[s:s + batch], 1)
+    exact_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+    print(f"{'exact scan':>12s} | recall@1 1.000 | {exact_ms:7.3f} ms/query")
+
+    for nprobe in nprobes:
+        t0 = time.perf_counter()
+        got = []
+        for s in range(0, len(queries), batch):
+            got += index.top_k_batch(queries[s:s + batch], 1, nprobe)
+        ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        recall = recall_at_1(got, truth)
+        print(f"{f'nprobe={nprobe}':>12s} | recall@1 {recall:.3f} | {ms:7.3f} ms/query "
+              f"({exact_ms / ms:.1f}x)")
+
+
+# ---------- CLI ----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IVF index over every user's cat bank")
+    parser.add_argument("command", choices=["build", "compact", "tune", "bench", "stats"])
+    parser.add_argument("--base", default="cat_db/users", help="Base DB directory")
+    parser.add_argument("--index", help="Index directory (default: <base>/../ann)")
+    parser.add_argument("--nlist", type=int, help="Inverted lists (default 4*sqrt(rows))")
+    parser.add_argument("--nprobe", type=int, help="Lists scanned per query")
+    parser.add_argument("--target", type=float, default=0.99, help="tune: recall@1 to reach")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=1.0, help="Query noise (tune/bench)")
+    parser.add_argument("--retrain", action="store_true", help="compact: re-run k-means")
+    parser.add_argument("--cats", type=int, help="bench: synthetic gallery with this many cats")
+    parser.add_argument("--per-cat", type=int, default=8)
+    parser.add_argument("--spread", type=float, default=1.0, help="bench: within-cat noise")
+    args = parser.parse_args()
+
+    path = args.index or os.path.join(os.path.dirname(os.path.normpath(args.base)), ANN_DIR)
+
+    if args.command == "build":
+        n = build_index(path, collect_banks(args.base), args.nlist, args.nprobe or DEFAULT_NPROBE)
+        print(f"✅ Indexed {n} rows -> {path}")
+    elif args.command == "compact":
+        print(f"✅ Compacted: {compact(path, retrain=args.retrain)} rows")
+    elif args.command == "stats":
+        index = IVFIndex(path)
+        print(f"📦 {path}: cats={len(index)} rows={index.n_rows} nlist={index.nlist} "
+              f"nprobe={index.nprobe} tail={len(index.tail_labels)} dead={index.n_dead}")
+    elif args.command == "tune":
+        index = load_index(path)
+        matcher = index.exact_matcher()
+        cat_rows = {(None, None, uid): matcher.rows_for(uid) for uid in index.cat_uids}
+        queries = _queries(cat_rows, args.queries, args.noise)
+        nprobe, recall = index.tune(queries, args.target, exact=matcher)
+        index.save_nprobe(nprobe)
+        print(f"✅ nprobe={nprobe} (recall@1 {recall:.3f}, target {args.target})")
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            if args.cats:
+                cat_rows, _ = synthetic_bank(args.cats, args.per_cat, spread=args.spread)
+                path = tmp
+                t0 = time.perf_counter()
+                build_index(path, cat_rows, args.nlist)
+                print(f"🔧 Built {args.cats} cats x {args.per_cat} in "
+                      f"{time.perf_counter() - t0:.1f}s")
+            index = IVFIndex(path)
+            if not args.cats:
+                matcher = index.exact_matcher()
+                cat_rows = {(None, None, uid): matcher.rows_for(uid) for uid in index.cat_uids}
+            queries = _queries(cat_rows, args.queries, args.noise)
+            nprobes = [p for p in (1, 2, 4, 8, 16, 32, 64) if p <= index.nlist]
+            print(f"📊 {len(index)} cats, {index.n_rows} rows, nlist={index.nlist}, "
+                  f"{len(queries)} queries")
+            bench(index, queries, [args.nprobe] if args.nprobe else nprobes)
+            del index
@@ -0,0 +1,183 @@
+# bank_watch.py
+import os
+import hashlib
+import threading
+import numpy as np
+
+from cat_bank import BANK_DIR, CATS_FILE, VECTORS_FILE, LABELS_FILE, load_user_bank, normalize_rows
+from identify_cat import CatMatcher
+
+# Hot reload of a user's cat bank while main.py runs.
+# A background thread polls the bank files of the device and user roots
+# every `interval` seconds. When their size/mtime changed and then stayed
+# the same for one more poll (register_cat writes remove + append),
+# cats.json is re-read and its per-cat generations compared with the ones
+# in use; only the rows of changed cats are read, and a new CatMatcher is
+# built with just those cats replaced. Banks written before generations
+# existed fall back to a digest of each cat's rows.
+# `watcher.matcher` is swapped in one assignment: the frame loop and the
+# identify workers never wait for a reload, they just pick up the new
+# matcher on their next batch.
+
+BANK_POLL_INTERVAL = 2.0
+WATCHED_FILES = (
+    os.path.join(BANK_DIR, CATS_FILE),
+    os.path.join(BANK_DIR, VECTORS_FILE),
+    os.path.join(BANK_DIR, LABELS_FILE),
+)
+
+
+def bank_signature(roots):
+    """(mtime, size) of every watched bank file under `roots` (None if missing)."""
+    sig = []
+    for root in roots:
+        for name in WATCHED_FILES:
+            try:
+                st = os.stat(os.path.join(root, name))
+                sig.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                sig.append(None)
+    return tuple(sig)
+
+
+def bank_roots(base_db, user_id, device_id=None):
+    """Roots load_user_bank searches: device first, then the user root."""
+    roots = [os.path.join(base_db, user_id)]
+    if device_id:
+        roots.insert(0, os.path.join(base_db, user_id, "devices", device_id))
+    return roots
+
+
+def _digest(rows):
+    return hashlib.blake2b(np.ascontiguousarray(rows).tobytes(), digest_size=16).hexdigest()
+
+
+class BankChanges:
+    """What a reload changed: cat UIDs added / removed / with new rows."""
+
+    def __init__(self, added=(), removed=(), replaced=()):
+        self.added = sorted(added)
+        self.removed = sorted(removed)
+        self.replaced = sorted(replaced)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.replaced)
+
+    def __str__(self):
+        return f"+{len(self.added)} cats, -{len(self.removed)} cats, ~{len(self.replaced)} cats"
+
+
+class BankWatcher:
+    def __init__(self, base_db, user_id, device_id=None, matcher=None,
+                 interval=BANK_POLL_INTERVAL, on_reload=None):
+        """
+        matcher  : the CatMatcher loaded at startup (or None)
+        on_reload: callback(changes, new_matcher), called on the watcher
+                   thread after the swap
+        """
+        self.base_db = base_db
+        self.user_id = user_id
+        self.device_id = device_id
+        self.interval = interval
+        self.on_reload = on_reload
+
+        self.matcher = matcher
+        self._digests = self._cat_digests(matcher)
+        self.reloads = 0
+        self.errors = 0
+
+        self._roots = bank_roots(base_db, user_id, device_id)
+        self._signature = self._stat()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bank_watch", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=2)
+
+    # ---------- change detection ----------
+    def _stat(self):
+        return bank_signature(self._roots)
+
+    @staticmethod
+    def _cat_digests(matcher):
+        """{ cat_uid: bank generation, or a digest of its rows without one }"""
+        if matcher is None:
+            return {}
+        return {
+            uid: matcher.gens.get(uid) or _digest(matcher.rows_for(uid))
+            for uid in matcher.cat_uids
+        }
+
+    def _run(self):
+        pending = False
+        while not self._stop.wait(self.interval):
+            sig = self._stat()
+            if sig != self._signature:
+                # still being written: wait until it holds still for a poll
+                self._signature = sig
+                pending = True
+                continue
+            if pending:
+                pending = False
+                self.reload()
+
+    # ---------- reload ----------
+    def reload(self):
+        """Re-read the bank and swap in a matcher if any cat changed."""
+        old_digests = self._digests
+        try:
+            bank = load_user_bank(self.base_db, self.user_id, self.device_id)
+            new_rows, new_digests = {}, {}
+            for uid in (bank.cat_uids if bank is not None else ()):
+                gen = bank.gens.get(uid)
+                if gen is not None and old_digests.get(uid) == gen:
+                    new_digests[uid] = gen      # unchanged: rows not read
+                    continue
+                rows = bank.embeddings_for(uid)
+                if len(rows) == 0:
+                    continue
+                # without a generation: digest what CatMatcher would hold
+                # (normalised rows), so an unchanged cat compares equal
+                new_rows[uid] = rows
+                new_digests[uid] = gen or _digest(normalize_rows(rows))
+            del bank  # release the memmap (register_cat replaces the files)
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Bank reload failed, keeping the current one: {e}")
+            return None
+
+        changes = BankChanges(
+            added=new_digests.keys() - old_digests.keys(),
+            removed=old_digests.keys() - new_digests.keys(),
+            replaced=[
+                uid for uid in new_digests.keys() & old_digests.keys()
+                if new_digests[uid] != old_digests[uid]
+            ]
+        )
+        if not changes:
+            return changes
+
+        changed = {uid: new_rows[uid] for uid in changes.added + changes.replaced}
+        if self.matcher is None:
+            matcher = CatMatcher.from_dict(changed)
+        else:
+            matcher = self.matcher.updated(removed=changes.removed, added=changed)
+
+        self.matcher = matcher          # atomic swap
+        self._digests = new_digests
+        self.reloads += 1
+
+        if self.on_reload is not None:
+            self.on_reload(changes, matcher)
+        return changes
+
+    def stats(self):
+        n = len(self.matcher) if self.matcher is not None else 0
+        return f"cats={n} reloads={self.reloads} errors={self.errors}"
@@ -0,0 +1,124 @@
+# bench_stride.py
+import time
+import argparse
+import cv2
+from deep_sort_realtime.deepsort_tracker import DeepSort
+
+from embeddings import get_embedding_batch
+from detector import detect_cats, load_yolo
+from detect_stride import DetectionClock, StrideController, TRACK_MAX_AGE, parse_stride
+
+# Throughput vs. ID switches for each detection stride, on recorded footage.
+# Every frame is processed (no dropping) on one thread, so runs are
+# repeatable. Stride 1 is the reference: each other run's confirmed boxes
+# are matched to it by IoU, and an ID switch is counted whenever a
+# reference track is matched to a different track id than before.
+#
+# python bench_stride.py --video bowl.mp4 --strides 1 2 3 4 auto
+
+MODEL_PATH = "yolov8n.pt"
+IOU_MATCH = 0.5
+
+
+def run(video, model, controller, max_frames):
+    """Return (fps, [ {track_id: (l, t, r, b)} per frame ])."""
+    cap = cv2.VideoCapture(video)
+    if not cap.isOpened():
+        raise RuntimeError(f"❌ Cannot open video: {video}")
+
+    # same tracker + detection clock as main.py, so strides compare as shipped
+    tracker = DeepSort(max_age=TRACK_MAX_AGE, embedder=None)
+    clock = DetectionClock(tracker)
+    frames = []
+    t0 = time.perf_counter()
+
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+
+        if controller.should_detect():
+            detections = detect_cats(model, frame)
+            embs = get_embedding_batch(
+                [frame[y:y + h, x:x + w] for (x, y, w, h), _, _ in detections],
+                bgr=True
+            )
+            clock.before_update()
+            tracks = tracker.update_tracks(detections, embeds=list(embs))
+            controller.update(tracks)
+        else:
+            tracks = clock.predict()
+
+        frames.append({
+            track.track_id: tuple(track.to_ltrb())
+            for track in tracks
+            if track.is_confirmed()
+        })
+
+    elapsed = time.perf_counter() - t0
+    cap.release()
+    return len(frames) / elapsed if elapsed > 0 else 0.0, frames
+
+
+def iou(a, b):
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def id_switches(reference, frames):
+    """Return (id switches, fraction of reference boxes matched)."""
+    last_match = {}
+    switches = matched = total = 0
+
+    for ref, test in zip(reference, frames):
+        pairs = sorted(
+            ((iou(rb, tb), rid, tid) for rid, rb in ref.items() for tid, tb in test.items()),
+            reverse=True
+        )
+        used_ref, used_test = set(), set()
+        for score, rid, tid in pairs:
+            if score < IOU_MATCH:
+                break
+            if rid in used_ref or tid in used_test:
+                continue
+            used_ref.add(rid)
+            used_test.add(tid)
+            if rid in last_match and last_match[rid] != tid:
+                switches += 1
+            last_match[rid] = tid
+
+        matched += len(used_ref)
+        total += len(ref)
+
+    return switches, (matched / total if total else 1.0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark detection stride settings")
+    parser.add_argument("--video", required=True, help="Recorded bowl footage")
+    parser.add_argument("--strides", nargs="+", type=parse_stride, default=[1, 2, 3, 4, "auto"])
+    parser.add_argument("--max-frames", type=int, default=900)
+    args = parser.parse_args()
+
+    model = load_yolo(MODEL_PATH)
+    strides = [1] + [s for s in args.strides if s != 1]
+
+    results = {}
+    for s in strides:
+        controller = StrideController() if s == "auto" else StrideController(fixed=s)
+        fps, frames = run(args.video, model, controller, args.max_frames)
+        results[s] = (fps, frames, controller.stats())
+        print(f"⏱️ stride={s}: {fps:.1f} fps ({controller.stats()})")
+
+    reference = results[1][1]
+    print("\n" + "=" * 60)
+    print(f"{'stride':>8} | {'fps':>7} | {'speedup':>7} | {'id_sw':>5} | {'coverage':>8}")
+    print("=" * 60)
+    for s in strides:
+        fps, frames, _ = results[s]
+        switches, coverage = id_switches(reference, frames)
+        speedup = fps / results[1][0] if results[1][0] else 0.0
+        print(f"{s:>8} | {fps:7.1f} | {speedup:6.2f}x | {switches:5d} | {coverage:7.1%}")
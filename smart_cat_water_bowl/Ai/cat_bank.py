@@ -0,0 +1,473 @@
+# cat_bank.py
+import os
+import json
+import time
+import shutil
+import argparse
+import functools
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+# Packed embedding bank (one per user/device)
+# {device_db}/
+#   bank/
+#     vectors.f32   # raw float32 rows, L2-normalised, shape (N, dim)
+#     labels.i32    # raw int32 rows, row -> index into cats.json["cats"]
+#     cats.json     # {"dim": 1280, "cats": [cat_uid, ...], "gens": {cat_uid: token}}
+#
+# gens: a fresh random token every time a cat's rows change, so readers
+# (bank_watch) can tell which cats changed without reading any rows.
+#
+# Rows are only ever appended; removing or replacing a cat rewrites
+# (compacts) the bank in one pass: a complete bank.new/ is written next to
+# bank/ and swapped in, so a crash leaves either the old or the new bank.
+# The reader trusts min(len(vectors), len(labels)) so a torn append is ignored.
+# Writers (register_cat, update_cat, sync_from_storage, possibly in other
+# processes) serialise on {root}/bank.lock: every write reads cats.json /
+# the rows and swaps in a new version, so two at once would lose one.
+
+BANK_DIR = "bank"
+VECTORS_FILE = "vectors.f32"
+LABELS_FILE = "labels.i32"
+CATS_FILE = "cats.json"
+EMB_DIM = 1280
+BANK_LOCK = "bank.lock"  # next to bank/ (bank/ itself is swapped out)
+REWRITE_CHUNK = 65536   # rows copied per step when compacting
+
+
+# ---------- utils ----------
+def bank_dir(root):
+    return os.path.join(root, BANK_DIR)
+
+
+def has_bank(root):
+    return os.path.exists(os.path.join(_live_dir(root), CATS_FILE))
+
+
+@contextmanager
+def file_lock(lock, timeout=30.0, stale=120.0):
+    """Cross-process writer lock (O_EXCL lock file; works on Windows too)."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.close(fd)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock) > stale:
+                    os.remove(lock)  # left behind by a crashed writer
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"❌ {lock} is held by another writer")
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.remove(lock)
+
+
+_held = threading.local()   # roots whose bank lock this thread holds
+
+
+@contextmanager
+def bank_lock(root):
+    """Hold {root}/bank.lock; re-entrant within a thread."""
+    key = os.path.abspath(root)
+    held = _held.__dict__.setdefault("roots", set())
+    if key in held:
+        yield
+        return
+    os.makedirs(root, exist_ok=True)
+    with file_lock(os.path.join(root, BANK_LOCK)):
+        held.add(key)
+        try:
+            yield
+        finally:
+            held.discard(key)
+
+
+def _writes_bank(fn):
+    """Run a bank writer `fn(root, ...)` under the root's bank lock."""
+    @functools.wraps(fn)
+    def locked(root, *args, **kwargs):
+        with bank_lock(root):
+            return fn(root, *args, **kwargs)
+    return locked
+
+
+def normalize_rows(embs):
+    embs = np.asarray(embs, dtype=np.float32)
+    if embs.ndim == 1:
+        embs = embs[None, :]
+    norms = np.linalg.norm(embs, axis=1, keepdims=True)
+    return embs / np.maximum(norms, 1e-12)
+
+
+def _load_cats(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _new_gen():
+    return os.urandom(8).hex()
+
+
+def _save_cats(path, cats_meta):
+    # write + rename so readers never see a half-written file
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cats_meta, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _open_rows(path, dtype, width):
+    """Memory-map a raw row file. Returns (rows, n_rows)."""
+    itemsize = np.dtype(dtype).itemsize * width
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    n = size // itemsize
+    if n == 0:
+        return None, 0
+    shape = (n, width) if width > 1 else (n,)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape), n
+
+
+# ---------- bank ----------
+class CatBank:
+    """Read-only view over a packed bank.
+
+    vectors  : (N, dim) float32, L2-normalised (memory-mapped)
+    labels   : (N,) int32, row -> index into cat_uids
+    cat_uids : list of cat UIDs in registration order
+    gens     : { cat_uid: generation token } (empty for older banks)
+    """
+
+    def __init__(self, vectors, labels, cat_uids, gens=None):
+        self.vectors = vectors
+        self.labels = labels
+        self.cat_uids = list(cat_uids)
+        self.gens = dict(gens or {})
+
+    def __len__(self):
+        return len(self.labels)
+
+    def counts(self):
+        counts = np.bincount(self.labels, minlength=len(self.cat_uids))
+        return {uid: int(c) for uid, c in zip(self.cat_uids, counts) if c}
+
+    def embeddings_for(self, cat_uid):
+        if cat_uid not in self.cat_uids:
+            return np.empty((0, self.vectors.shape[1]), dtype=np.float32)
+        idx = self.cat_uids.index(cat_uid)
+        return np.asarray(self.vectors[self.labels == idx])
+
+    def to_dict(self):
+        """Return { cat_uid: (n, dim) array } for cats that have rows."""
+        present = set(np.unique(self.labels).tolist())
+        return {
+            uid: self.embeddings_for(uid)
+            for i, uid in enumerate(self.cat_uids)
+            if i in present
+        }
+
+
+def open_bank(root):
+    """Open the bank under `root` with np.memmap. Returns None if missing."""
+    bdir = _live_dir(root)
+    cats_path = os.path.join(bdir, CATS_FILE)
+    if not os.path.exists(cats_path):
+        return None
+
+    cats_meta = _load_cats(cats_path)
+    dim = int(cats_meta.get("dim", EMB_DIM))
+    cat_uids = cats_meta.get("cats", [])
+
+    vectors, nv = _open_rows(os.path.join(bdir, VECTORS_FILE), np.float32, dim)
+    labels, nl = _open_rows(os.path.join(bdir, LABELS_FILE), np.int32, 1)
+
+    n = min(nv, nl)
+    if n == 0:
+        vectors = np.empty((0, dim), dtype=np.float32)
+        labels = np.empty((0,), dtype=np.int32)
+    else:
+        vectors, labels = vectors[:n], labels[:n]
+
+    return CatBank(vectors, labels, cat_uids, cats_meta.get("gens"))
+
+
+@_writes_bank
+def append_embeddings(root, cat_uid, embs):
+    """Append L2-normalised embeddings for `cat_uid`. Returns rows written."""
+    rows = normalize_rows(embs)
+    if len(rows) == 0:
+        return 0
+
+    _finish_swap(root)
+    bdir = bank_dir(root)
+    os.makedirs(bdir, exist_ok=True)
+    cats_path = os.path.join(bdir, CATS_FILE)
+
+    if os.path.exists(cats_path):
+        cats_meta = _load_cats(cats_path)
+    else:
+        cats_meta = {"dim": rows.shape[1], "cats": []}
+
+    if rows.shape[1] != cats_meta["dim"]:
+        raise ValueError(
+            f"❌ Embedding dim {rows.shape[1]} != bank dim {cats_meta['dim']}"
+        )
+
+    cats = cats_meta["cats"]
+    if cat_uid not in cats:
+        cats.append(cat_uid)
+        _save_cats(cats_path, cats_meta)
+    label = cats.index(cat_uid)
+
+    # vectors first, labels second: readers only see rows present in both
+    with open(os.path.join(bdir, VECTORS_FILE), "ab") as f:
+        f.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+    with open(os.path.join(bdir, LABELS_FILE), "ab") as f:
+        f.write(np.full(len(rows), label, dtype=np.int32).tobytes())
+
+    # after the rows: a reader that sees the new generation sees them too
+    cats_meta.setdefault("gens", {})[cat_uid] = _new_gen()
+    _save_cats(cats_path, cats_meta)
+    return len(rows)
+
+
+# ---------- rewrites ----------
+def _live_dir(root):
+    """bank/, or the complete bank.new/ while a swap is between its renames."""
+    bdir = bank_dir(root)
+    if not os.path.exists(bdir) and os.path.exists(os.path.join(bdir + ".new", CATS_FILE)):
+        return bdir + ".new"
+    return bdir
+
+
+def _finish_swap(root):
+    """Writers: complete a swap a crash interrupted (readers use _live_dir)."""
+    bdir = bank_dir(root)
+    if _live_dir(root) != bdir:
+        os.replace(bdir + ".new", bdir)
+
+
+def _swap_in(root, chunks, cats_meta):
+    """
+    Write a whole bank into bank.new/ and swap it in for bank/.
+    chunks: iterable of (vectors, labels) row blocks, in order
+    return: rows written
+    """
+    _finish_swap(root)
+    bdir = bank_dir(root)
+    new_dir, old_dir = bdir + ".new", bdir + ".old"
+    for stale in (new_dir, old_dir):
+        if os.path.exists(stale):
+            shutil.rmtree(stale)
+    os.makedirs(new_dir)
+
+    n = 0
+    with open(os.path.join(new_dir, VECTORS_FILE), "wb") as fv, \
+            open(os.path.join(new_dir, LABELS_FILE), "wb") as fl:
+        for vectors, labels in chunks:
+            fv.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            fl.write(np.ascontiguousarray(labels, dtype=np.int32).tobytes())
+            n += len(labels)
+    with open(os.path.join(new_dir, CATS_FILE), "w", encoding="utf-8") as f:
+        json.dump(cats_meta, f, ensure_ascii=False)
+
+    if os.path.exists(bdir):
+        os.replace(bdir, old_dir)
+    os.replace(new_dir, bdir)   # a crash before this: _finish_swap() redoes it
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return n
+
+
+@_writes_bank
+def write_bank(root, cat_embeddings, dim=EMB_DIM):
+    """(Re)write the whole bank from { cat_uid: [emb, ...] }."""
+    cats, chunks = [], []
+    for cat_uid, embs in cat_embeddings.items():
+        rows = normalize_rows(embs) if len(embs) else None
+        if rows is None or len(rows) == 0:
+            continue
+        dim = rows.shape[1]
+        chunks.append((rows, np.full(len(rows), len(cats), dtype=np.int32)))
+        cats.append(cat_uid)
+
+    gens = {cat_uid: _new_gen() for cat_uid in cats}
+    return _swap_in(root, chunks, {"dim": int(dim), "cats": cats, "gens": gens})
+
+
+@_writes_bank
+def _rewrite_cat(root, cat_uid, rows):
+    """
+    One compacting pass: every row except `cat_uid`'s, then `rows` for it
+    (None = drop the cat).
+    return: (rows removed, rows written for the cat)
+    """
+    bank = open_bank(root)
+    if bank is None or (cat_uid not in bank.cat_uids and rows is None):
+        return 0, 0
+
+    cats = list(bank.cat_uids)
+    dim = bank.vectors.shape[1]
+    if rows is not None and rows.shape[1] != dim:
+        raise ValueError(f"❌ Embedding dim {rows.shape[1]} != bank dim {dim}")
+
+    old = cats.index(cat_uid) if cat_uid in cats else -1
+    if rows is None:
+        cats.pop(old)
+        label = -1
+    else:
+        if old < 0:
+            cats.append(cat_uid)
+        label = cats.index(cat_uid)
+    removed = int(np.count_nonzero(bank.labels == old)) if old >= 0 else 0
+    gens = {uid: bank.gens[uid] for uid in cats if uid in bank.gens}
+    if rows is None:
+        gens.pop(cat_uid, None)
+    else:
+        gens[cat_uid] = _new_gen()
+
+    def chunks():
+        for s in range(0, len(bank), REWRITE_CHUNK):
+            labels = np.asarray(bank.labels[s:s + REWRITE_CHUNK])
+            keep = labels != old
+            if rows is None:
+                labels = labels - (labels > old)   # the cat's index is gone
+            yield np.asarray(bank.vectors[s:s + REWRITE_CHUNK])[keep], labels[keep]
+        if rows is not None:
+            yield rows, np.full(len(rows), label, dtype=np.int32)
+
+    _swap_in(root, chunks(), {"dim": int(dim), "cats": cats, "gens": gens})
+    del bank  # release the memmap of the replaced files
+    return removed, 0 if rows is None else len(rows)
+
+
+def remove_cat(root, cat_uid):
+    """Drop every row of `cat_uid` (compacting rewrite)."""
+    return _rewrite_cat(root, cat_uid, None)[0]
+
+
+def replace_cat(root, cat_uid, embs):
+    """Replace all rows of `cat_uid` with `embs` in one rewrite of the bank."""
+    rows = normalize_rows(embs) if len(embs) else None
+    if rows is not None and not has_bank(root):
+        return append_embeddings(root, cat_uid, rows)
+    return _rewrite_cat(root, cat_uid, rows)[1]
+
+
+# ---------- legacy per-file layout ----------
+def _entry_emb_files(entry):
+    if isinstance(entry, dict):
+        return entry.get("embeddings", [])
+    if isinstance(entry, list):
+        return entry
+    return []
+
+
+def load_per_file(root):
+    """Load the old layout: metadata.json -> embeddings/{cat_id}_{n}.npy."""
+    metadata_path = os.path.join(root, "metadata.json")
+    if not os.path.exists(metadata_path):
+        return {}
+
+    with open(metadata_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    cat_embeddings = {}
+    for cat_uid, entry in meta.items():
+        embs = []
+        for fn in _entry_emb_files(entry):
+            # metadata written on Windows stores "embeddings\\x.npy"
+            path = os.path.join(root, *fn.replace("\\", "/").split("/"))
+            if os.path.exists(path):
+                try:
+                    embs.append(np.load(path))
+                except Exception:
+                    continue
+        if embs:
+            cat_embeddings[cat_uid] = embs
+
+    return cat_embeddings
+
+
+def migrate_per_file(root):
+    """One-shot migration of the per-file layout under `root` into a bank.
+
+    The old .npy files are left in place. Returns rows written.
+    """
+    cat_embeddings = load_per_file(root)
+    if not cat_embeddings:
+        return 0
+    return write_bank(root, cat_embeddings)
+
+
+def ensure_bank(root):
+    """Migrate `root` to a bank if it only has per-file embeddings."""
+    if has_bank(root):
+        return
+    with bank_lock(root):
+        if not has_bank(root):   # another writer may have migrated it meanwhile
+            migrate_per_file(root)
+
+
+# ---------- lookup ----------
+def load_user_bank(base_db, user_id, device_id=None):
+    """Find the bank for a user (device scope first, then user root).
+
+    Falls back to the per-file layout when no bank has been written yet.
+    Return: CatBank or None
+    """
+    base_user = os.path.join(base_db, user_id)
+    search_paths = []
+    if device_id:
+        search_paths.append(os.path.join(base_user, "devices", device_id))
+    search_paths.append(base_user)
+
+    for root in search_paths:
+        bank = open_bank(root)
+        if bank is None:
+            legacy = load_per_file(root)
+            if legacy:
+                bank = CatBank(
+                    *_pack(legacy),
+                    cat_uids=list(legacy.keys())
+                )
+        if bank is not None and len(bank) > 0:
+            return bank
+
+    return None
+
+
+def _pack(cat_embeddings):
+    vec_parts, label_parts = [], []
+    for i, embs in enumerate(cat_embeddings.values()):
+        rows = normalize_rows(embs)
+        vec_parts.append(rows)
+        label_parts.append(np.full(len(rows), i, dtype=np.int32))
+    return np.concatenate(vec_parts), np.concatenate(label_parts)
+
+
+# ---------- CLI: one-shot migration ----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate per-file embeddings into a packed bank")
+    parser.add_argument("--base", default="cat_db/users", help="Base DB directory")
+    parser.add_argument("--user", help="Only migrate this user (default: all users)")
+    args = parser.parse_args()
+
+    users = [args.user] if args.user else sorted(os.listdir(args.base))
+    for user_id in users:
+        user_root = os.path.join(args.base, user_id)
+        roots = [user_root]
+        devices_dir = os.path.join(user_root, "devices")
+        if os.path.isdir(devices_dir):
+            roots += [os.path.join(devices_dir, d) for d in sorted(os.listdir(devices_dir))]
+
+        for root in roots:
+            n = migrate_per_file(root)
+            if n:
+                print(f"✅ Migrated {n} embeddings -> {bank_dir(root)}")
@@ -0,0 +1,400 @@
+# catalog.py
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+
+# Transactional cat catalog (replaces rewriting metadata.json on every change)
+# cat_db/
+#   catalog.db        # SQLite, WAL mode, shared by every user/device
+#   users/{user_id}/devices/{device_id}/...
+#
+#   cats   (user_id, device_id, cat_id) -> name, profile, bank_rows
+#   images (user_id, device_id, cat_id, path) -> hash, emb_file
+#
+# Every change is one short BEGIN IMMEDIATE transaction touching only the
+# rows of that cat, so concurrent sync / register / update runs serialise
+# on the database lock instead of overwriting each other's JSON. A scope
+# (user, device) that still has a metadata.json is imported the first
+# time it is opened; `python catalog.py export` writes the old layout back
+# for tools that read metadata.json.
+
+CATALOG_FILE = "catalog.db"
+METADATA_FILE = "metadata.json"
+BUSY_TIMEOUT = 30.0   # seconds a writer waits for the lock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cats (
+    user_id    TEXT NOT NULL,
+    device_id  TEXT NOT NULL,
+    cat_id     TEXT NOT NULL,
+    name       TEXT,
+    profile    TEXT,
+    bank_rows  INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL,
+    PRIMARY KEY (user_id, device_id, cat_id)
+);
+CREATE TABLE IF NOT EXISTS images (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id   TEXT NOT NULL,
+    device_id TEXT NOT NULL,
+    cat_id    TEXT NOT NULL,
+    path      TEXT,              -- NULL: an embedding file without an image, or
+                                 -- (no emb_file) a photo rejected as a near-duplicate
+    hash      TEXT,
+    emb_file  TEXT,
+    UNIQUE (user_id, device_id, cat_id, path),
+    FOREIGN KEY (user_id, device_id, cat_id)
+        REFERENCES cats (user_id, device_id, cat_id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS images_by_hash ON images (user_id, device_id, cat_id, hash);
+CREATE TABLE IF NOT EXISTS imported (
+    user_id     TEXT NOT NULL,
+    device_id   TEXT NOT NULL,
+    source      TEXT,
+    imported_at REAL,
+    PRIMARY KEY (user_id, device_id)
+);
+"""
+
+
+class Catalog:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    # ---------- connection / transactions ----------
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # one connection per thread; transactions are explicit
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction: takes the write lock up front (no upgrade deadlock)."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # ---------- writes ----------
+    def save_cat(self, user_id, device_id, cat_id, name=None, bank_rows=0,
+                 training_images=(), profile=None, image_hashes=None, emb_files=None,
+                 rejected_hashes=()):
+        """Replace a cat's entry and image list.
+
+        rejected_hashes: photos left out as near-duplicates, remembered so
+        has_hash() skips them next time
+        """
+        hashes = list(image_hashes) if image_hashes is not None else []
+        embs = list(emb_files) if emb_files is not None else []
+        with self.transaction() as conn:
+            conn.execute(
+                "DELETE FROM cats WHERE user_id=? AND device_id=? AND cat_id=?",
+                (user_id, device_id, cat_id)
+            )
+            self._insert_cat(conn, user_id, device_id, cat_id, name or cat_id, profile, bank_rows)
+            self._insert_images(conn, user_id, device_id, cat_id, [
+                (path, _at(hashes, i), _at(embs, i))
+                for i, path in enumerate(training_images)
+            ] + [(None, h, None) for h in rejected_hashes])
+
+    def add_images(self, user_id, device_id, cat_id, images, bank_rows=0,
+                   profile=None, name=None):
+        """
+        Append images [(path, hash, emb_file), ...] to a cat (created if
+        missing); bank_rows is added to its count. The profile is only set
+        when the cat has none (or when given for a new cat).
+        """
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT name, profile FROM cats WHERE user_id=? AND device_id=? AND cat_id=?",
+                (user_id, device_id, cat_id)
+            ).fetchone()
+            if row is None:
+                self._insert_cat(conn, user_id, device_id, cat_id, name or cat_id, profile, 0)
+            else:
+                conn.execute(
+                    "UPDATE cats SET name=?, profile=?, updated_at=? "
+                    "WHERE user_id=? AND device_id=? AND cat_id=?",
+                    (name or row["name"], row["profile"] or profile, time.time(),
+                     user_id, device_id, cat_id)
+                )
+            conn.execute(
+                "UPDATE cats SET bank_rows = bank_rows + ? "
+                "WHERE user_id=? AND device_id=? AND cat_id=?",
+                (bank_rows, user_id, device_id, cat_id)
+            )
+            self._insert_images(conn, user_id, device_id, cat_id, images)
+
+    def set_profile(self, user_id, device_id, cat_id, profile):
+        with self.transaction() as conn:
+            cur = conn.execute(
+                "UPDATE cats SET profile=?, updated_at=? "
+                "WHERE user_id=? AND device_id=? AND cat_id=?",
+                (profile, time.time(), user_id, device_id, cat_id)
+            )
+            return cur.rowcount > 0
+
+    def drop_cat(self, user_id, device_id, cat_id):
+        """Delete a cat and its images. Returns True if it existed."""
+        with self.transaction() as conn:
+            cur = conn.execute(
+                "DELETE FROM cats WHERE user_id=? AND device_id=? AND cat_id=?",
+                (user_id, device_id, cat_id)
+            )
+            return cur.rowcount > 0
+
+    @staticmethod
+    def _insert_cat(conn, user_id, device_id, cat_id, name, profile, bank_rows):
+        conn.execute(
+            "INSERT INTO cats (user_id, device_id, cat_id, name, profile, bank_rows, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user_id, device_id, cat_id, name, profile, int(bank_rows), time.time())
+        )
+
+    @staticmethod
+    def _insert_images(conn, user_id, device_id, cat_id, images):
+        conn.executemany(
+            "INSERT OR REPLACE INTO images (user_id, device_id, cat_id, path, hash, emb_file) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(user_id, device_id, cat_id, path, h, emb) for path, h, emb in images]
+        )
+
+    # ---------- reads ----------
+    def get_cat(self, user_id, device_id, cat_id):
+        """The cat in the metadata.json layout, or None."""
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT * FROM cats WHERE user_id=? AND device_id=? AND cat_id=?",
+            (user_id, device_id, cat_id)
+        ).fetchone()
+        if row is None:
+            return None
+        images = conn.execute(
+            "SELECT path, hash, emb_file FROM images "
+            "WHERE user_id=? AND device_id=? AND cat_id=? ORDER BY id",
+            (user_id, device_id, cat_id)
+        ).fetchall()
+        return _entry(row, images)
+
+    def cats(self, user_id, device_id):
+        """{ cat_id: entry } for one scope (the metadata.json layout)."""
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT * FROM cats WHERE user_id=? AND device_id=? ORDER BY updated_at, cat_id",
+            (user_id, device_id)
+        ).fetchall()
+        images = {}
+        for img in conn.execute(
+            "SELECT cat_id, path, hash, emb_file FROM images "
+            "WHERE user_id=? AND device_id=? ORDER BY id",
+            (user_id, device_id)
+        ):
+            images.setdefault(img["cat_id"], []).append(img)
+        return {row["cat_id"]: _entry(row, images.get(row["cat_id"], [])) for row in rows}
+
+    def has_hash(self, user_id, device_id, cat_id, h):
+        row = self._conn().execute(
+            "SELECT 1 FROM images WHERE user_id=? AND device_id=? AND cat_id=? AND hash=? LIMIT 1",
+            (user_id, device_id, cat_id, h)
+        ).fetchone()
+        return row is not None
+
+    def scopes(self):
+        return [
+            (r["user_id"], r["device_id"]) for r in self._conn().execute(
+                "SELECT DISTINCT user_id, device_id FROM cats ORDER BY user_id, device_id"
+            )
+        ]
+
+    # ---------- metadata.json import / export ----------
+    def import_metadata(self, user_id, device_id, path, force=False):
+        """
+        Load an old metadata.json into the scope (once, unless force).
+        Cats already in the catalog are kept. Returns cats imported.
+        """
+        conn = self._conn()
+        done = conn.execute(
+            "SELECT 1 FROM imported WHERE user_id=? AND device_id=?", (user_id, device_id)
+        ).fetchone()
+        if done and not force:
+            return 0
+
+        meta = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+
+        n = 0
+        with self.transaction() as conn:
+            for cat_id, entry in meta.items():
+                exists = conn.execute(
+                    "SELECT 1 FROM cats WHERE user_id=? AND device_id=? AND cat_id=?",
+                    (user_id, device_id, cat_id)
+                ).fetchone()
+                if exists:
+                    continue
+                if isinstance(entry, list):   # oldest layout: [emb files]
+                    entry = {"embeddings": entry}
+                embs = entry.get("embeddings", [])
+                paths = entry.get("training_images", entry.get("images", []))
+                hashes = entry.get("image_hashes", [])
+                self._insert_cat(
+                    conn, user_id, device_id, cat_id, entry.get("name", cat_id),
+                    entry.get("profile"), entry.get("bank_rows", len(embs))
+                )
+                # image i <-> embedding i when both lists were recorded together
+                images = [(p, _at(hashes, i), _at(embs, i)) for i, p in enumerate(paths)]
+                images += [(None, None, e) for e in embs[len(paths):]]
+                images += [(None, h, None) for h in entry.get("rejected_hashes", [])]
+                self._insert_images(conn, user_id, device_id, cat_id, images)
+                n += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO imported (user_id, device_id, source, imported_at) "
+                "VALUES (?, ?, ?, ?)",
+                (user_id, device_id, path, time.time())
+            )
+        return n
+
+    def export_metadata(self, user_id, device_id, path):
+        """Write the scope as metadata.json (atomic). Returns cats written."""
+        meta = self.cats(user_id, device_id)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, path)
+        return len(meta)
+
+
+def _at(items, i):
+    return items[i] if i < len(items) else None
+
+
+def _entry(row, images):
+    entry = {
+        "name": row["name"],
+        "bank_rows": row["bank_rows"],
+        "training_images": [i["path"] for i in images if i["path"] is not None],
+        "profile": row["profile"],
+    }
+    hashes = [i["hash"] for i in images if i["hash"] and i["path"] is not None]
+    if hashes:
+        entry["image_hashes"] = hashes
+    rejected = [i["hash"] for i in images if i["hash"] and i["path"] is None and not i["emb_file"]]
+    if rejected:
+        entry["rejected_hashes"] = rejected
+    emb_files = [i["emb_file"] for i in images if i["emb_file"]]
+    if emb_files:
+        # per-file layout (update_cat / cat_bank.load_per_file)
+        entry["embeddings"] = emb_files
+        entry["images"] = entry["training_images"]
+    return entry
+
+
+# ---------- locating the catalog for a data root ----------
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def scope_for(root):
+    """
+    (catalog path, user_id, device_id) for a data root:
+      .../users/{user}/devices/{device} -> (.../catalog.db, user, device)
+      .../users/{user}                  -> (.../catalog.db, user, "")
+      anything else (e.g. cat_db)       -> (root/catalog.db, "", "")
+    """
+    parts = os.path.normpath(os.path.abspath(root)).split(os.sep)
+    if "users" in parts:
+        i = len(parts) - 1 - parts[::-1].index("users")
+        rest = parts[i + 1:]
+        base = os.sep.join(parts[:i]) or os.sep
+        if len(rest) == 3 and rest[1] == "devices":
+            return os.path.join(base, CATALOG_FILE), rest[0], rest[2]
+        if len(rest) == 1:
+            return os.path.join(base, CATALOG_FILE), rest[0], ""
+    return os.path.join(root, CATALOG_FILE), "", ""
+
+
+def get_catalog(path):
+    """One Catalog per database file per process."""
+    path = os.path.abspath(path)
+    with _catalogs_lock:
+        catalog = _catalogs.get(path)
+        if catalog is None:
+            catalog = _catalogs[path] = Catalog(path)
+        return catalog
+
+
+def catalog_for(root):
+    """(Catalog, user_id, device_id) for a data root; imports its metadata.json once."""
+    path, user_id, device_id = scope_for(root)
+    catalog = get_catalog(path)
+    catalog.import_metadata(user_id, device_id, os.path.join(root, METADATA_FILE))
+    return catalog, user_id, device_id
+
+
+def _roots(base, user=None, device=None):
+    users = [user] if user else sorted(
+        d for d in os.listdir(base) if os.path.isdir(os.path.join(base, d))
+    )
+    for user_id in users:
+        devices_dir = os.path.join(base, user_id, "devices")
+        if device:
+            yield os.path.join(devices_dir, device)
+            continue
+        yield os.path.join(base, user_id)
+        if os.path.isdir(devices_dir):
+            for d in sorted(os.listdir(devices_dir)):
+                yield os.path.join(devices_dir, d)
+
+
+# ---------- CLI ----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cat catalog (SQLite) import / export")
+    parser.add_argument("command", choices=["import", "export", "show"])
+    parser.add_argument("--base", default="cat_db/users", help="Base DB directory")
+    parser.add_argument("--user", help="Only this user (default: all users)")
+    parser.add_argument("--device", help="Only this device")
+    parser.add_argument("--force", action="store_true", help="Re-import scopes imported before")
+    args = parser.parse_args()
+
+    for root in _roots(args.base, args.user, args.device):
+        path, user_id, device_id = scope_for(root)
+        catalog = get_catalog(path)
+        meta_path = os.path.join(root, METADATA_FILE)
+        scope = f"USER={user_id} DEVICE={device_id or '-'}"
+
+        if args.command == "import":
+            n = catalog.import_metadata(user_id, device_id, meta_path, force=args.force)
+            print(f"✅ Imported {n} cats {scope}")
+        elif args.command == "export":
+            if catalog.cats(user_id, device_id):
+                n = catalog.export_metadata(user_id, device_id, meta_path)
+                print(f"✅ Exported {n} cats {scope} -> {meta_path}")
+        else:
+            for cat_id, entry in catalog.cats(user_id, device_id).items():
+                print(f"{scope} {cat_id:24s} {entry['name']:12s} "
+                      f"rows={entry['bank_rows']} images={len(entry['training_images'])}")
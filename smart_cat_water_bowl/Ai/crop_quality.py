@@ -0,0 +1,107 @@
+# crop_quality.py
+import threading
+import cv2
+import numpy as np
+
+# Cheap crop quality score in [0, 1], computed for all boxes of a frame at
+# once, used to skip crops that are not worth a MobileNet forward:
+#   area      : tiny boxes score 0, boxes >= GOOD_AREA_FRAC of the frame score 1
+#   aspect    : boxes outside ASPECT_RANGE (cut-off / smeared) are halved
+#   edge      : boxes touching the frame border (cat partly outside) are halved
+#   sharpness : Laplacian variance on a 128x128 grey copy (motion blur -> low)
+#   conf      : YOLO confidence
+# The final score is the product of the terms.
+# Stills (uploads to test_image / identify_service) are scored without the
+# edge term, since a close-up photo usually touches the border, and their
+# best box always passes: there is no next frame to wait for.
+
+QUALITY_THRESHOLD = 0.25
+MIN_AREA_FRAC = 0.002
+GOOD_AREA_FRAC = 0.03
+ASPECT_RANGE = (0.4, 2.5)     # w / h
+EDGE_MARGIN_FRAC = 0.01
+SHARPNESS_REF = 150.0         # Laplacian variance that counts as sharp
+SHARP_SIZE = 128
+
+
+def _sharpness(frame, boxes):
+    """Laplacian variance of every box, on one stacked (N, S, S) array."""
+    stack = np.empty((len(boxes), SHARP_SIZE, SHARP_SIZE), dtype=np.float32)
+    for i, (l, t, w, h) in enumerate(boxes):
+        crop = frame[t:t + h, l:l + w]
+        if crop.ndim == 3:
+            crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        stack[i] = cv2.resize(crop, (SHARP_SIZE, SHARP_SIZE), interpolation=cv2.INTER_AREA)
+
+    lap = (
+        stack[:, :-2, 1:-1] + stack[:, 2:, 1:-1]
+        + stack[:, 1:-1, :-2] + stack[:, 1:-1, 2:]
+        - 4.0 * stack[:, 1:-1, 1:-1]
+    )
+    return lap.reshape(len(boxes), -1).var(axis=1)
+
+
+def score_boxes(frame, boxes, confs, edge_penalty=True):
+    """
+    frame: BGR image
+    boxes: (N, 4) [left, top, width, height] inside the frame
+    confs: (N,) detector confidence (0 for boxes without a detection)
+    edge_penalty: halve boxes touching the border (camera frames only)
+    return: (N,) quality in [0, 1]
+    """
+    if len(boxes) == 0:
+        return np.zeros((0,), dtype=np.float32)
+
+    fh, fw = frame.shape[:2]
+    b = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    l, t, w, h = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+
+    area_frac = (w * h) / float(fw * fh)
+    area = np.clip((area_frac - MIN_AREA_FRAC) / (GOOD_AREA_FRAC - MIN_AREA_FRAC), 0.0, 1.0)
+
+    aspect_ratio = w / np.maximum(h, 1.0)
+    aspect = np.where(
+        (aspect_ratio >= ASPECT_RANGE[0]) & (aspect_ratio <= ASPECT_RANGE[1]), 1.0, 0.5
+    )
+
+    margin = EDGE_MARGIN_FRAC * max(fw, fh)
+    edge_dist = np.minimum.reduce([l, t, fw - (l + w), fh - (t + h)])
+    edge = np.where((edge_dist >= margin) | (not edge_penalty), 1.0, 0.5)
+
+    sharp = np.clip(_sharpness(frame, b.astype(int)) / SHARPNESS_REF, 0.0, 1.0)
+    conf = np.clip(np.asarray(confs, dtype=np.float32), 0.0, 1.0)
+
+    return (area * aspect * edge * sharp * conf).astype(np.float32)
+
+
+class QualityGate:
+    """Threshold + counters (how many embeddings the gate saved)."""
+
+    def __init__(self, threshold=QUALITY_THRESHOLD):
+        self.threshold = threshold
+        self.scored = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def passes(self, scores, keep_best=False):
+        """Return a bool mask for `scores` and update the counters.
+
+        keep_best: the highest-scoring box passes whatever its score
+        """
+        mask = np.asarray(scores) >= self.threshold
+        if keep_best and mask.size:
+            mask[int(np.argmax(scores))] = True
+        with self._lock:
+            self.scored += int(mask.size)
+            self.skipped += int(mask.size - mask.sum())
+        return mask
+
+    def note_skipped(self, n=1):
+        """Count crops that passed the threshold but were not embedded."""
+        with self._lock:
+            self.skipped += n
+
+    def stats(self):
+        with self._lock:
+            pct = 100.0 * self.skipped / self.scored if self.scored else 0.0
+            return f"scored={self.scored} skipped={self.skipped} ({pct:.1f}%)"
@@ -0,0 +1,131 @@
+# crop_writer.py
+import os
+import time
+import threading
+import cv2
+
+from pipeline import STOP, DropOldestQueue
+
+# Background writer for camera_images/crop_*.jpg (and visit crops)
+# - per-track rate limit (max crops per track per second)
+# - bounded queue: when the disk falls behind, the oldest pending track
+#   crop is dropped instead of stalling the frame loop
+# - visit crops (save()) go through their own unbounded queue and thread:
+#   visits.jsonl points at them, so they are never dropped
+# - counters for written / throttled / dropped / failed crops
+
+FORMAT_PARAMS = {
+    "jpg": lambda q: [cv2.IMWRITE_JPEG_QUALITY, int(q)],
+    "png": lambda q: [cv2.IMWRITE_PNG_COMPRESSION, 3],
+    "webp": lambda q: [cv2.IMWRITE_WEBP_QUALITY, int(q)],
+}
+
+
+class CropWriter:
+    def __init__(
+        self,
+        out_dir,
+        max_per_track_per_sec=2.0,
+        fmt="jpg",
+        quality=85,
+        queue_size=64
+    ):
+        if fmt not in FORMAT_PARAMS:
+            raise ValueError(f"❌ Unsupported crop format: {fmt}")
+
+        self.out_dir = out_dir
+        self.min_interval = 1.0 / max_per_track_per_sec if max_per_track_per_sec > 0 else 0.0
+        self.fmt = fmt
+        self.params = FORMAT_PARAMS[fmt](quality)
+
+        self.written = 0
+        self.throttled = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._last_save = {}  # track_id -> monotonic time of last accepted crop
+        self._lock = threading.Lock()
+        self._queue = DropOldestQueue(queue_size, "crop_writer", on_drop=self._on_drop)
+        self._keep_queue = DropOldestQueue(0, "crop_writer_keep", drop=False)
+        self._threads = [
+            threading.Thread(target=self._run, args=(q,), name=name, daemon=True)
+            for q, name in ((self._queue, "crop_writer"), (self._keep_queue, "crop_writer_keep"))
+        ]
+
+        os.makedirs(out_dir, exist_ok=True)
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    # ---------- producer side (frame loop) ----------
+    def submit(self, name, track_id, crop):
+        """Queue a crop for saving. Returns False if throttled."""
+        now = time.monotonic()
+
+        with self._lock:
+            last = self._last_save.get(track_id)
+            if last is not None and now - last < self.min_interval:
+                self.throttled += 1
+                return False
+            self._last_save[track_id] = now
+
+            # forget tracks that have not been seen for a while
+            if len(self._last_save) > 256:
+                horizon = now - max(10 * self.min_interval, 10.0)
+                self._last_save = {
+                    k: v for k, v in self._last_save.items() if v >= horizon
+                }
+
+        ts = int(time.time() * 1000)
+        filename = f"crop_{name}_{track_id}_{ts}.{self.fmt}"
+        # the frame is drawn on after this call -> keep our own copy
+        self._queue.put((filename, crop.copy()))
+        return True
+
+    def save(self, path, crop):
+        """Queue one unthrottled save that is never dropped (a visit's best crop).
+
+        Relative paths are resolved against out_dir.
+        """
+        self._keep_queue.put((path, crop.copy()))
+
+    def _on_drop(self, item):
+        with self._lock:
+            self.dropped += 1
+
+    # ---------- consumer side (background thread) ----------
+    def _run(self, queue):
+        while True:
+            item = queue.get()
+            if item is STOP:
+                break
+
+            filename, crop = item
+            try:
+                ok = cv2.imwrite(os.path.join(self.out_dir, filename), crop, self.params)
+            except Exception:
+                ok = False
+
+            with self._lock:
+                if ok:
+                    self.written += 1
+                else:
+                    self.failed += 1
+
+    def close(self, timeout=5.0):
+        """Flush pending crops and stop the writer threads."""
+        for queue, thread in zip((self._queue, self._keep_queue), self._threads):
+            if thread.is_alive():
+                queue.put(STOP)
+                thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "written": self.written,
+                "throttled": self.throttled,
+                "dropped": self.dropped,
+                "failed": self.failed,
+            }
@@ -0,0 +1,117 @@
+# detect_stride.py
+import argparse
+import threading
+
+# Run YOLO only every Nth frame and let DeepSort's Kalman filter carry the
+# tracks in between. In adaptive mode the stride drops back to MIN_STRIDE
+# whenever tracking is uncertain (tentative tracks, tracks that missed their
+# last detection, tracks still collecting identity crops) and grows by one
+# after every detection where all tracks were stable, up to MAX_STRIDE.
+
+MIN_STRIDE = 1
+MAX_STRIDE = 4
+# frames a DeepSort track survives without a matching detection; DeepSort
+# counts detection frames, so DetectionClock rescales its max_age
+TRACK_MAX_AGE = 30
+
+
+def parse_stride(value):
+    """argparse type for --stride: "auto" or an int >= 1 (0 would mean auto)."""
+    if value == "auto":
+        return value
+    try:
+        stride = int(value)
+    except ValueError:
+        stride = 0
+    if stride < 1:
+        raise argparse.ArgumentTypeError(f"expected 'auto' or an integer >= 1, got {value!r}")
+    return stride
+
+
+class StrideController:
+    def __init__(self, min_stride=MIN_STRIDE, max_stride=MAX_STRIDE, fixed=None):
+        """fixed=N pins the stride to N (no adaptation)."""
+        self.fixed = fixed
+        self.min_stride = max(1, min_stride)
+        self.max_stride = max(self.min_stride, max_stride)
+        self.stride = fixed or self.min_stride
+
+        self._since_detect = self.stride  # detect on the first frame
+        self._lock = threading.Lock()
+
+        self.frames = 0
+        self.detected = 0
+        self.stride_frames = {}  # stride -> frames spent at that stride
+
+    def should_detect(self):
+        """Call once per frame (detect stage)."""
+        with self._lock:
+            self.frames += 1
+            self.stride_frames[self.stride] = self.stride_frames.get(self.stride, 0) + 1
+            self._since_detect += 1
+            if self._since_detect >= self.stride:
+                self._since_detect = 0
+                self.detected += 1
+                return True
+            return False
+
+    def update(self, tracks, still_identifying=()):
+        """Adapt after a detection frame (track stage).
+
+        tracks: DeepSort tracks after update_tracks()
+        still_identifying: ids of tracks that still want identity crops
+        """
+        if self.fixed:
+            return
+
+        uncertain = not tracks or any(
+            not track.is_confirmed()
+            or track.time_since_update > 0
+            or track.track_id in still_identifying
+            for track in tracks
+        )
+
+        with self._lock:
+            if uncertain:
+                self.stride = self.min_stride
+            else:
+                self.stride = min(self.stride + 1, self.max_stride)
+
+    def stats(self):
+        with self._lock:
+            mode = f"fixed={self.fixed}" if self.fixed else f"auto {self.min_stride}-{self.max_stride}"
+            spent = " ".join(f"x{k}={v}" for k, v in sorted(self.stride_frames.items()))
+            return f"{mode} frames={self.frames} detected={self.detected} {spent}"
+
+
+class DetectionClock:
+    """Keep DeepSort's track ages in detection frames while frames are skipped.
+
+    DeepSort's matcher only tries the IoU fallback on tracks with
+    time_since_update == 1 and deletes them past max_age, both meant per
+    update. predict() on a skipped frame bumps time_since_update too, so
+    those frames are taken back before the next update, and max_age
+    shrinks with the gap so a track still lives about `max_age` frames.
+    """
+
+    def __init__(self, tracker, max_age=TRACK_MAX_AGE):
+        """tracker: deep_sort_realtime DeepSort"""
+        self.tracker = tracker
+        self.max_age = max_age
+        self.predicted = 0   # frames since the last detection (Kalman only)
+
+    def predict(self):
+        """Skipped frame: Kalman prediction only. Returns the tracks."""
+        core = self.tracker.tracker
+        core.predict()
+        self.predicted += 1
+        return core.tracks
+
+    def before_update(self):
+        """Call right before update_tracks() on a detection frame."""
+        skipped, self.predicted = self.predicted, 0
+        core = self.tracker.tracker
+        core.max_age = max(1, -(-self.max_age // (skipped + 1)))
+        for track in core.tracks:
+            track.time_since_update = max(0, track.time_since_update - skipped)
+            track._max_age = core.max_age
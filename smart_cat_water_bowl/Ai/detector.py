@@ -0,0 +1,145 @@
+# detector.py
+# YOLO -> DeepSort detections, shared by main.py, test_image.py and the benchmarks
+import numpy as np
+import cv2
+
+DETECT_CONF = 0.4
+
+
+def load_yolo(path):
+    """Build the YOLO model (ultralytics imports torch, so keep it out of module scope)."""
+    from ultralytics import YOLO
+    return YOLO(path)
+
+
+class DetectionZone:
+    """
+    Bowl region of interest: a rectangle [x1, y1, x2, y2] or a polygon
+    [[x, y], ...]. Coordinates are pixels, or fractions of the frame size
+    when every value is <= 1 (so one setting survives a resolution change).
+
+    YOLO only sees the zone's bounding rectangle; a box is kept when its
+    centre lies inside the zone. Leave room around the bowl for the cat's
+    whole body, boxes are clipped to the rectangle.
+    """
+
+    def __init__(self, points):
+        pts = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        if len(pts) == 2:
+            (x1, y1), (x2, y2) = pts
+            pts = np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], dtype=np.float32)
+        if len(pts) < 3:
+            raise ValueError(f"❌ ROI needs a rectangle or >= 3 points, got {points}")
+
+        self.points = pts
+        self.relative = bool((pts <= 1.0).all())
+        self._size = None
+        self._polygon = None
+        self._rect = None
+
+    def resolve(self, width, height):
+        """Return (polygon (N, 2) int32, (x1, y1, x2, y2)) for this frame size."""
+        if self._size != (width, height):
+            pts = self.points * (width, height) if self.relative else self.points
+            pts = np.clip(np.round(pts), 0, (width, height)).astype(np.int32)
+
+            x1, y1 = pts.min(axis=0)
+            x2, y2 = pts.max(axis=0)
+            if x2 <= x1 or y2 <= y1:
+                raise ValueError(f"❌ ROI is empty for a {width}x{height} frame")
+
+            self._size = (width, height)
+            self._polygon = pts
+            self._rect = (int(x1), int(y1), int(x2), int(y2))
+        return self._polygon, self._rect
+
+    def crop(self, frame):
+        """Return (view of the zone's bounding rectangle, (x offset, y offset))."""
+        _, (x1, y1, x2, y2) = self.resolve(frame.shape[1], frame.shape[0])
+        return frame[y1:y2, x1:x2], (x1, y1)
+
+    def contains(self, x, y):
+        """Is the frame point (x, y) inside the zone? (call after resolve/crop)"""
+        return cv2.pointPolygonTest(self._polygon, (float(x), float(y)), False) >= 0
+
+    def draw(self, frame, color=(255, 200, 0)):
+        polygon, _ = self.resolve(frame.shape[1], frame.shape[0])
+        cv2.polylines(frame, [polygon], True, color, 1)
+
+
+def parse_roi(spec):
+    """
+    "x1,y1,x2,y2"            -> rectangle
+    "x,y;x,y;x,y[;...]"      -> polygon
+    None / ""                -> None (whole frame)
+    """
+    if not spec:
+        return None
+    if isinstance(spec, DetectionZone):
+        return spec
+    if not isinstance(spec, str):
+        return DetectionZone(spec)
+
+    try:
+        values = [float(v) for v in spec.replace(";", ",").split(",") if v.strip()]
+    except ValueError:
+        raise ValueError(f"❌ Bad ROI: {spec!r}") from None
+    if len(values) % 2:
+        raise ValueError(f"❌ Bad ROI (odd number of values): {spec!r}")
+
+    return DetectionZone(values)
+
+
+def detect_cats(model, frame, conf=DETECT_CONF, imgsz=None, zone=None):
+    """
+    Run YOLO on one BGR frame (only on `zone`, if given).
+    imgsz: detector input size (None = model default, 640 for yolov8n)
+    return: [[ [left, top, w, h], confidence, "cat" ], ...] in frame
+            coordinates, clipped to the frame (or zone rectangle)
+    """
+    return detect_cats_batch(model, [frame], conf, imgsz, [zone])[0]
+
+
+def detect_cats_batch(model, frames, conf=DETECT_CONF, imgsz=None, zones=None):
+    """
+    detect_cats for several frames in one YOLO call (same conf / imgsz).
+    zones: one DetectionZone (or None) per frame, or None for whole frames
+    return: one detection list per frame
+    """
+    if not frames:
+        return []
+    zones = zones or [None] * len(frames)
+    views = [
+        zone.crop(frame) if zone is not None else (frame, (0, 0))
+        for frame, zone in zip(frames, zones)
+    ]
+    options = {"imgsz": imgsz} if imgsz else {}
+    results = model([image for image, _ in views], conf=conf, verbose=False, **options)
+
+    out = []
+    for r, (image, (ox, oy)), zone in zip(results, views, zones):
+        detections = []
+        ih, iw = image.shape[:2]
+
+        for box in r.boxes:
+            if model.names[int(box.cls[0])] != "cat":
+                continue
+
+            x1, y1, x2, y2 = map(int, box.xyxy[0])
+            x1, y1 = max(x1, 0), max(y1, 0)
+            x2, y2 = min(x2, iw), min(y2, ih)
+            if x2 <= x1 or y2 <= y1:
+                continue
+
+            x1, y1, x2, y2 = x1 + ox, y1 + oy, x2 + ox, y2 + oy
+            if zone is not None and not zone.contains((x1 + x2) / 2, (y1 + y2) / 2):
+                continue
+
+            detections.append([
+                [x1, y1, x2 - x1, y2 - y1],
+                float(box.conf[0]),
+                "cat"
+            ])
+        out.append(detections)
+
+    return out
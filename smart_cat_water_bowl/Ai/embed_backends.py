@@ -0,0 +1,383 @@
+# embed_backends.py
+import os
+import glob
+import hashlib
+import functools
+import argparse
+import numpy as np
+import cv2
+from cat_bank import normalize_rows
+
+# Interchangeable runtimes for the MobileNetV2 embedder (classifier = Identity)
+#   torch        eager PyTorch fp32 (reference)
+#   torchscript  traced fp32 graph           models/mobilenet_v2.ts
+#   onnx         ONNX Runtime fp32           models/mobilenet_v2.onnx
+#   onnx-int8    ONNX Runtime INT8           models/mobilenet_v2_int8.onnx
+# Every backend takes a preprocessed (N, 3, 224, 224) float32 batch and
+# returns (N, 1280) float32.
+#
+# Build the files once per machine (or copy them between boards):
+#   python embed_backends.py export                 # .onnx + .ts
+#   python embed_backends.py quantize --mode static # INT8, calibrated on cats/
+#   python embed_backends.py parity --backend onnx-int8
+#   python embed_backends.py preprocess   # numpy fast path vs. PIL transform
+# A backend is only safe to use when `parity` passes: the identification
+# thresholds (SIM_THRESHOLD 0.8) were tuned on fp32 vectors.
+
+EMB_DIM = 1280
+INPUT_SIZE = 224
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+BACKEND_FILES = {
+    "torchscript": "mobilenet_v2.ts",
+    "onnx": "mobilenet_v2.onnx",
+    "onnx-int8": "mobilenet_v2_int8.onnx",
+}
+BACKENDS = ("torch",) + tuple(BACKEND_FILES)
+
+PARITY_TOLERANCE = 0.98     # min cosine(fp32, backend) over the parity images
+PREPROCESS_TOLERANCE = 0.995  # min cosine(PIL transform, numpy fast path)
+CALIB_DIR = "cats"
+CALIB_MAX_IMAGES = 200
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+# ---------- reference model ----------
+def build_torch_model(pretrained=True):
+    """MobileNetV2 backbone on CPU, eval mode, 1280-d output."""
+    import torch
+    import torchvision.models as models
+    from torchvision.models import MobileNet_V2_Weights
+
+    weights = MobileNet_V2_Weights.IMAGENET1K_V1 if pretrained else None
+    model = models.mobilenet_v2(weights=weights)
+    model.classifier = torch.nn.Identity()
+    return model.eval()
+
+
+# ---------- backends ----------
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self, model=None, device=None):
+        import torch
+        self.torch = torch
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = (model or build_torch_model()).to(self.device).eval()
+
+    def __call__(self, batch):
+        with self.torch.no_grad():
+            x = self.torch.from_numpy(np.ascontiguousarray(batch)).to(self.device)
+            return self.model(x).cpu().numpy()
+
+
+class TorchScriptBackend(TorchBackend):
+    name = "torchscript"
+
+    def __init__(self, path):
+        import torch
+        super().__init__(model=torch.jit.load(path, map_location="cpu"), device="cpu")
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, path, threads=None):
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            path, opts, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+def backend_path(name, model_dir=MODEL_DIR):
+    return os.path.join(model_dir, BACKEND_FILES[name])
+
+
+def model_version(name, model_dir=MODEL_DIR):
+    """
+    Identity of the weights a backend would load, without loading them:
+    torchvision's pretrained tag for torch, a hash of the model file
+    otherwise (a re-export or re-quantisation changes it).
+    """
+    if name == "torch":
+        return "torch:mobilenet_v2:IMAGENET1K_V1"
+    path = backend_path(name, model_dir)
+    if not os.path.exists(path):
+        return f"{name}:missing"
+    st = os.stat(path)
+    return f"{name}:{_file_digest(path, st.st_size, st.st_mtime_ns)}"
+
+
+@functools.lru_cache(maxsize=8)
+def _file_digest(path, size, mtime_ns):
+    h = hashlib.blake2b(digest_size=8)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_backend(name, model_dir=MODEL_DIR):
+    if name not in BACKENDS:
+        raise ValueError(f"❌ Unknown embedding backend {name!r} (choose from {', '.join(BACKENDS)})")
+    if name == "torch":
+        return TorchBackend()
+
+    path = backend_path(name, model_dir)
+    if not os.path.exists(path):
+        step = "quantize" if name == "onnx-int8" else "export"
+        raise FileNotFoundError(f"❌ {path} not found (run: python embed_backends.py {step})")
+
+    if name == "torchscript":
+        return TorchScriptBackend(path)
+    backend = OnnxBackend(path)
+    backend.name = name
+    return backend
+
+
+# ---------- export ----------
+def _dummy_input(n=1):
+    import torch
+    return torch.zeros((n, 3, INPUT_SIZE, INPUT_SIZE), dtype=torch.float32)
+
+
+def export_onnx(path, model=None, opset=17):
+    import torch
+    model = model or build_torch_model()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    torch.onnx.export(
+        model,
+        _dummy_input(),
+        path,
+        input_names=["input"],
+        output_names=["embedding"],
+        dynamic_axes={"input": {0: "batch"}, "embedding": {0: "batch"}},
+        opset_version=opset,
+        dynamo=False
+    )
+    return path
+
+
+def export_torchscript(path, model=None):
+    import torch
+    model = model or build_torch_model()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, _dummy_input())
+    traced.save(path)
+    return path
+
+
+# ---------- INT8 ----------
+def list_images(root, limit=None):
+    paths = sorted(
+        p for p in glob.glob(os.path.join(root, "**", "*"), recursive=True)
+        if p.lower().endswith(IMAGE_EXTS)
+    )
+    return paths[:limit] if limit else paths
+
+
+def load_batches(paths, preprocess, batch_size=16):
+    """Yield preprocessed float32 batches for image files (RGB)."""
+    imgs = []
+    for path in paths:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        imgs.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        if len(imgs) == batch_size:
+            yield preprocess(imgs).copy()  # preprocess_batch reuses its buffer
+            imgs = []
+    if imgs:
+        yield preprocess(imgs).copy()
+
+
+class _CalibrationReader:
+    """onnxruntime CalibrationDataReader over preprocessed batches."""
+
+    def __init__(self, input_name, batches):
+        self._feeds = iter([{input_name: b} for b in batches])
+
+    def get_next(self):
+        return next(self._feeds, None)
+
+
+def quantize_onnx(src, dst, mode="dynamic", calib_batches=None):
+    """
+    dynamic: INT8 weights, activations quantised at run time (no data needed)
+    static : INT8 weights + activations, ranges calibrated on `calib_batches`
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic, quantize_static, QuantFormat
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    prepped = dst + ".prep.onnx"
+    quant_pre_process(src, prepped)
+
+    try:
+        if mode == "dynamic":
+            quantize_dynamic(prepped, dst, weight_type=QuantType.QUInt8, per_channel=True)
+        elif mode == "static":
+            if not calib_batches:
+                raise ValueError("❌ static quantisation needs calibration images")
+            import onnxruntime as ort
+            input_name = ort.InferenceSession(
+                prepped, providers=["CPUExecutionProvider"]
+            ).get_inputs()[0].name
+            quantize_static(
+                prepped,
+                dst,
+                _CalibrationReader(input_name, calib_batches),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=True
+            )
+        else:
+            raise ValueError(f"❌ Unknown quantisation mode {mode!r}")
+    finally:
+        if os.path.exists(prepped):
+            os.remove(prepped)
+    return dst
+
+
+# ---------- parity ----------
+def parity_report(reference, candidate, tolerance=PARITY_TOLERANCE):
+    """
+    reference, candidate: (N, dim) embeddings of the same images
+    Checks per-image cosine(fp32, candidate) and how far the image-to-image
+    similarities (what the matcher thresholds) move.
+    """
+    ref = normalize_rows(reference)
+    cand = normalize_rows(candidate)
+    cos = (ref * cand).sum(axis=1)
+    drift = np.abs(ref @ ref.T - cand @ cand.T)
+    return {
+        "images": int(len(cos)),
+        "cos_min": float(cos.min()) if len(cos) else 1.0,
+        "cos_mean": float(cos.mean()) if len(cos) else 1.0,
+        "sim_drift_max": float(drift.max()) if drift.size else 0.0,
+        "tolerance": tolerance,
+        "ok": bool(len(cos) and cos.min() >= tolerance),
+    }
+
+
+def check_parity(name, images_dir=CALIB_DIR, tolerance=PARITY_TOLERANCE, model_dir=MODEL_DIR,
+                 limit=CALIB_MAX_IMAGES):
+    """Embed `images_dir` with fp32 torch and with backend `name`; compare."""
+    from embeddings import preprocess_batch
+
+    paths = list_images(images_dir, limit)
+    if not paths:
+        raise FileNotFoundError(f"❌ No images under {images_dir}")
+
+    reference = TorchBackend(device="cpu")
+    candidate = load_backend(name, model_dir)
+
+    ref, cand = [], []
+    for batch in load_batches(paths, preprocess_batch):
+        ref.append(reference(batch))
+        cand.append(candidate(batch))
+    return parity_report(np.concatenate(ref), np.concatenate(cand), tolerance)
+
+
+def check_preprocess(images_dir=CALIB_DIR, backend="torch", tolerance=PREPROCESS_TOLERANCE,
+                     model_dir=MODEL_DIR, limit=CALIB_MAX_IMAGES):
+    """Embed `images_dir` through the PIL transform and the numpy fast path; compare."""
+    from embeddings import preprocess_batch, preprocess_batch_reference
+
+    paths = list_images(images_dir, limit)
+    if not paths:
+        raise FileNotFoundError(f"❌ No images under {images_dir}")
+
+    model = load_backend(backend, model_dir)
+    ref, fast, pixel_max, pixel_sum, pixel_n = [], [], 0.0, 0.0, 0
+    for a, b in zip(load_batches(paths, preprocess_batch_reference), load_batches(paths, preprocess_batch)):
+        diff = np.abs(a - b)
+        pixel_max = max(pixel_max, float(diff.max()))
+        pixel_sum += float(diff.sum())
+        pixel_n += diff.size
+        ref.append(model(a))
+        fast.append(model(b))
+
+    report = parity_report(np.concatenate(ref), np.concatenate(fast), tolerance)
+    report["pixel_max"] = pixel_max
+    report["pixel_mean"] = pixel_sum / max(pixel_n, 1)
+    return report
+
+
+def print_report(name, report):
+    print(
+        f"{'✅' if report['ok'] else '❌'} {name}: {report['images']} images, "
+        f"cos min={report['cos_min']:.4f} mean={report['cos_mean']:.4f} "
+        f"(tol {report['tolerance']}), max similarity drift={report['sim_drift_max']:.4f}"
+    )
+    if "pixel_max" in report:
+        print(f"   input diff (normalised units): max={report['pixel_max']:.3f} mean={report['pixel_mean']:.4f}")
+
+
+# ---------- CLI ----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export / quantise / check the embedding backends")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("export", help="Write the fp32 ONNX and TorchScript models")
+    p.add_argument("--models", default=MODEL_DIR)
+    p.add_argument("--opset", type=int, default=17)
+
+    p = sub.add_parser("quantize", help="Write the INT8 ONNX model")
+    p.add_argument("--models", default=MODEL_DIR)
+    p.add_argument("--mode", choices=["dynamic", "static"], default="static")
+    p.add_argument("--calib", default=CALIB_DIR, help="Calibration images (static mode)")
+    p.add_argument("--calib-max", type=int, default=CALIB_MAX_IMAGES)
+
+    p = sub.add_parser("parity", help="Compare a backend against fp32 PyTorch")
+    p.add_argument("--models", default=MODEL_DIR)
+    p.add_argument("--backend", choices=BACKENDS[1:], default="onnx-int8")
+    p.add_argument("--images", default=CALIB_DIR)
+    p.add_argument("--tol", type=float, default=PARITY_TOLERANCE)
+
+    p = sub.add_parser("preprocess", help="Compare the numpy preprocessing with the PIL transform")
+    p.add_argument("--models", default=MODEL_DIR)
+    p.add_argument("--backend", choices=BACKENDS, default="torch")
+    p.add_argument("--images", default=CALIB_DIR)
+    p.add_argument("--tol", type=float, default=PREPROCESS_TOLERANCE)
+
+    args = parser.parse_args()
+
+    if args.cmd == "export":
+        model = build_torch_model()
+        print(f"✅ {export_onnx(backend_path('onnx', args.models), model, args.opset)}")
+        print(f"✅ {export_torchscript(backend_path('torchscript', args.models), model)}")
+
+    elif args.cmd == "quantize":
+        src = backend_path("onnx", args.models)
+        if not os.path.exists(src):
+            export_onnx(src)
+        batches = None
+        if args.mode == "static":
+            from embeddings import preprocess_batch
+            batches = list(load_batches(list_images(args.calib, args.calib_max), preprocess_batch))
+        dst = quantize_onnx(src, backend_path("onnx-int8", args.models), args.mode, batches)
+        print(f"✅ {dst} ({args.mode})")
+
+        # always check the fresh INT8 model before anyone switches to it
+        args.backend, args.images, args.tol = "onnx-int8", args.calib, PARITY_TOLERANCE
+
+    if args.cmd in ("quantize", "parity"):
+        report = check_parity(args.backend, args.images, args.tol, args.models)
+        print_report(args.backend, report)
+        raise SystemExit(0 if report["ok"] else 1)
+
+    if args.cmd == "preprocess":
+        report = check_preprocess(args.images, args.backend, args.tol, args.models)
+        print_report(f"preprocess ({args.backend})", report)
+        raise SystemExit(0 if report["ok"] else 1)
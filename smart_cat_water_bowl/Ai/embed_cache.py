@@ -0,0 +1,258 @@
+# embed_cache.py
+import os
+import hashlib
+import argparse
+import threading
+import cv2
+import numpy as np
+from embed_backends import EMB_DIM, model_version
+from embeddings import EMBED_BACKEND, PREPROCESS_VERSION, get_embedding_batch
+
+# On-disk cache of image embeddings, shared by every script that embeds
+# image files (register_cat, update_cat, sync_from_storage,
+# test_metric_multi, test_compare).
+#
+#   cache/embeddings/<key[:2]>/<key>.npy     # one (1280,) float32 vector
+#
+# key = blake2b(file bytes + version), version = backend + model weights
+# hash + PREPROCESS_VERSION, so a different backend, a re-exported model
+# or a preprocessing change never returns a stale vector. The cache is
+# capped (CAT_EMBED_CACHE_MB); a hit touches the file's mtime and the
+# least recently used files are evicted first. CAT_EMBED_CACHE=0 disables
+# it, CAT_EMBED_CACHE_DIR moves it.
+#
+#   python embed_cache.py stats
+#   python embed_cache.py clear
+
+CACHE_DIR = os.environ.get(
+    "CAT_EMBED_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "embeddings")
+)
+CACHE_MAX_MB = float(os.environ.get("CAT_EMBED_CACHE_MB", "256"))
+CACHE_ENABLED = os.environ.get("CAT_EMBED_CACHE", "1") != "0"
+EVICT_TO = 0.9   # evict down to this fraction of the cap
+
+
+def cache_version(backend=EMBED_BACKEND):
+    return f"{model_version(backend)}|pre{PREPROCESS_VERSION}"
+
+
+class EmbeddingCache:
+    def __init__(self, root=CACHE_DIR, max_mb=CACHE_MAX_MB, version=None):
+        self.root = root
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.version = (version or cache_version()).encode("utf-8")
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._size = None   # bytes on disk, scanned on first put
+        self._lock = threading.Lock()
+
+    # ---------- keys ----------
+    def key(self, data):
+        """Cache key of an encoded image (the file bytes)."""
+        h = hashlib.blake2b(self.version, digest_size=20)
+        h.update(data)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.npy")
+
+    # ---------- get / put ----------
+    def get(self, key):
+        path = self._path(key)
+        try:
+            emb = np.load(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if emb.shape != (EMB_DIM,):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)   # LRU: mtime = last use
+        except OSError:
+            pass
+        self.hits += 1
+        return emb
+
+    def put(self, key, emb):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, np.asarray(emb, dtype=np.float32))
+        os.replace(tmp, path)   # readers never see a partial file
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += os.path.getsize(path)
+            over = self._size > self.max_bytes
+        if over:
+            self.prune()
+
+    # ---------- size / eviction ----------
+    def _entries(self):
+        """[(mtime_ns, size, path), ...] of every cached vector."""
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for e in os.scandir(shard.path):
+                if e.name.endswith(".npy"):
+                    try:
+                        st = e.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime_ns, st.st_size, e.path))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def prune(self, max_bytes=None):
+        """Evict least recently used vectors until under EVICT_TO of the cap."""
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            target = int(limit * EVICT_TO)
+            removed = 0
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            self._size = total
+            self.evicted += removed
+        return removed
+
+    def clear(self):
+        return self.prune(max_bytes=0)
+
+    def stats(self):
+        entries = self._entries()
+        size = sum(size for _, size, _ in entries)
+        return (
+            f"entries={len(entries)} size={size / 1e6:.1f}MB/{self.max_bytes / 1e6:.0f}MB "
+            f"hits={self.hits} misses={self.misses} evicted={self.evicted}"
+        )
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_cache():
+    """The process-wide cache (None when CAT_EMBED_CACHE=0)."""
+    global _default
+    if not CACHE_ENABLED:
+        return None
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = EmbeddingCache()
+    return _default
+
+
+# ---------- embedding through the cache ----------
+def decode(data):
+    """BGR image from encoded bytes (None if it does not decode)."""
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def read_image(path):
+    """(file bytes, BGR image or None)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    return data, decode(data)
+
+
+def embed_encoded(datas, imgs=None, bgr=True, cache=None):
+    """
+    datas: encoded bytes of each image (what the key is computed from)
+    imgs : the decoded images, same order; None = decode only the misses
+    return: (N, 1280) float32; only cache misses go through the CNN
+    """
+    cache = cache or get_cache()
+    if imgs is None:
+        imgs = [None] * len(datas)
+    if cache is None:
+        return get_embedding_batch(
+            [decode(d) if img is None else img for d, img in zip(datas, imgs)], bgr=bgr
+        )
+
+    out = np.empty((len(datas), EMB_DIM), dtype=np.float32)
+    keys = [cache.key(d) for d in datas]
+    missing = []
+    for i, key in enumerate(keys):
+        emb = cache.get(key)
+        if emb is None:
+            missing.append(i)
+        else:
+            out[i] = emb
+
+    if missing:
+        batch = [decode(datas[i]) if imgs[i] is None else imgs[i] for i in missing]
+        embs = get_embedding_batch(batch, bgr=bgr)
+        for i, emb in zip(missing, embs):
+            out[i] = emb
+            cache.put(keys[i], emb)
+    return out
+
+
+def embed_files(paths, images=True, cache=None):
+    """
+    Embed image files through the cache.
+    images=False: files whose embedding is cached are not even decoded
+    (for callers that only need the vectors).
+    return: (embs (N, 1280), BGR images or None, paths) for the N usable files
+    """
+    datas, imgs, ok = [], [], []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            data = None
+
+        img = None
+        known = data is not None and not images and _is_cached(data, cache)
+        if data is not None and not known:
+            img = decode(data)
+        if not known and img is None:
+            print(f"❌ Cannot read image: {path}")
+            continue
+        datas.append(data)
+        imgs.append(img)
+        ok.append(path)
+
+    embs = embed_encoded(datas, imgs, bgr=True, cache=cache)
+    return embs, (imgs if images else None), ok
+
+
+def _is_cached(data, cache):
+    cache = cache or get_cache()
+    return cache is not None and os.path.exists(cache._path(cache.key(data)))
+
+
+# ---------- CLI ----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding cache maintenance")
+    parser.add_argument("command", choices=["stats", "clear", "prune"])
+    args = parser.parse_args()
+
+    cache = EmbeddingCache()
+    if args.command == "clear":
+        print(f"🗑️ Removed {cache.clear()} cached embeddings")
+    elif args.command == "prune":
+        print(f"🗑️ Evicted {cache.prune()} cached embeddings")
+    print(f"📦 {cache.root}: {cache.stats()}")
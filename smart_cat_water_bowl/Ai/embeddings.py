@@ -1,38 +1,155 @@
-import torch
-import torchvision.models as models
-import torchvision.transforms as transforms
-from torchvision.models import MobileNet_V2_Weights
+import os
+import threading
+import functools
+import cv2
 import numpy as np
+from embed_backends import EMB_DIM, INPUT_SIZE, load_backend
+from lazy import Lazy
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
-
-# โหลด weights แบบใหม่ (ไม่ใช้ pretrained=True)
-weights = MobileNet_V2_Weights.IMAGENET1K_V1
-
-model = models.mobilenet_v2(weights=weights)
-model.classifier = torch.nn.Identity()
-model = model.to(device).eval()
+# runtime for the MobileNetV2 embedder: torch / torchscript / onnx / onnx-int8
+# (see embed_backends.py to build + parity-check the exported models);
+# CAT_EMBED_BACKEND overrides it per machine
+EMBED_BACKEND = os.environ.get("CAT_EMBED_BACKEND", "torch")
 
 # ✅ ImageNet mean / std (fix ตายตัว ปลอดภัย)
 IMAGENET_MEAN = [0.485, 0.456, 0.406]
 IMAGENET_STD  = [0.229, 0.224, 0.225]
 
-transform = transforms.Compose([
-    transforms.ToPILImage(),
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(
-        mean=IMAGENET_MEAN,
-        std=IMAGENET_STD
-    )
-])
+EMBED_BATCH_SIZE = 32   # crops per forward pass
+
+# bump when preprocess_batch changes its output: cached embeddings
+# (embed_cache.py) are keyed by it
+PREPROCESS_VERSION = 2
+
+
+# (x / 255 - mean) / std  ==  x * scale - shift, per channel
+_SCALE = (1.0 / (255.0 * np.asarray(IMAGENET_STD, dtype=np.float64))).astype(np.float32)[:, None, None]
+_SHIFT = (np.asarray(IMAGENET_MEAN, dtype=np.float64) / IMAGENET_STD).astype(np.float32)[:, None, None]
+
+# one reusable (batch, 3, 224, 224) input buffer per thread
+_buffers = threading.local()
+
+
+def _build_transform():
+    # torchvision pulls in torch: only paid when something is embedded
+    import torchvision.transforms as transforms
+
+    return transforms.Compose([
+        transforms.ToPILImage(),
+        transforms.Resize((INPUT_SIZE, INPUT_SIZE)),
+        transforms.ToTensor(),
+        transforms.Normalize(
+            mean=IMAGENET_MEAN,
+            std=IMAGENET_STD
+        )
+    ])
+
+
+# loaded on first use, shared by all threads
+transform = Lazy(_build_transform, "transform")
+backend = Lazy(lambda: load_backend(EMBED_BACKEND), "embedding backend")
+
+
+def get_backend():
+    """The configured embedding backend."""
+    return backend.get()
+
+
+def _batch_buffer(n):
+    buf = getattr(_buffers, "batch", None)
+    if buf is None or len(buf) < n:
+        buf = np.empty((max(n, EMBED_BATCH_SIZE), 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+        _buffers.batch = buf
+    return buf[:n]
+
+
+@functools.lru_cache(maxsize=512)
+def _triangle_kernel(n):
+    """
+    1-D weights of PIL's antialiased bilinear filter for shrinking n -> INPUT_SIZE
+    (a triangle with half-width = scale); None when not shrinking.
+    """
+    scale = n / INPUT_SIZE
+    if scale <= 1.0:
+        return None
+    r = int(np.ceil(scale))
+    k = np.maximum(0.0, 1.0 - np.abs(np.arange(-r, r + 1)) / scale)
+    return (k / k.sum()).astype(np.float32)
+
+
+_NO_FILTER = np.ones(1, dtype=np.float32)
+
+
+def _resize(img):
+    """Resize to INPUT_SIZE like PIL's Resize (bilinear + antialias), with cv2."""
+    h, w = img.shape[:2]
+
+    # big photos: exact box reduction first, so the filter below stays short
+    f = min(h, w) // (2 * INPUT_SIZE)
+    if f >= 2:
+        img = cv2.resize(img, (w // f, h // f), interpolation=cv2.INTER_AREA)
+        h, w = img.shape[:2]
+
+    kx, ky = _triangle_kernel(w), _triangle_kernel(h)
+    if kx is not None or ky is not None:
+        img = cv2.sepFilter2D(
+            img, -1,
+            _NO_FILTER if kx is None else kx,
+            _NO_FILTER if ky is None else ky,
+            borderType=cv2.BORDER_REPLICATE
+        )
+    return cv2.resize(img, (INPUT_SIZE, INPUT_SIZE), interpolation=cv2.INTER_LINEAR)
+
+
+def preprocess_batch(imgs, bgr=False, out=None):
+    """
+    imgs: list of uint8 RGB numpy arrays (any size), BGR if bgr=True
+    out : (N, 3, 224, 224) float32 array to fill (default: this thread's
+          reusable buffer, overwritten by its next call)
+    return: (N, 3, 224, 224) float32 array, normalised
+
+    Matches `transform` (PIL) to well under one grey level on average
+    (check: python embed_backends.py preprocess). After the resize, channel
+    swap + HWC->CHW + scale + mean/std are two numpy passes straight into `out`.
+    """
+    out = _batch_buffer(len(imgs)) if out is None else out
+
+    for i, img in enumerate(imgs):
+        resized = _resize(img)
+        if bgr:
+            resized = resized[:, :, ::-1]
+
+        np.multiply(resized.transpose(2, 0, 1), _SCALE, out=out[i])
+        out[i] -= _SHIFT
+
+    return out
+
+
+def preprocess_batch_reference(imgs):
+    """The original torchvision transform (RGB), kept to check preprocess_batch."""
+    tf = transform.get()
+    return np.stack([tf(img).numpy() for img in imgs])
+
+
+def get_embedding_batch(imgs, batch_size=EMBED_BATCH_SIZE, bgr=False):
+    """
+    imgs: list of RGB numpy arrays (any size), BGR if bgr=True
+          (camera crops can be passed as-is, no cvtColor copy)
+    return: (N, 1280) float32 array, one row per image
+    """
+    out = np.empty((len(imgs), EMB_DIM), dtype=np.float32)
+    model = backend.get() if imgs else None
+
+    for start in range(0, len(imgs), batch_size):
+        chunk = imgs[start:start + batch_size]
+        out[start:start + len(chunk)] = model(preprocess_batch(chunk, bgr=bgr))
+
+    return out
+
 
-def get_embedding(img):
+def get_embedding(img, bgr=False):
     """
-    img: RGB numpy array
+    img: RGB numpy array (BGR if bgr=True)
     return: 1D embedding vector
     """
-    img = transform(img).unsqueeze(0).to(device)
-    with torch.no_grad():
-        emb = model(img)
-    return emb.cpu().numpy().flatten()
+    return get_embedding_batch([img], bgr=bgr)[0]
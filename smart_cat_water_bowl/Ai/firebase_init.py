@@ -1,7 +1,6 @@
 # firebase_init.py
 import os
-import firebase_admin
-from firebase_admin import credentials, storage
+from lazy import Lazy
 
 AI_DIR = os.path.dirname(os.path.abspath(__file__))
 BASE_DIR = os.path.dirname(AI_DIR)
@@ -12,10 +11,26 @@ cred_path = os.path.join(
     "smart-cat-water-bowl-firebase-adminsdk-fbsvc-8ae7ca925f.json"
 )
 
-if not firebase_admin._apps:
-    cred = credentials.Certificate(cred_path)
-    firebase_admin.initialize_app(cred, {
-        "storageBucket": "smart-cat-water-bowl.firebasestorage.app"
-    })
 
-bucket = storage.bucket()
+def _init_bucket():
+    # firebase_admin (+ google-cloud) is slow to import: only on first use
+    import firebase_admin
+    from firebase_admin import credentials, storage
+
+    if not firebase_admin._apps:
+        cred = credentials.Certificate(cred_path)
+        firebase_admin.initialize_app(cred, {
+            "storageBucket": "smart-cat-water-bowl.firebasestorage.app"
+        })
+
+    return storage.bucket()
+
+
+get_bucket = Lazy(_init_bucket, "firebase bucket")
+
+
+def __getattr__(name):
+    # `from firebase_init import bucket` keeps working, connecting on demand
+    if name == "bucket":
+        return get_bucket()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
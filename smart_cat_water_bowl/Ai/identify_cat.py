@@ -1,30 +1,151 @@
 # identify_cat.py
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from cat_bank import normalize_rows
 
 IDENTITY_THRESHOLD = 0.78  # ใช้ค่าเดียวกับ test
 
-def identify_cat(query_emb, cat_bank):
-    """
-    cat_bank = {
-        cat_uid: [emb1, emb2, ...]
-    }
+
+class CatMatcher:
+    """Score query embeddings against every cat with one matrix multiply.
+
+    The gallery is normalised once and sorted by cat so every cat is one
+    contiguous segment of rows; the per-cat score is the max cosine over
+    its segment (np.maximum.reduceat), same as the old per-cat loop.
     """
-    best_score = 0.0
-    best_cat = None
 
-    for cat_uid, emb_list in cat_bank.items():
-        if len(emb_list) == 0:
-            continue
+    def __init__(self, gallery, labels, cat_uids):
+        gallery = np.asarray(gallery, dtype=np.float32)
+        labels = np.asarray(labels, dtype=np.int64)
+
+        order = np.argsort(labels, kind="stable")
+        labels = labels[order]
+        present = np.unique(labels)
+
+        self.cat_uids = [cat_uids[i] for i in present]
+        self.gallery = normalize_rows(gallery[order]) if len(order) else gallery
+        self.starts = np.searchsorted(labels, present)
+        self.counts = np.diff(np.append(self.starts, len(labels)))
+        self.gens = {}  # cat_uid -> bank generation (from_bank only)
+
+    @classmethod
+    def from_dict(cls, cat_embeddings):
+        """cat_embeddings = { cat_uid: [emb1, emb2, ...] }"""
+        cat_uids, parts, labels = [], [], []
+        for cat_uid, emb_list in cat_embeddings.items():
+            if len(emb_list) == 0:
+                continue
+            rows = np.asarray(emb_list, dtype=np.float32).reshape(len(emb_list), -1)
+            parts.append(rows)
+            labels.append(np.full(len(rows), len(cat_uids)))
+            cat_uids.append(cat_uid)
+
+        if not parts:
+            return cls(np.empty((0, 0), np.float32), np.empty((0,), np.int64), [])
+        return cls(np.concatenate(parts), np.concatenate(labels), cat_uids)
+
+    @classmethod
+    def from_bank(cls, bank):
+        """Build from a cat_bank.CatBank (rows already normalised)."""
+        matcher = cls(bank.vectors, bank.labels, bank.cat_uids)
+        matcher.gens = {uid: bank.gens[uid] for uid in matcher.cat_uids if uid in bank.gens}
+        return matcher
+
+    def __len__(self):
+        return len(self.cat_uids)
+
+    def rows_for(self, cat_uid):
+        """Normalised gallery rows of one cat ((0, dim) if unknown)."""
+        if cat_uid not in self.cat_uids:
+            return self.gallery[:0]
+        i = self.cat_uids.index(cat_uid)
+        return self.gallery[self.starts[i]:self.starts[i] + self.counts[i]]
+
+    def updated(self, removed=(), added=None):
+        """
+        Return a new matcher without the `removed` cats and with `added`
+        = { cat_uid: rows } (replacing any existing rows of that cat).
+        Unchanged cats keep their rows; this matcher is not modified, so
+        readers holding it are unaffected.
+        """
+        added = added or {}
+        drop = set(removed) | set(added)
 
-        sims = cosine_similarity([query_emb], emb_list)[0]
-        score = float(np.max(sims))   # 🔥 metric learning
+        cat_uids, parts, labels = [], [], []
+        segments = [(uid, self.rows_for(uid)) for uid in self.cat_uids if uid not in drop]
+        segments += [(uid, np.asarray(rows, dtype=np.float32)) for uid, rows in added.items()]
+        for cat_uid, rows in segments:
+            if len(rows) == 0:
+                continue
+            parts.append(rows.reshape(len(rows), -1))
+            labels.append(np.full(len(rows), len(cat_uids)))
+            cat_uids.append(cat_uid)
 
-        if score > best_score:
-            best_score = score
-            best_cat = cat_uid
+        if not parts:
+            return CatMatcher(np.empty((0, 0), np.float32), np.empty((0,), np.int64), [])
+        return CatMatcher(np.concatenate(parts), np.concatenate(labels), cat_uids)
 
-    if best_score >= IDENTITY_THRESHOLD:
-        return best_cat, best_score
+    def scores(self, queries, reduce="max"):
+        """
+        queries: (Q, dim) or (dim,)
+        return: (Q, n_cats) per-cat cosine ("max" or "mean" over the cat's rows)
+        """
+        q = normalize_rows(queries)
+        if not self.cat_uids:
+            return np.zeros((len(q), 0), dtype=np.float32)
 
-    return None, best_score
+        sims = q @ self.gallery.T
+        if reduce == "mean":
+            return np.add.reduceat(sims, self.starts, axis=1) / self.counts
+        return np.maximum.reduceat(sims, self.starts, axis=1)
+
+    def identify_batch(self, queries, threshold=IDENTITY_THRESHOLD):
+        """Return [(cat_uid or None, score), ...], one per query."""
+        per_cat = self.scores(queries)
+        if per_cat.shape[1] == 0:
+            return [(None, 0.0)] * len(per_cat)
+
+        best = per_cat.argmax(axis=1)
+        results = []
+        for qi, ci in enumerate(best):
+            score = max(float(per_cat[qi, ci]), 0.0)
+            if score > 0.0 and score >= threshold:
+                results.append((self.cat_uids[ci], score))
+            else:
+                results.append((None, score))
+        return results
+
+    def identify(self, query_emb, threshold=IDENTITY_THRESHOLD):
+        return self.identify_batch(query_emb, threshold)[0]
+
+    def top_k_batch(self, queries, k=3):
+        """Return [[(cat_uid, score), ...], ...] best-first, k per query."""
+        per_cat = self.scores(queries)
+        k = min(k, per_cat.shape[1])
+        if k == 0:
+            return [[] for _ in range(len(per_cat))]
+
+        idx = np.argpartition(-per_cat, k - 1, axis=1)[:, :k]
+        results = []
+        for qi, row in enumerate(idx):
+            row = sorted(row, key=lambda ci: (-per_cat[qi, ci], ci))
+            results.append([(self.cat_uids[ci], float(per_cat[qi, ci])) for ci in row])
+        return results
+
+    def top_k(self, query_emb, k=3):
+        return self.top_k_batch(query_emb, k)[0]
+
+
+def identify_cat(query_emb, cat_bank, user_id=None):
+    """
+    cat_bank = {
+        cat_uid: [emb1, emb2, ...]
+    }
+    or a CatMatcher / ann_index.IVFIndex (build it once and reuse it for
+    many queries)
+    user_id = owner of the query; the IVF index holds every user's cats
+    and only searches this user's (a CatMatcher is already per user)
+    """
+    matcher = cat_bank if hasattr(cat_bank, "identify") else CatMatcher.from_dict(cat_bank)
+    if user_id is not None and hasattr(matcher, "users"):
+        return matcher.identify(query_emb, IDENTITY_THRESHOLD, user_id=user_id)
+    return matcher.identify(query_emb, IDENTITY_THRESHOLD)
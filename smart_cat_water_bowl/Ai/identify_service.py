@@ -0,0 +1,349 @@
+# identify_service.py
+import os
+import json
+import time
+import base64
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib import request as urlrequest
+import cv2
+import numpy as np
+from bank_watch import bank_signature, bank_roots
+from cat_bank import load_user_bank
+from identify_cat import CatMatcher
+from crop_quality import QualityGate, score_boxes, QUALITY_THRESHOLD
+from detector import DETECT_CONF, detect_cats_batch, parse_roi, load_yolo
+from embeddings import EMBED_BATCH_SIZE, get_backend, get_embedding_batch
+from lazy import Lazy
+from pipeline import MicroBatcher
+
+# Long-running local identification service: YOLO + MobileNet stay loaded,
+# per-user banks stay in an LRU, and concurrent requests are merged into
+# batched YOLO / embedding forwards (pipeline.MicroBatcher).
+#
+#   python identify_service.py --warmup            # http://127.0.0.1:8765
+#
+#   POST /identify  {"user": U, "device": D, "roi": "...", "imgsz": 320,
+#                    "save_crops": false,
+#                    "images": [{"path": "/abs/x.jpg"} | {"data": "<base64>"}]}
+#     -> {"user": U, "cats": n, "results": [{"detections": [
+#           {"box": [x1, y1, x2, y2], "conf": .., "quality": ..,
+#            "cat_uid": uid | null, "score": .., "skipped": false}, ...]}, ...]}
+#   POST /reload    {"user": U}     drop the cached bank (reloaded anyway
+#                                   when its files change)
+#   GET  /health    models, banks, batching stats
+#
+# test_image.py is a thin client of this service. It runs in-process only
+# when no service is reachable (or with --local); errors and timeouts from
+# a running service are reported, not retried in-process.
+# Listens on localhost only by default: "path" images are read from disk.
+
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+SERVICE_URL = os.environ.get("CAT_ID_SERVICE", f"http://{SERVICE_HOST}:{SERVICE_PORT}")
+
+MODEL_PATH = "yolov8n.pt"
+SIM_THRESHOLD = 0.8
+BASE_DB = "cat_db/users"
+
+BANK_CACHE_MB = 256       # gallery memory kept across users
+DETECT_BATCH = 8          # images per YOLO forward
+BATCH_WAIT_MS = 5         # how long a batch waits for more callers
+
+
+# ---------- per-user banks ----------
+class BankCache:
+    """LRU of CatMatchers per (user, device), capped by gallery bytes.
+
+    An entry is reloaded when the bank files' size/mtime change, so a
+    registration is picked up on the next request.
+    """
+
+    def __init__(self, base_db=BASE_DB, max_mb=BANK_CACHE_MB):
+        self.base_db = base_db
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self._banks = OrderedDict()   # key -> (signature, matcher, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id, device_id=None):
+        key = (user_id, device_id or "")
+        sig = bank_signature(bank_roots(self.base_db, user_id, device_id))
+
+        with self._lock:
+            entry = self._banks.get(key)
+            if entry is not None and entry[0] == sig:
+                self._banks.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        # load outside the lock: other users keep being served
+        bank = load_user_bank(self.base_db, user_id, device_id)
+        matcher = CatMatcher.from_bank(bank) if bank is not None else None
+        del bank
+        nbytes = matcher.gallery.nbytes if matcher is not None else 0
+
+        with self._lock:
+            old = self._banks.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._banks[key] = (sig, matcher, nbytes)
+            self._bytes += nbytes
+            self.loads += 1
+            while self._bytes > self.max_bytes and len(self._banks) > 1:
+                _, (_, _, n) = self._banks.popitem(last=False)
+                self._bytes -= n
+                self.evictions += 1
+        return matcher
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            for key in [k for k in self._banks if user_id is None or k[0] == user_id]:
+                self._bytes -= self._banks.pop(key)[2]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "banks": len(self._banks), "mb": round(self._bytes / 1e6, 2),
+                "hits": self.hits, "loads": self.loads, "evictions": self.evictions,
+            }
+
+
+# ---------- identification ----------
+class Identifier:
+    """Warm models + bank cache; identify() is safe to call from many threads."""
+
+    def __init__(self, base_db=BASE_DB, model_path=MODEL_PATH, bank_mb=BANK_CACHE_MB,
+                 threshold=SIM_THRESHOLD, batch_wait_ms=BATCH_WAIT_MS):
+        self.base_db = base_db
+        self.threshold = threshold
+        self.model = Lazy(lambda: load_yolo(model_path), "YOLO")
+        self.banks = BankCache(base_db, bank_mb)
+        self.gate = QualityGate(QUALITY_THRESHOLD)
+        wait = batch_wait_ms / 1000.0
+        self.detector = MicroBatcher(self._detect, DETECT_BATCH, wait, "detect")
+        self.embedder = MicroBatcher(self._embed, EMBED_BATCH_SIZE, wait, "embed")
+        self.requests = 0
+        self.images = 0
+        self.started = time.time()
+
+    def warmup(self):
+        """Load both models and run one forward each (first-call setup)."""
+        self.model.get()
+        get_backend()
+        dummy = np.zeros((64, 64, 3), dtype=np.uint8)
+        self.detector.submit([(dummy, None, None, DETECT_CONF)])
+        self.embedder.submit([dummy])
+
+    def close(self):
+        self.detector.close()
+        self.embedder.close()
+
+    # ----- batched model calls (worker threads of the batchers) -----
+    def _detect(self, items):
+        """items: [(frame, zone, imgsz, conf)] -> detections per frame."""
+        out = [None] * len(items)
+        groups = {}
+        for i, (_, _, imgsz, conf) in enumerate(items):
+            groups.setdefault((imgsz, conf), []).append(i)
+        for (imgsz, conf), idx in groups.items():
+            dets = detect_cats_batch(
+                self.model.get(), [items[i][0] for i in idx], conf, imgsz,
+                [items[i][1] for i in idx]
+            )
+            for i, d in zip(idx, dets):
+                out[i] = d
+        return out
+
+    def _embed(self, crops):
+        return list(get_embedding_batch(crops, bgr=True))
+
+    # ----- requests -----
+    def identify(self, user_id, images, device_id=None, roi=None, imgsz=None,
+                 save_crops=False):
+        """
+        images: BGR arrays (None for images that failed to decode)
+        return: {"user", "cats", "results": [{"detections": [...]}, ...]}
+        """
+        self.requests += 1
+        self.images += len(images)
+        matcher = self.banks.get(user_id, device_id)
+
+        valid = [i for i, img in enumerate(images) if img is not None]
+        zone = parse_roi(roi)
+        dets = self.detector.submit([(images[i], zone, imgsz, DETECT_CONF) for i in valid])
+
+        results = [{"error": "cannot decode image"} for _ in images]
+        crops, owners = [], []
+        for i, detections in zip(valid, dets):
+            img = images[i]
+            boxes = [box for box, _, _ in detections]
+            confs = [conf for _, conf, _ in detections]
+            # stills: no border penalty, and the best box is always identified
+            quality = score_boxes(img, boxes, confs, edge_penalty=False)
+            keep = self.gate.passes(quality, keep_best=True)
+
+            entries = []
+            for (x1, y1, w, h), conf, q, ok in zip(boxes, confs, quality, keep):
+                entries.append({
+                    "box": [x1, y1, x1 + w, y1 + h], "conf": round(conf, 4),
+                    "quality": round(float(q), 4), "cat_uid": None, "score": 0.0,
+                    "skipped": not bool(ok),
+                })
+                if ok:
+                    crops.append(img[y1:y1 + h, x1:x1 + w])
+                    owners.append((i, entries[-1]))
+            results[i] = {"detections": entries}
+
+        if crops:
+            embs = np.asarray(self.embedder.submit(crops))
+            if matcher is not None:
+                for (i, entry), (cat_uid, score) in zip(owners, matcher.identify_batch(embs, self.threshold)):
+                    entry["cat_uid"] = cat_uid
+                    entry["score"] = round(float(score), 4)
+
+        if save_crops and device_id:
+            self._save_crops(user_id, device_id, images, owners)
+
+        return {
+            "user": user_id,
+            "cats": len(matcher) if matcher is not None else 0,
+            "results": results,
+        }
+
+    def _save_crops(self, user_id, device_id, images, owners):
+        cam_dir = os.path.join(self.base_db, user_id, "devices", device_id, "camera_images")
+        os.makedirs(cam_dir, exist_ok=True)
+        for i, entry in owners:
+            x1, y1, x2, y2 = entry["box"]
+            ts = int(time.time() * 1000)
+            name = entry["cat_uid"] or "unknown"
+            try:
+                cv2.imwrite(os.path.join(cam_dir, f"crop_{name}_{ts}.jpg"), images[i][y1:y2, x1:x2])
+            except Exception:
+                pass
+
+    def handle(self, payload):
+        """Run a /identify request body (dict)."""
+        if not payload.get("user"):
+            raise ValueError("missing 'user'")
+        images = [_decode(spec) for spec in payload.get("images", [])]
+        return self.identify(
+            payload["user"], images,
+            device_id=payload.get("device"),
+            roi=payload.get("roi"),
+            imgsz=payload.get("imgsz"),
+            save_crops=bool(payload.get("save_crops"))
+        )
+
+    def stats(self):
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "requests": self.requests,
+            "images": self.images,
+            "yolo_loaded": self.model.loaded,
+            "bank_cache": self.banks.stats(),
+            "quality_gate": self.gate.stats(),
+            "batching": [self.detector.stats(), self.embedder.stats()],
+        }
+
+
+def _decode(spec):
+    if "data" in spec:
+        buf = np.frombuffer(base64.b64decode(spec["data"]), dtype=np.uint8)
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    if "path" in spec:
+        return cv2.imread(spec["path"])
+    return None
+
+
+# ---------- HTTP ----------
+class _Handler(BaseHTTPRequestHandler):
+    def _send(self, code, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, {"ok": True, **self.server.identifier.stats()})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/identify":
+                self._send(200, self.server.identifier.handle(payload))
+            elif self.path == "/reload":
+                self.server.identifier.banks.invalidate(payload.get("user"))
+                self._send(200, {"ok": True})
+            else:
+                self._send(404, {"error": "not found"})
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            self._send(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+
+def serve(identifier, host=SERVICE_HOST, port=SERVICE_PORT, verbose=False):
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.identifier = identifier
+    server.verbose = verbose
+    return server
+
+
+# ---------- client ----------
+def call_service(url, path, payload=None, timeout=30.0):
+    """POST (or GET when payload is None) a JSON request to the service."""
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urlrequest.Request(
+        url.rstrip("/") + path, data=data,
+        headers={"Content-Type": "application/json"}
+    )
+    with urlrequest.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+
+# ---------- CLI ----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warm-model cat identification service")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--base", default=BASE_DB, help="Base DB directory")
+    parser.add_argument("--bank-mb", type=float, default=BANK_CACHE_MB, help="Bank LRU size")
+    parser.add_argument("--batch-wait-ms", type=float, default=BATCH_WAIT_MS)
+    parser.add_argument("--warmup", action="store_true", help="Load the models before serving")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    identifier = Identifier(args.base, bank_mb=args.bank_mb, batch_wait_ms=args.batch_wait_ms)
+    if args.warmup:
+        t0 = time.perf_counter()
+        identifier.warmup()
+        print(f"🔥 Models warm in {time.perf_counter() - t0:.1f}s")
+
+    server = serve(identifier, args.host, args.port, args.verbose)
+    print(f"🚀 Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        identifier.close()
+        print(f"📊 {identifier.stats()}")
@@ -0,0 +1,41 @@
+# lazy.py
+import time
+import threading
+
+# On-first-use singletons for heavy objects (models, cloud clients).
+# The factory runs once, under a lock, the first time .get() is called
+# from any thread; later calls are a plain attribute read. Keep the heavy
+# imports (torch, ultralytics, firebase_admin, ...) inside the factory so
+# importing a module that only *may* need the object stays cheap.
+
+
+class Lazy:
+    def __init__(self, factory, name=None):
+        self._factory = factory
+        self.name = name or getattr(factory, "__name__", "lazy")
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.load_seconds = None
+
+    def get(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    t0 = time.perf_counter()
+                    self._value = self._factory()
+                    self.load_seconds = time.perf_counter() - t0
+                    self._loaded = True
+        return self._value
+
+    __call__ = get
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def reset(self):
+        """Drop the instance; the next get() builds a new one."""
+        with self._lock:
+            self._value = None
+            self._loaded = False
@@ -0,0 +1,49 @@
+# local_bucket.py
+import os
+import base64
+import hashlib
+import shutil
+
+# A directory that behaves like the parts of a google.cloud.storage Bucket
+# that sync_from_storage.py uses: list_blobs(prefix) -> blobs with .name,
+# .generation, .md5_hash and .download_to_filename(). Lets the sync run
+# offline (tests, a folder of photos) and counts the calls it makes.
+#
+#   python sync_from_storage.py --user U --local-bucket ./fake_bucket
+#   fake_bucket/cats/U/<cat_uid>/*.jpg
+
+
+class LocalBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.root, *name.split("/"))
+
+        st = os.stat(self.path)
+        self.generation = st.st_mtime_ns
+        self.size = st.st_size
+        with open(self.path, "rb") as f:
+            # GCS reports base64(md5) in the listing, so compute it here too
+            self.md5_hash = base64.b64encode(hashlib.md5(f.read()).digest()).decode("ascii")
+
+    def download_to_filename(self, filename):
+        self.bucket.downloads += 1
+        shutil.copyfile(self.path, filename)
+
+
+class LocalBucket:
+    def __init__(self, root):
+        self.root = root
+        self.list_calls = 0
+        self.downloads = 0
+
+    def list_blobs(self, prefix=""):
+        self.list_calls += 1
+        blobs = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for fn in filenames:
+                rel = os.path.relpath(os.path.join(dirpath, fn), self.root)
+                name = rel.replace(os.sep, "/")
+                if name.startswith(prefix):
+                    blobs.append(LocalBlob(self, name))
+        return sorted(blobs, key=lambda b: b.name)
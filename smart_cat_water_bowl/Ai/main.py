@@ -1,20 +1,110 @@
 import os
 import cv2
 import time
+import queue
 import json
 import argparse
+import threading
 import numpy as np
-from ultralytics import YOLO
-from deep_sort_realtime.deepsort_tracker import DeepSort
-from sklearn.metrics.pairwise import cosine_similarity
 
-from embeddings import get_embedding
+from embeddings import get_embedding_batch
+from cat_bank import load_user_bank
+from identify_cat import CatMatcher
 from device import get_or_create_device_id
+from pipeline import STOP, DropOldestQueue, CaptureThread, Stage, MicroBatcher
+from crop_writer import CropWriter
+from visits import VisitTracker, VISITS_FILE
+from track_cache import TrackIdentityCache
+from crop_quality import QualityGate, score_boxes
+from motion_gate import MotionGate
+from detector import DETECT_CONF, detect_cats_batch, parse_roi, load_yolo
+from detect_stride import (
+    DetectionClock, StrideController, MAX_STRIDE, TRACK_MAX_AGE, parse_stride
+)
+from bank_watch import BankWatcher
+from video_source import open_source
 
 # ================= CONFIG =================
+# --source: camera index, stream URL (rtsp://...), video file or image
+# directory. Recorded footage (file / directory) is replayed: every frame
+# goes through the pipeline (no queue drops), identification runs in frame
+# order, timestamps are seconds into the footage and the bank is not
+# reloaded, so a replay gives the same identities and visits every run.
+# Its identities.jsonl / visits.jsonl go to REPLAY_DIR/<source> (or --out).
+# Several --source values run in one process (one bowl camera each): every
+# stream has its own DeepSort + identities, YOLO and MobileNetV2 are
+# shared and their forwards are batched across streams.
 CAMERA_ID = 0
+REPLAY_DIR = "cat_db/replays"
+IDENTITIES_FILE = "identities.jsonl"
 MODEL_PATH = "yolov8n.pt"
 SIM_THRESHOLD = 0.8
+# feed MobileNetV2 vectors to DeepSort instead of its built-in CNN, so each
+# detection gets exactly one CNN forward per frame (shared with identify)
+SHARED_EMBEDDER = True
+
+# pipeline per camera: capture -> detect -> track -> output (visits/save)
+# shared: identify pool, display, YOLO / MobileNetV2 batchers
+# every queue is bounded and drops its OLDEST item when full
+CAPTURE_QUEUE = 1       # keep only the latest camera frame
+DETECT_QUEUE = 2        # YOLO results waiting for the tracker
+IDENTIFY_QUEUE = 16     # new tracks waiting for identification (all cameras)
+OUTPUT_QUEUE = 2        # tracked frames waiting for visits/save
+DISPLAY_QUEUE = 4       # annotated frames waiting for the window
+IDENTIFY_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+IDENTIFY_BATCH = 8      # max new tracks identified per forward
+
+# cross-camera batching: a YOLO / embedding forward waits this long for the
+# other streams' frames (each stream has at most one frame in flight, so a
+# batch holds at most one frame per camera: round-robin by construction)
+BATCH_WAIT = 0.003      # seconds; 0 with a single camera
+DETECT_BATCH = 8        # frames per YOLO forward
+EMBED_BATCH = 32        # crops per MobileNetV2 forward
+FPS_REPORT_INTERVAL = 10.0
+
+# skip YOLO + DeepSort on static frames (cheap frame-difference test on a
+# downscaled frame); still detects while tracks are alive and at least
+# every MOTION_IDLE_INTERVAL seconds
+MOTION_GATE = True
+MOTION_IDLE_INTERVAL = 1.0
+
+# run YOLO every Nth frame, DeepSort's Kalman prediction fills the gaps;
+# "auto" adapts N between 1 (new/uncertain tracks) and DETECT_STRIDE_MAX
+DETECT_STRIDE = "auto"
+DETECT_STRIDE_MAX = MAX_STRIDE
+
+# YOLO only looks at the bowl zone and drops boxes centred outside it.
+# "x1,y1,x2,y2" rectangle or "x,y;x,y;..." polygon, pixels or fractions
+# of the frame (None = whole frame). Include the space around the bowl.
+DETECT_ROI = None
+# YOLO input size (multiple of 32); the ROI crop is small, so 320-416 is
+# usually enough (None = model default 640)
+DETECT_IMGSZ = None
+
+# identity per track: vote over the first IDENTITY_BUDGET embeddings, then
+# freeze; entries go away with the DeepSort track or after IDENTITY_TTL
+IDENTITY_BUDGET = 5
+IDENTITY_TTL = 60.0
+MAX_TRACKS = 256
+# crops scoring below this (size, aspect, border, blur, YOLO conf) are not
+# used for identification ...
+QUALITY_THRESHOLD = 0.25
+# ... unless a track only ever shows such crops: after this many rejected
+# frames its best rejected crop so far is identified anyway
+QUALITY_FALLBACK_FRAMES = 10
+
+# one record + best crop per visit (visits.jsonl, visits/*.jpg)
+# per-frame camera_images/crop_* are only written when SAVE_TRACK_CROPS is on
+SAVE_TRACK_CROPS = False
+CROP_SAVE_FPS = 2.0     # max crops per track per second (0 = every frame)
+CROP_FORMAT = "jpg"     # jpg / png / webp
+CROP_QUALITY = 85
+CROP_QUEUE = 64         # pending saves; oldest dropped when full
+
+# pick up cats added/removed by sync_from_storage.py / register_cat.py
+# without a restart (bank files polled every BANK_POLL_INTERVAL seconds)
+BANK_RELOAD = True
+BANK_POLL_INTERVAL = 2.0
 
 BASE_DB = "cat_db/users"
 RUNTIME_DB = "cat_db/runtime/current_user.json"
@@ -39,73 +129,78 @@ def get_current_user_id():
 # ================= LOAD USER CATS =================
 def load_user_cats(user_id, device_id=None):
     """
-    Return: { cat_uid: [emb1, emb2, ...] }
+    Return: CatMatcher over { cat_uid: [emb1, emb2, ...] } (or None)
     """
-    base_user = os.path.join(BASE_DB, user_id)
-    device_db = os.path.join(base_user, "devices", device_id) if device_id else None
-
-    search_paths = []
-    if device_db:
-        search_paths.append(device_db)
-    search_paths.append(base_user)
-
-    cat_embeddings = {}
-
-    for root in search_paths:
-        metadata_path = os.path.join(root, "metadata.json")
-        if not os.path.exists(metadata_path):
-            continue
-
-        with open(metadata_path, "r", encoding="utf-8") as f:
-            meta = json.load(f)
-
-        for cat_uid, entry in meta.items():
-            emb_files = []
-            if isinstance(entry, dict):
-                emb_files = entry.get("embeddings", [])
-            elif isinstance(entry, list):
-                emb_files = entry
-
-            embs = []
-            for fn in emb_files:
-                path = os.path.join(root, fn)
-                if os.path.exists(path):
-                    try:
-                        embs.append(np.load(path))
-                    except Exception:
-                        pass
-
-            if embs:
-                cat_embeddings[cat_uid] = embs
-                print(f"📦 Loaded {len(embs)} embeddings for {cat_uid}")
-
-        if cat_embeddings:
-            break
-
-    return cat_embeddings
+    bank = load_user_bank(BASE_DB, user_id, device_id)
+    if bank is None:
+        return None
 
+    for cat_uid, n in bank.counts().items():
+        print(f"📦 Loaded {n} embeddings for {cat_uid}")
 
-# ================= IDENTIFY CAT =================
-def identify_cat(emb, cat_embeddings):
-    best_score, best_cat_uid = 0.0, None
-
-    for cat_uid, ref_emb_list in cat_embeddings.items():
-        scores = cosine_similarity([emb], ref_emb_list)[0]
-        score = float(np.max(scores))
-
-        if score > best_score:
-            best_score, best_cat_uid = score, cat_uid
-
-    if best_score >= SIM_THRESHOLD:
-        return best_cat_uid, best_score
-
-    return None, best_score
+    return CatMatcher.from_bank(bank)
 
 
 # ================= ARG PARSE =================
 parser = argparse.ArgumentParser()
 parser.add_argument("--user", help="Force USER_ID for testing")
+parser.add_argument(
+    "--builtin-embedder",
+    action="store_true",
+    help="Use DeepSort's own appearance CNN instead of the shared MobileNetV2"
+)
+parser.add_argument(
+    "--no-motion-gate",
+    action="store_true",
+    help="Run YOLO on every frame, even when nothing moves"
+)
+parser.add_argument(
+    "--stride",
+    type=parse_stride,
+    default=DETECT_STRIDE,
+    help="Run YOLO every N frames (number) or adaptively ('auto')"
+)
+parser.add_argument(
+    "--roi",
+    nargs="+",
+    default=[DETECT_ROI],
+    help="Bowl zone: 'x1,y1,x2,y2' or 'x,y;x,y;...' (pixels or 0-1 fractions); "
+         "one for all cameras or one per --source"
+)
+parser.add_argument(
+    "--imgsz",
+    type=int,
+    default=DETECT_IMGSZ,
+    help="YOLO input size, e.g. 320"
+)
+parser.add_argument(
+    "--source",
+    nargs="+",
+    default=[str(CAMERA_ID)],
+    help="Camera index, stream URL, video file or image directory (several = multi-camera)"
+)
+parser.add_argument(
+    "--headless",
+    action="store_true",
+    help="No window (stop with Ctrl+C, or at the end of recorded footage)"
+)
+parser.add_argument(
+    "--realtime",
+    action="store_true",
+    help="Replay recorded footage at its own frame rate instead of max speed"
+)
+parser.add_argument(
+    "--fps",
+    type=float,
+    help="Frame rate of an image directory source"
+)
+parser.add_argument(
+    "--out",
+    help="Write identities.jsonl + visits here (default for replays: cat_db/replays/<source>)"
+)
 args = parser.parse_args()
+if len(args.roi) not in (1, len(args.source)):
+    parser.error("--roi: give one zone for all cameras or one per --source")
 
 if args.user:
     USER_ID = args.user
@@ -117,103 +212,514 @@ else:
 DEVICE_ID = get_or_create_device_id()
 print(f"🧩 DEVICE={DEVICE_ID}")
 
+shared_embedder = SHARED_EMBEDDER and not args.builtin_embedder
+
 # ================= LOAD DATA =================
-cat_embeddings = load_user_cats(USER_ID, DEVICE_ID)
-print(f"✅ Loaded {len(cat_embeddings)} cats")
+matcher = load_user_cats(USER_ID, DEVICE_ID)
+print(f"✅ Loaded {len(matcher) if matcher else 0} cats")
+
+# identify workers read bank_watcher.matcher; a reload swaps it
+bank_watcher = BankWatcher(
+    BASE_DB,
+    USER_ID,
+    DEVICE_ID,
+    matcher=matcher,
+    interval=BANK_POLL_INTERVAL
+)
 
 # ================= INIT MODELS =================
-model = YOLO(MODEL_PATH)
-tracker = DeepSort(max_age=30)
+# heavy imports after argument parsing, so --help stays instant
+from deep_sort_realtime.deepsort_tracker import DeepSort
 
-# ================= CAMERA =================
-cap = cv2.VideoCapture(CAMERA_ID)
-if not cap.isOpened():
-    raise RuntimeError("❌ Cannot open camera")
+model = load_yolo(MODEL_PATH)
+multi = len(args.source) > 1
+batch_wait = BATCH_WAIT if multi else 0.0
 
-device_db = os.path.join(BASE_DB, USER_ID, "devices", DEVICE_ID)
-camera_dir = os.path.join(device_db, "camera_images")
-os.makedirs(camera_dir, exist_ok=True)
 
-print("🚀 Cat AI started")
+def detect_batch(items):
+    """[(frame, zone), ...] of any cameras -> detections, one YOLO forward."""
+    return detect_cats_batch(
+        model,
+        [frame for frame, _ in items],
+        DETECT_CONF,
+        args.imgsz,
+        [zone for _, zone in items]
+    )
 
-# ================= TRACK LOCK =================
-track_identity = {}
 
-# ================= MAIN LOOP =================
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
+def embed_batch(crops):
+    return list(get_embedding_batch(crops, bgr=True))
 
-    detections = []
-    results = model(frame, conf=0.4, verbose=False)
 
-    # ---------- YOLO ----------
-    for r in results:
-        for box in r.boxes:
-            if model.names[int(box.cls[0])] != "cat":
-                continue
+# the models only ever run on these two threads, fed by every camera
+detector = MicroBatcher(detect_batch, DETECT_BATCH, batch_wait, "detect")
+embedder = MicroBatcher(embed_batch, EMBED_BATCH, batch_wait, "embed")
 
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            detections.append([
-                [x1, y1, x2 - x1, y2 - y1],
-                float(box.conf[0]),
-                "cat"
-            ])
+device_db = os.path.join(BASE_DB, USER_ID, "devices", DEVICE_ID)
+stop_event = threading.Event()
+display_q = None if args.headless else DropOldestQueue(DISPLAY_QUEUE, "display")
 
-    # ---------- TRACK ----------
-    tracks = tracker.update_tracks(detections, frame=frame)
 
-    for track in tracks:
-        if not track.is_confirmed():
-            continue
+# ================= CAMERA STREAM =================
+class CameraStream:
+    """One camera: its source, DeepSort, track identities, visits and stages.
 
-        track_id = track.track_id
-        l, t, w, h = map(int, track.to_ltrb())
+    capture -> detect -> track -> output run on this stream's threads;
+    YOLO / MobileNetV2 calls go through the shared batchers and new tracks
+    to the shared identify pool.
+    """
 
-        crop = frame[t:t + h, l:l + w]
-        if crop.size == 0:
-            continue
+    def __init__(self, index, spec, roi):
+        self.name = f"cam{index}"
+        self.prefix = f"[{self.name}] " if multi else ""
+        self.source = open_source(spec, realtime=args.realtime, fps=args.fps)
+        self.replay = not self.source.live
+        print(f"🎞️ {self.prefix}{'Replaying' if self.replay else 'Live'} source: {self.source.name}")
 
-        if track_id in track_identity:
-            cat_uid, score = track_identity[track_id]
+        if shared_embedder:
+            # embeds are passed to update_tracks() every frame
+            self.tracker = DeepSort(max_age=TRACK_MAX_AGE, embedder=None)
         else:
-            rgb = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
-            emb = get_embedding(rgb)
+            self.tracker = DeepSort(max_age=TRACK_MAX_AGE)
+        self.track_clock = DetectionClock(self.tracker, TRACK_MAX_AGE)
+
+        # ---------- TRACK IDENTITY ----------
+        self.track_identity = TrackIdentityCache(
+            budget=IDENTITY_BUDGET,
+            ttl=IDENTITY_TTL,
+            max_tracks=MAX_TRACKS
+        )
+        self.quality_gate = QualityGate(QUALITY_THRESHOLD)
+        self._held = {}  # track_id -> [rejected frames, quality, emb, crop] of its best rejected
+
+        # ---------- MOTION GATE ----------
+        self.motion_gate = None
+        if MOTION_GATE and not args.no_motion_gate:
+            self.motion_gate = MotionGate(idle_interval=MOTION_IDLE_INTERVAL)
+        self.tracking_active = threading.Event()  # set by the track stage
+
+        # ---------- DETECTION STRIDE ----------
+        if args.stride == "auto":
+            self.stride = StrideController(max_stride=DETECT_STRIDE_MAX)
+        else:
+            self.stride = StrideController(fixed=args.stride)
+
+        # ---------- DETECTION ZONE ----------
+        self.zone = parse_roi(roi)
+
+        # ---------- OUTPUTS ----------
+        out_dir = args.out
+        if out_dir is not None and multi:
+            out_dir = os.path.join(out_dir, self.name)
+        if out_dir is None and self.replay:
+            name = os.path.splitext(os.path.basename(os.path.normpath(self.source.name)))[0]
+            out_dir = os.path.join(REPLAY_DIR, f"{self.name}_{name}" if multi else name)
+
+        self.identities_file = None
+        if out_dir is not None:
+            os.makedirs(out_dir, exist_ok=True)
+            if self.replay:
+                # a replay's results describe that run only
+                for old in (IDENTITIES_FILE, VISITS_FILE):
+                    if os.path.exists(os.path.join(out_dir, old)):
+                        os.remove(os.path.join(out_dir, old))
+            self.identities_file = open(
+                os.path.join(out_dir, IDENTITIES_FILE), "a", encoding="utf-8"
+            )
+            print(f"📝 {self.prefix}Writing identities / visits to {out_dir}")
+
+        self.crop_writer = CropWriter(
+            os.path.join(out_dir or device_db, "camera_images"),
+            max_per_track_per_sec=CROP_SAVE_FPS,
+            fmt=CROP_FORMAT,
+            quality=CROP_QUALITY,
+            queue_size=CROP_QUEUE
+        ).start()
+        # live cameras share device_db/visits.jsonl, told apart by "camera"
+        self.visit_tracker = VisitTracker(
+            out_dir or device_db,
+            crop_writer=self.crop_writer,
+            camera=self.name if multi else None,
+            replay=self.replay
+        )
+
+        # ---------- PIPELINE ----------
+        # live: drop stale frames; replay: every frame, back-pressure to the reader
+        drop = not self.replay
+        self.capture_q = DropOldestQueue(CAPTURE_QUEUE, f"{self.prefix}capture", drop=drop)
+        # several cameras: detect no faster than this stream's tracker keeps
+        # up (the capture queue still drops stale frames), since YOLO time
+        # spent on results the tracker would drop is taken from the others
+        self.detect_q = DropOldestQueue(
+            DETECT_QUEUE, f"{self.prefix}detect", drop=drop and not multi
+        )
+        self.output_q = DropOldestQueue(OUTPUT_QUEUE, f"{self.prefix}output", drop=drop)
+        self.capture = CaptureThread(
+            self.source.read, self.capture_q, stop_event, clock=self.source.timestamp
+        )
+        self.stages = []
+        self.frames = 0
+        self._fps_mark = (time.perf_counter(), 0)
+
+    def start(self):
+        self.stages = [
+            Stage(f"{self.name}-detect", self.detect, self.capture_q, self.detect_q).start(),
+            Stage(f"{self.name}-track", self.track, self.detect_q, self.output_q).start(),
+            Stage(f"{self.name}-output", self.output, self.output_q, display_q).start(),
+        ]
+        self.capture.start()
+        return self
+
+    def is_alive(self):
+        return any(stage.is_alive() for stage in self.stages)
+
+    def fps(self):
+        """Frames output per second since the previous call."""
+        now, frames = time.perf_counter(), self.frames
+        then, before = self._fps_mark
+        self._fps_mark = (now, frames)
+        return (frames - before) / max(now - then, 1e-9)
+
+    # ================= STAGES =================
+    def detect(self, item):
+        """capture -> (seq, ts, frame, detections)
+
+        detections is None when the motion gate or the stride skipped YOLO.
+        """
+        seq, ts, frame = item
+        now = ts if self.replay else None
+        if self.motion_gate is not None and not self.motion_gate.should_detect(
+            frame, self.tracking_active.is_set(), now
+        ):
+            return seq, ts, frame, None
+        if not self.stride.should_detect():
+            return seq, ts, frame, None
+
+        # batched with whatever frames the other cameras have in flight
+        return seq, ts, frame, detector.submit([(frame, self.zone)])[0]
+
+    def _hold_best(self, track_id, quality, emb, crop):
+        """
+        Keep a track's best crop rejected by the quality gate; after
+        QUALITY_FALLBACK_FRAMES rejections return it (and start over), so
+        a cat that only shows small / edge / low-confidence crops still
+        gets identified. Return: [n, quality, emb, crop] or None.
+        """
+        held = self._held.get(track_id)
+        if held is None or quality > held[1]:
+            n = held[0] if held is not None else 0
+            held = self._held[track_id] = [n, quality, emb, None if crop is None else crop.copy()]
+        held[0] += 1
+        if held[0] < QUALITY_FALLBACK_FRAMES:
+            return None
+        return self._held.pop(track_id)
+
+    def track(self, item):
+        """(seq, ts, frame, detections) -> (seq, ts, frame, visible, active ids)
+
+        Runs on a single thread: DeepSort must see frames in order.
+        New tracks are handed to the identify pool instead of blocking here.
+        """
+        seq, ts, frame, detections = item
+        now = ts if self.replay else None  # replay: media time drives the TTLs
+        tracker = self.tracker
+        track_identity = self.track_identity
+        det_embs = None
+        jobs = []
+
+        if detections is None:
+            # no YOLO this frame: Kalman prediction only (tracks keep moving,
+            # nothing is matched or deleted; time_since_update grows and is
+            # taken back by the detection clock before the next update)
+            tracks = self.track_clock.predict()
+        elif shared_embedder:
+            self.track_clock.before_update()
+            # one batched MobileNetV2 forward per frame, reused for identify
+            det_embs = embedder.submit(
+                [frame[y:y + h, x:x + w] for (x, y, w, h), _, _ in detections]
+            )
+            tracks = tracker.update_tracks(
+                detections,
+                embeds=det_embs,
+                frame=frame,
+                others=list(range(len(detections)))
+            )
+        else:
+            self.track_clock.before_update()
+            tracks = tracker.update_tracks(detections, frame=frame)
 
-            cat_uid, score = None, None
-            if cat_embeddings:
-                cat_uid, score = identify_cat(emb, cat_embeddings)
+        visible = []
+        confirmed = []
 
-            track_identity[track_id] = (cat_uid, score)
+        for track in tracks:
+            if not track.is_confirmed():
+                continue
 
-        # ---------- SAVE ----------
-        ts = int(time.time() * 1000)
-        name = cat_uid if cat_uid else "unknown"
-        cv2.imwrite(
-            os.path.join(camera_dir, f"crop_{name}_{track_id}_{ts}.jpg"),
-            crop
-        )
+            # to_ltrb() is left, top, right, bottom
+            l, t, r, b = map(int, track.to_ltrb())
+            l, t = max(l, 0), max(t, 0)
+            r, b = min(r, frame.shape[1]), min(b, frame.shape[0])
+            w, h = r - l, b - t
+            if w <= 0 or h <= 0:
+                continue
 
-        # ---------- DRAW ----------
-        color = (0, 255, 0) if cat_uid else (0, 0, 255)
-        label = cat_uid if cat_uid else "Unknown"
+            # predicted-only boxes (no detection this frame) get conf 0
+            conf = track.get_det_conf() if track.time_since_update == 0 else None
+            confirmed.append((track, l, t, w, h, conf or 0.0))
 
-        cv2.rectangle(frame, (l, t), (l + w, t + h), color, 2)
-        cv2.putText(
+        # ---------- QUALITY (all boxes at once) ----------
+        qualities = score_boxes(
             frame,
-            label,
-            (l, max(t - 10, 20)),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.8,
-            color,
-            2
+            [(l, t, w, h) for _, l, t, w, h, _ in confirmed],
+            [conf for *_, conf in confirmed]
         )
 
-    cv2.imshow("Cat AI System", frame)
-    if cv2.waitKey(1) & 0xFF == ord("q"):
-        break
+        for (track, l, t, w, h, _), quality in zip(confirmed, qualities):
+            track_id = track.track_id
+            crop = frame[t:t + h, l:l + w]
+            quality = float(quality)
+
+            visible.append((track_id, l, t, w, h, crop, quality))
+            track_identity.touch(track_id, now)
+
+            if not track_identity.wants(track_id):
+                continue
+
+            if shared_embedder:
+                # only tracks matched to a detection this frame have a fresh vector
+                det_idx = track.get_det_supplementary()
+                if track.time_since_update != 0 or det_idx is None:
+                    continue
+
+            if shared_embedder:
+                emb, job_crop = det_embs[det_idx], None
+            else:
+                emb, job_crop = None, crop
+
+            if not self.quality_gate.passes([quality])[0]:
+                held = self._hold_best(track_id, quality, emb, job_crop)
+                if held is None:
+                    continue
+                _, quality, emb, job_crop = held
+
+            if not track_identity.request(track_id, quality):
+                self.quality_gate.note_skipped()
+                continue
+            jobs.append((self, track_id, emb, None if job_crop is None else job_crop.copy()))
+
+        if self.replay:
+            # in frame order, before the frame is output: deterministic identities
+            if jobs:
+                identify_stage(jobs)
+        else:
+            for job in jobs:
+                identify_q.put(job)
+
+        # every track DeepSort still holds; a visit ends when its id disappears
+        active_ids = {track.track_id for track in tracks}
+        track_identity.retain(active_ids, now)
+        for track_id in [tid for tid in self._held if tid not in active_ids]:
+            del self._held[track_id]
+
+        if detections is not None:
+            self.stride.update(
+                tracks,
+                still_identifying={tid for tid in active_ids if track_identity.wants(tid)}
+            )
+        if active_ids:
+            self.tracking_active.set()
+        else:
+            self.tracking_active.clear()
+
+        return seq, ts, frame, visible, active_ids
+
+    def output(self, item):
+        """Visits, identities file, crops, drawing -> (camera, frame) to display."""
+        seq, ts, frame, visible, active_ids = item
+        self.frames += 1
+
+        labels = []
+        observations = []
+        records = []
+        for track_id, l, t, w, h, crop, quality in visible:
+            cat_uid, score = self.track_identity.get(track_id)
+            labels.append(cat_uid)
+            observations.append((track_id, cat_uid, score, crop, quality))
+            records.append({
+                "track_id": track_id, "cat_uid": cat_uid,
+                "score": None if score is None else round(float(score), 4),
+                "box": [l, t, w, h], "quality": round(quality, 4),
+            })
+
+            # ---------- SAVE (async, throttled) ----------
+            if SAVE_TRACK_CROPS:
+                name = cat_uid if cat_uid else "unknown"
+                if multi:
+                    name = f"{self.name}_{name}"
+                self.crop_writer.submit(name, track_id, crop)
+
+        # ---------- VISITS (before drawing, crops are views of frame) ----------
+        self.visit_tracker.update(ts, observations, active_ids)
+
+        if self.identities_file is not None and records:
+            self.identities_file.write(json.dumps(
+                {"frame": seq, "ts": round(ts, 3), "tracks": records}, ensure_ascii=False
+            ) + "\n")
+
+        if args.headless:
+            return None
+
+        for (track_id, l, t, w, h, *_), cat_uid in zip(visible, labels):
+            # ---------- DRAW ----------
+            color = (0, 255, 0) if cat_uid else (0, 0, 255)
+            label = cat_uid if cat_uid else "Unknown"
+
+            cv2.rectangle(frame, (l, t), (l + w, t + h), color, 2)
+            cv2.putText(
+                frame,
+                label,
+                (l, max(t - 10, 20)),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.8,
+                color,
+                2
+            )
+
+        if self.zone is not None:
+            self.zone.draw(frame)
+        return self.name, frame
+
+    def close(self, elapsed):
+        for q in (self.capture_q, self.detect_q, self.output_q):
+            print(f"📉 {q.stats()}")
+
+        self.visit_tracker.close()
+        print(f"🐾 {self.prefix}visits recorded: {self.visit_tracker.closed}")
+        if self.identities_file is not None:
+            self.identities_file.close()
+
+        print(f"⏱️ {self.prefix}{self.frames} frames in {elapsed:.1f}s "
+              f"({self.frames / max(elapsed, 1e-9):.1f} fps)")
+        if self.motion_gate is not None:
+            print(f"🏃 {self.prefix}motion gate: {self.motion_gate.stats()}")
+        print(f"🦘 {self.prefix}detect stride: {self.stride.stats()}")
+        print(f"🔎 {self.prefix}quality gate: {self.quality_gate.stats()}")
+        print(f"🧠 {self.prefix}identity cache: {len(self.track_identity)} tracks, "
+              f"{self.track_identity.evicted} evicted")
+
+        self.crop_writer.close()
+        print(f"💾 {self.prefix}crops: {self.crop_writer.stats()}")
+        self.source.release()
+
+
+# ================= IDENTIFY (all cameras) =================
+def identify_stage(jobs):
+    """Identify a batch of track crops (runs on the worker pool)."""
+    if shared_embedder:
+        embs = np.stack([emb for _, _, emb, _ in jobs])
+    else:
+        embs = np.asarray(embedder.submit([crop for *_, crop in jobs]))
+
+    current = bank_watcher.matcher  # one bank per batch, even mid-reload
+    if current:
+        matches = current.identify_batch(embs, SIM_THRESHOLD)
+    else:
+        matches = [(None, None)] * len(jobs)
+
+    for (stream, track_id, _, _), (cat_uid, score), emb in zip(jobs, matches, embs):
+        stream.track_identity.vote(track_id, cat_uid, score, emb)
+
+
+def drop_identify_job(job):
+    # the track will be re-submitted on its next frame
+    stream, track_id = job[:2]
+    stream.track_identity.cancel(track_id)
+
+
+identify_q = DropOldestQueue(IDENTIFY_QUEUE, "identify", on_drop=drop_identify_job)
+
+# ================= STREAMS =================
+rois = args.roi * len(args.source) if len(args.roi) == 1 else args.roi
+streams = [
+    CameraStream(i, spec, roi)
+    for i, (spec, roi) in enumerate(zip(args.source, rois))
+]
+any_replay = any(stream.replay for stream in streams)
+
+
+# ================= BANK RELOAD =================
+def on_bank_reload(changes, new_matcher):
+    """Runs on the watcher thread right after the matcher swap."""
+    changed = 0
+    for stream in streams:
+        changed += len(stream.track_identity.rescore(
+            lambda embs: new_matcher.identify_batch(embs, SIM_THRESHOLD),
+            affected=set(changes.removed) | set(changes.replaced)
+        ))
+    print(f"🔄 Cat bank reloaded ({changes}), {len(new_matcher)} cats; "
+          f"{changed} live tracks re-identified")
+
+
+if BANK_RELOAD and not any_replay:
+    bank_watcher.on_reload = on_bank_reload
+    bank_watcher.start()
+
+# ================= PIPELINE =================
+identify = Stage(
+    "identify",
+    identify_stage,
+    identify_q,
+    workers=IDENTIFY_WORKERS,
+    batch=IDENTIFY_BATCH
+).start()
+for stream in streams:
+    stream.start()
+
+print(f"🚀 Cat AI started ({len(streams)} camera{'s' if multi else ''})")
+
+# ================= MAIN LOOP (display) =================
+started = time.perf_counter()
+last_report = started
+try:
+    while any(stream.is_alive() for stream in streams):
+        if display_q is None:
+            time.sleep(0.05)
+        else:
+            try:
+                item = display_q.get(timeout=0.05)
+            except queue.Empty:
+                item = None
+            if item is not None and item is not STOP:
+                name, frame = item
+                cv2.imshow(f"Cat AI System - {name}" if multi else "Cat AI System", frame)
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+
+        if multi and time.perf_counter() - last_report >= FPS_REPORT_INTERVAL:
+            last_report = time.perf_counter()
+            print("📷 " + " | ".join(f"{s.name} {s.fps():.1f} fps" for s in streams))
+except KeyboardInterrupt:
+    print("⏹️ Interrupted")
+elapsed = time.perf_counter() - started
 
 # ================= CLEANUP =================
-cap.release()
-cv2.destroyAllWindows()
+stop_event.set()
+bank_watcher.stop()
+for stream in streams:
+    stream.capture.join(timeout=2)
+    for stage in stream.stages:
+        stage.join(timeout=2)
+identify_q.put(STOP)
+identify.join(timeout=2)
+
+for stream in streams:
+    stream.close(elapsed)
+
+print(f"📉 {identify_q.stats()}")
+print(f"📦 {detector.stats()} | {embedder.stats()}")
+print(f"📚 cat bank: {bank_watcher.stats()}")
+detector.close()
+embedder.close()
+
+if not args.headless:
+    cv2.destroyAllWindows()
@@ -0,0 +1,99 @@
+# motion_gate.py
+import time
+import threading
+import cv2
+import numpy as np
+
+# Decide per frame whether YOLO + DeepSort should run at all.
+# The bowl camera sees an empty, static scene most of the day, so a cheap
+# test on a downscaled grey frame (difference against a running-average
+# background) lets us skip detection until something moves.
+# Detection always runs while tracks are active, and at least once every
+# IDLE_INTERVAL seconds as a safety net (e.g. a cat that sits very still).
+
+GATE_WIDTH = 160              # downscaled width for the motion test
+DIFF_THRESHOLD = 25           # grey-level change that counts as motion
+MIN_CHANGED_FRAC = 0.003      # fraction of changed pixels that means "motion"
+BG_ALPHA = 0.05               # running-average background update rate
+IDLE_INTERVAL = 1.0           # seconds between detections while idle
+MOTION_HOLD = 1.0             # keep detecting this long after motion stops
+
+
+class MotionGate:
+    def __init__(
+        self,
+        width=GATE_WIDTH,
+        diff_threshold=DIFF_THRESHOLD,
+        min_changed_frac=MIN_CHANGED_FRAC,
+        alpha=BG_ALPHA,
+        idle_interval=IDLE_INTERVAL,
+        hold=MOTION_HOLD
+    ):
+        self.width = width
+        self.diff_threshold = diff_threshold
+        self.min_changed_frac = min_changed_frac
+        self.alpha = alpha
+        self.idle_interval = idle_interval
+        self.hold = hold
+
+        self.background = None
+        self.last_detect = -1e9
+        self.last_motion = -1e9
+
+        self.frames = 0
+        self.detected = 0
+        self.reasons = {"motion": 0, "tracks": 0, "idle": 0}
+        self._lock = threading.Lock()
+
+    def _motion(self, frame):
+        h, w = frame.shape[:2]
+        small = cv2.resize(
+            frame,
+            (self.width, max(1, int(h * self.width / w))),
+            interpolation=cv2.INTER_AREA
+        )
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (5, 5), 0).astype(np.float32)
+
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray
+            return True
+
+        diff = cv2.absdiff(gray, self.background)
+        cv2.accumulateWeighted(gray, self.background, self.alpha)
+        changed = np.count_nonzero(diff > self.diff_threshold) / diff.size
+        return changed >= self.min_changed_frac
+
+    def should_detect(self, frame, tracks_active, now=None):
+        """Return True if the full detector should run on this frame."""
+        now = time.monotonic() if now is None else now
+        moving = self._motion(frame)
+        if moving:
+            self.last_motion = now
+
+        reason = None
+        if tracks_active:
+            reason = "tracks"
+        elif now - self.last_motion <= self.hold:
+            reason = "motion"
+        elif now - self.last_detect >= self.idle_interval:
+            reason = "idle"
+
+        with self._lock:
+            self.frames += 1
+            if reason is not None:
+                self.detected += 1
+                self.reasons[reason] += 1
+        if reason is not None:
+            self.last_detect = now
+        return reason is not None
+
+    def duty_cycle(self):
+        with self._lock:
+            return self.detected / self.frames if self.frames else 0.0
+
+    def stats(self):
+        with self._lock:
+            reasons = " ".join(f"{k}={v}" for k, v in self.reasons.items())
+            pct = 100.0 * self.detected / self.frames if self.frames else 0.0
+            return f"frames={self.frames} detected={self.detected} ({pct:.1f}%) {reasons}"
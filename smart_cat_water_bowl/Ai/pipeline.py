@@ -0,0 +1,249 @@
+# pipeline.py
+import time
+import queue
+import threading
+
+# Small building blocks for the staged main loop:
+#   capture thread -> detect stage -> track stage -> identify pool
+# Stages are joined by bounded queues with an explicit drop-oldest policy,
+# so a slow stage sheds stale work instead of stalling the camera.
+# MicroBatcher merges model calls from concurrent callers into batches.
+
+STOP = object()  # end-of-stream marker, flows through every queue
+
+
+class DropOldestQueue(queue.Queue):
+    """Bounded queue whose put() never blocks.
+
+    When the queue is full the oldest item is discarded to make room,
+    so consumers always see the freshest data; `on_drop` is called with
+    each discarded item. With drop=False it behaves like a normal
+    blocking queue (replay, where every frame must be processed).
+    """
+
+    def __init__(self, maxsize, name="", drop=True, on_drop=None):
+        super().__init__(maxsize)
+        self.name = name
+        self.drop = drop
+        self.on_drop = on_drop
+        self.put_count = 0
+        self.dropped = 0
+
+    def put(self, item, block=True, timeout=None):
+        if not self.drop:
+            with self.mutex:
+                self.put_count += 1
+            return super().put(item, block, timeout)
+
+        dropped = None
+        with self.mutex:
+            self.put_count += 1
+            if self.maxsize > 0 and self._qsize() >= self.maxsize:
+                # evict the oldest real item, never STOP: the consumer
+                # would wait forever for an end-of-stream that was dropped
+                for i, old in enumerate(self.queue):
+                    if old is not STOP:
+                        del self.queue[i]
+                        dropped = old
+                        self.dropped += 1
+                        break
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+        if dropped is not None and self.on_drop:
+            self.on_drop(dropped)
+
+    def drain(self, limit):
+        """Pop up to `limit` more items without blocking."""
+        items = []
+        while len(items) < limit:
+            try:
+                items.append(self.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def stats(self):
+        return f"{self.name}: in={self.put_count} dropped={self.dropped}"
+
+
+class CaptureThread(threading.Thread):
+    """Read frames from `read_fn` as fast as the source delivers them.
+
+    read_fn() -> (ok, frame). (seq, capture_ts, frame) goes to `out_q`;
+    with a DropOldestQueue(maxsize=1) only the latest frame is ever kept.
+    clock() stamps each frame (a recorded source passes its media time).
+    """
+
+    def __init__(self, read_fn, out_q, stop_event, clock=time.time):
+        super().__init__(name="capture", daemon=True)
+        self.read_fn = read_fn
+        self.clock = clock
+        self.out_q = out_q
+        self.stop_event = stop_event
+        self.frames = 0
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                ok, frame = self.read_fn()
+                if not ok:
+                    break
+                self.out_q.put((self.frames, self.clock(), frame))
+                self.frames += 1
+        finally:
+            self.out_q.put(STOP)
+
+
+class Stage:
+    """Run `fn(item)` on `workers` threads pulling from `in_q`.
+
+    With batch > 1, fn receives a list: the item that woke the worker plus
+    whatever else is already queued (up to `batch` items).
+    Non-None results go to `out_q`. When STOP arrives every worker exits
+    and the last one forwards STOP downstream. Use workers=1 for stages
+    that must see items in order (e.g. the tracker).
+    """
+
+    def __init__(self, name, fn, in_q, out_q=None, workers=1, batch=1):
+        self.name = name
+        self.fn = fn
+        self.in_q = in_q
+        self.out_q = out_q
+        self.batch = batch
+        self.errors = 0
+        self._alive = workers
+        self._lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self):
+        for t in self.threads:
+            t.start()
+        return self
+
+    def join(self, timeout=None):
+        for t in self.threads:
+            t.join(timeout)
+
+    def is_alive(self):
+        return any(t.is_alive() for t in self.threads)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.in_q.get()
+            if item is STOP:
+                break
+
+            if self.batch > 1:
+                items = [item]
+                for extra in self.in_q.drain(self.batch - 1):
+                    if extra is STOP:
+                        stopping = True
+                        break
+                    items.append(extra)
+                item = items
+
+            try:
+                result = self.fn(item)
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ {self.name} stage error: {e}")
+                continue
+
+            if result is not None and self.out_q is not None:
+                self.out_q.put(result)
+
+        self.in_q.put(STOP)  # let sibling workers see it too
+        with self._lock:
+            self._alive -= 1
+            last = self._alive == 0
+        if last and self.out_q is not None:
+            self.out_q.put(STOP)
+
+
+class MicroBatcher:
+    """Merge calls from many threads into batched `fn(items)` calls.
+
+    submit(items) blocks until fn has processed them and returns their
+    results in order. A worker thread takes the first waiting request,
+    gathers whatever else arrives within `max_wait` seconds (up to
+    `max_batch` items), and calls fn(list) -> list of the same length.
+    fn only ever runs on the worker thread, so it may use objects that are
+    not thread-safe (a YOLO model, an ONNX session).
+    """
+
+    def __init__(self, fn, max_batch=32, max_wait=0.005, name="batcher"):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.name = name
+        self.calls = 0
+        self.items = 0
+        self._q = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, items):
+        items = list(items)
+        if not items:
+            return []
+        done = threading.Event()
+        job = {"items": items, "results": None, "error": None, "done": done}
+        self._q.put(job)
+        done.wait()
+        if job["error"] is not None:
+            raise job["error"]
+        return job["results"]
+
+    def close(self):
+        self._q.put(STOP)
+        self._thread.join(timeout=2)
+
+    def _run(self):
+        while True:
+            job = self._q.get()
+            if job is STOP:
+                return
+            jobs = [job]
+            n = len(job["items"])
+            deadline = time.monotonic() + self.max_wait
+            while n < self.max_batch:
+                try:
+                    extra = self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if extra is STOP:
+                    self._q.put(STOP)
+                    break
+                jobs.append(extra)
+                n += len(extra["items"])
+            self._process(jobs)
+
+    def _process(self, jobs):
+        flat = [item for job in jobs for item in job["items"]]
+        try:
+            results = []
+            for s in range(0, len(flat), self.max_batch):
+                results += list(self.fn(flat[s:s + self.max_batch]))
+                self.calls += 1
+            self.items += len(flat)
+        except Exception as e:
+            for job in jobs:
+                job["error"] = e
+                job["done"].set()
+            return
+
+        pos = 0
+        for job in jobs:
+            job["results"] = results[pos:pos + len(job["items"])]
+            pos += len(job["items"])
+            job["done"].set()
+
+    def stats(self):
+        avg = self.items / self.calls if self.calls else 0.0
+        return f"{self.name}: calls={self.calls} items={self.items} avg_batch={avg:.1f}"
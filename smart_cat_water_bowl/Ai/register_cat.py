@@ -1,22 +1,32 @@
 # register_cat.py
 import os
-import json
+import hashlib
 import cv2
 import numpy as np
-from embeddings import get_embedding
+from embeddings import EMBED_BATCH_SIZE
+from embed_backends import EMB_DIM
+from embed_cache import embed_encoded, read_image
+from cat_bank import (
+    ensure_bank, open_bank, append_embeddings, replace_cat, remove_cat, normalize_rows
+)
+from catalog import catalog_for
+from ann_index import on_cat_changed
 from device import get_or_create_device_id
 
 # โครงสร้างฐานข้อมูล local
 # cat_db/
+#   catalog.db                (cats / images / profiles, see catalog.py)
 #   users/
 #     {user_id}/
 #       devices/
 #         {device_id}/
-#           embeddings/
+#           bank/             (packed embeddings, see cat_bank.py)
 #           training_images/
-#           metadata.json
+#           metadata.json     (old layout: imported into catalog.db on first use,
+#                              `python catalog.py export` writes it back)
 
 BASE_DB = "cat_db/users"
+DEDUP_THRESHOLD = 0.97   # cosine above which a new photo adds nothing
 
 
 # ---------- utils ----------
@@ -24,16 +34,104 @@ def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
 
 
-def load_meta(path):
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+def save_cat(device_db, cat_id, embs, training_files, profile, cat_name=None,
+             image_hashes=None, rejected_hashes=()):
+    """Write a cat's bank rows + catalog entry. Returns rows written."""
+    n_rows = replace_cat(device_db, cat_id, embs)
+    on_cat_changed(device_db, cat_id, embs)
+
+    catalog, user_id, device_id = catalog_for(device_db)
+    catalog.save_cat(
+        user_id, device_id, cat_id,
+        name=cat_name or cat_id,
+        bank_rows=n_rows,
+        training_images=training_files,
+        profile=profile,
+        image_hashes=image_hashes,
+        rejected_hashes=rejected_hashes
+    )
+    return n_rows
+
+
+def append_cat(device_db, cat_id, embs, training_files, image_hashes, profile=None,
+               cat_name=None, rejected_hashes=()):
+    """Append rows to a cat (no rewrite) + its new images to the catalog."""
+    n_rows = append_embeddings(device_db, cat_id, embs)
+    on_cat_changed(device_db, cat_id, embs, replace=False)
+
+    catalog, user_id, device_id = catalog_for(device_db)
+    catalog.add_images(
+        user_id, device_id, cat_id,
+        [(path, h, None) for path, h in zip(training_files, image_hashes)]
+        + [(None, h, None) for h in rejected_hashes],
+        bank_rows=n_rows,
+        profile=profile,
+        name=cat_name
+    )
+    return n_rows
+
+
+def drop_cat(device_db, cat_id):
+    """Remove a cat's bank rows and catalog entry."""
+    remove_cat(device_db, cat_id)
+    on_cat_changed(device_db, cat_id)
+
+    catalog, user_id, device_id = catalog_for(device_db)
+    catalog.drop_cat(user_id, device_id, cat_id)
+
+
+def _remove_stale_images(device_db, paths):
+    """
+    Delete images of a previous registration this one did not overwrite
+    (earlier --append photos, higher-numbered {cat_id}_{n}.jpg). Only
+    files inside training_images/ are touched (catalog paths may come from
+    an imported metadata.json), and never one sync_from_storage's
+    manifest still tracks (it would be downloaded again).
+    """
+    from sync_from_storage import MANIFEST_FILE, SYNC_DIR, load_manifest
+
+    training_dir = os.path.realpath(os.path.join(device_db, "training_images"))
+    manifest = load_manifest(os.path.join(device_db, SYNC_DIR, MANIFEST_FILE))
+    synced = {os.path.realpath(os.path.join(device_db, e["image"])) for e in manifest.values()}
+
+    for path in paths:
+        full = os.path.realpath(os.path.join(device_db, path))
+        if os.path.dirname(full) != training_dir or full in synced:
+            continue
+        if os.path.isfile(full):
+            os.remove(full)
 
 
-def save_meta(path, meta):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(meta, f, indent=2, ensure_ascii=False)
+# ---------- dedup ----------
+def image_hash(data):
+    """Content hash of an uploaded image file (its bytes)."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def select_new(embs, gallery=None, threshold=DEDUP_THRESHOLD):
+    """
+    Indices of the rows of `embs` to keep: a row is dropped when its cosine
+    to a gallery row or to an already-kept new row exceeds `threshold`
+    (None = keep all).
+    """
+    if threshold is None or len(embs) == 0:
+        return list(range(len(embs)))
+
+    rows = normalize_rows(embs)
+    if gallery is not None and len(gallery):
+        best_old = (rows @ normalize_rows(gallery).T).max(axis=1)
+    else:
+        best_old = np.full(len(rows), -1.0, dtype=np.float32)
+    among_new = rows @ rows.T
+
+    keep = []
+    for i in range(len(rows)):
+        if best_old[i] > threshold:
+            continue
+        if keep and among_new[i, keep].max() > threshold:
+            continue
+        keep.append(i)
+    return keep
 
 
 # ---------- CORE FUNCTION ----------
@@ -42,7 +140,9 @@ def register_cat(
     device_id: str,
     cat_id: str,
     image_paths: list,
-    cat_name: str | None = None
+    cat_name: str | None = None,
+    incremental: bool = False,
+    dedup_threshold: float | None = DEDUP_THRESHOLD
 ):
     """
     🔥 ฟังก์ชันเดียวที่ AI ต้องใช้
@@ -52,74 +152,127 @@ def register_cat(
     cat_id    = Firestore cat document ID (ใช้เป็น UID หลัก)
     image_paths = list path รูปที่ดึงมาจาก Firebase Storage
     cat_name  = (optional) ชื่อแมวจาก Firestore
+    incremental = True: keep the cat's rows and append only images not
+                  registered before (same file bytes) and not
+                  near-duplicates of its gallery
+    dedup_threshold = (incremental only) cosine above which an image
+                  counts as a near-duplicate (None = keep every distinct
+                  image); a full registration keeps every photo given
     """
 
     # path หลัก
     device_db = os.path.join(BASE_DB, user_id, "devices", device_id)
-    embeddings_dir = os.path.join(device_db, "embeddings")
     training_dir = os.path.join(device_db, "training_images")
-    metadata_path = os.path.join(device_db, "metadata.json")
 
-    ensure_dir(embeddings_dir)
     ensure_dir(training_dir)
 
-    meta = load_meta(metadata_path)
+    # old devices still have embeddings/*.npy -> pack them before appending
+    ensure_bank(device_db)
 
-    emb_files = []
-    training_files = []
+    catalog, scope_user, scope_device = catalog_for(device_db)
+    entry = catalog.get_cat(scope_user, scope_device, cat_id)
+    if incremental and entry is None:
+        incremental = False  # nothing registered yet: a normal registration
+
+    # photos already in the gallery (incremental), then every kept new one:
+    # near-duplicates are checked against both
+    known = np.empty((0, EMB_DIM), dtype=np.float32)
+    if incremental:
+        bank = open_bank(device_db)
+        if bank is not None:
+            known = bank.embeddings_for(cat_id)
+        del bank
+
+    # one EMBED_BATCH_SIZE chunk of photos in memory at a time:
+    # read -> embed -> dedup -> write its training images
+    seen = set()
+    kept_embs, training_files, hashes = [], [], []
+    rejected = []   # near-duplicates: recorded so --append skips them unread
     profile_img = None
+    n_read = n_near = 0
 
-    for idx, img_path in enumerate(image_paths):
-        img = cv2.imread(img_path)
-        if img is None:
-            print(f"❌ Cannot read image: {img_path}")
+    for start in range(0, len(image_paths), EMBED_BATCH_SIZE):
+        # ----- read + drop exact duplicates (by content hash) -----
+        datas, images, chunk_hashes = [], [], []
+        for img_path in image_paths[start:start + EMBED_BATCH_SIZE]:
+            try:
+                data, img = read_image(img_path)
+            except OSError:
+                img = None
+            if img is None:
+                print(f"❌ Cannot read image: {img_path}")
+                continue
+            h = image_hash(data)
+            if h in seen or (incremental and catalog.has_hash(scope_user, scope_device, cat_id, h)):
+                continue
+            seen.add(h)
+            datas.append(data)
+            images.append(img)
+            chunk_hashes.append(h)
+        n_read += len(images)
+        if not images:
             continue
 
-        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        emb = get_embedding(rgb)
-
-        # ----- save embedding -----
-        emb_name = f"{cat_id}_{idx+1}.npy"
-        np.save(
-            os.path.join(embeddings_dir, emb_name),
-            emb
-        )
-        emb_files.append(os.path.join("embeddings", emb_name))
-
-        # ----- save training image -----
-        img_name = f"{cat_id}_{idx+1}.jpg"
-        cv2.imwrite(
-            os.path.join(training_dir, img_name),
-            img
-        )
-        training_files.append(os.path.join("training_images", img_name))
-
-        # ----- profile image -----
-        if idx == 0:
-            profile_img = os.path.join(
-                "training_images",
-                f"{cat_id}_profile.jpg"
-            )
+        # ----- embed (through the shared cache: re-registering the same
+        # photos skips the CNN) -----
+        embs = embed_encoded(datas, images)
+        del datas
+
+        # ----- drop near-duplicates of the gallery / of each other -----
+        keep = select_new(embs, known, dedup_threshold if incremental else None)
+        n_near += len(embs) - len(keep)
+        kept = set(keep)
+        rejected += [h for i, h in enumerate(chunk_hashes) if i not in kept]
+        known = np.concatenate([known, embs[keep]])
+        kept_embs.append(embs[keep])
+
+        for i in keep:
+            img, h = images[i], chunk_hashes[i]
+            idx = len(training_files)
+
+            # ----- save training image -----
+            img_name = f"{cat_id}_{h[:12]}.jpg" if incremental else f"{cat_id}_{idx+1}.jpg"
             cv2.imwrite(
-                os.path.join(device_db, profile_img),
+                os.path.join(training_dir, img_name),
                 img
             )
+            training_files.append(os.path.join("training_images", img_name))
+            hashes.append(h)
+
+            # ----- profile image -----
+            if idx == 0 and not (incremental and entry.get("profile")):
+                profile_img = os.path.join(
+                    "training_images",
+                    f"{cat_id}_profile.jpg"
+                )
+                cv2.imwrite(
+                    os.path.join(device_db, profile_img),
+                    img
+                )
+
+    n_exact = len(image_paths) - n_read
+    embs = np.concatenate(kept_embs) if kept_embs else np.empty((0, EMB_DIM), dtype=np.float32)
 
-    # ----- update metadata -----
-    meta[cat_id] = {
-        "name": cat_name or cat_id,
-        "embeddings": emb_files,
-        "training_images": training_files,
-        "profile": profile_img
-    }
+    # ----- save embeddings (packed bank) + catalog -----
+    if incremental:
+        n_rows = append_cat(device_db, cat_id, embs, training_files, hashes,
+                            profile_img, cat_name, rejected_hashes=rejected)
+        total = entry.get("bank_rows", 0) + n_rows
+    else:
+        n_rows = save_cat(device_db, cat_id, embs, training_files, profile_img,
+                          cat_name, image_hashes=hashes, rejected_hashes=rejected)
+        total = n_rows
 
-    save_meta(metadata_path, meta)
+        if entry:
+            _remove_stale_images(device_db, set(entry["training_images"]) - set(training_files))
 
     print(
         f"✅ Registered cat UID={cat_id} "
-        f"(images={len(emb_files)}) "
+        f"(+{n_rows} images, {total} total, skipped {n_exact} seen/unreadable "
+        f"+ {n_near} near-duplicates) "
         f"for USER={user_id} DEVICE={device_id}"
     )
+    return n_rows
 
 
 # ---------- optional CLI (debug only) ----------
@@ -132,6 +285,10 @@ if __name__ == "__main__":
     parser.add_argument("images", nargs="+")
     parser.add_argument("--name", required=False)
     parser.add_argument("--device", required=False)
+    parser.add_argument("--append", action="store_true",
+                        help="Add only new images to an already registered cat")
+    parser.add_argument("--dedup", type=float, default=DEDUP_THRESHOLD,
+                        help="--append: near-duplicate cosine threshold (>= 1 keeps all)")
     args = parser.parse_args()
 
     device_id = args.device or get_or_create_device_id()
@@ -141,5 +298,7 @@ if __name__ == "__main__":
         device_id=device_id,
         cat_id=args.cat_id,
         cat_name=args.name,
-        image_paths=args.images
+        image_paths=args.images,
+        incremental=args.append,
+        dedup_threshold=args.dedup if args.dedup < 1 else None
     )
@@ -0,0 +1,111 @@
+# startup_budget.py
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+# Startup-time check for the Ai CLIs: runs `python -X importtime <script> --help`
+# for each script and fails when one takes longer than the budget or imports
+# a heavy package (those must only load on first use, see lazy.py).
+#
+# python startup_budget.py [--budget 1.0] [--top 5]
+
+AI_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = [
+    "sync_from_storage.py",
+    "register_cat.py",
+    "update_cat.py",
+    "test_image.py",
+    "identify_service.py",
+    "main.py",
+    "video_source.py",
+    "cat_bank.py",
+    "embed_backends.py",
+    "embed_cache.py",
+    "catalog.py",
+    "ann_index.py",
+]
+HEAVY_MODULES = (
+    "torch",
+    "torchvision",
+    "ultralytics",
+    "onnxruntime",
+    "deep_sort_realtime",
+    "firebase_admin",
+    "google.cloud",
+)
+BUDGET_SECONDS = 1.0
+
+
+def parse_importtime(stderr):
+    """Return [(module, cumulative_us)] for top-level imports in -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [p.strip() for p in line[len("import time:"):].split("|")]
+        if len(parts) != 3 or not parts[1].isdigit():
+            continue
+        name = parts[2]
+        # nesting is shown by indentation; top-level imports have none
+        if name == name.lstrip():
+            rows.append((name, int(parts[1])))
+    return rows
+
+
+def imported_modules(stderr):
+    return {
+        line.rsplit("|", 1)[-1].strip()
+        for line in stderr.splitlines()
+        if line.startswith("import time:") and "|" in line
+    }
+
+
+def measure(script):
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", script, "--help"],
+        cwd=AI_DIR,
+        capture_output=True,
+        text=True
+    )
+    elapsed = time.perf_counter() - t0
+
+    modules = imported_modules(proc.stderr)
+    heavy = sorted(
+        h for h in HEAVY_MODULES
+        if any(m == h or m.startswith(h + ".") for m in modules)
+    )
+    top = sorted(parse_importtime(proc.stderr), key=lambda r: -r[1])
+    return {
+        "script": script,
+        "seconds": elapsed,
+        "returncode": proc.returncode,
+        "heavy": heavy,
+        "top": top,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check CLI startup time (import budget)")
+    parser.add_argument("--budget", type=float, default=BUDGET_SECONDS, help="Seconds per script")
+    parser.add_argument("--top", type=int, default=5, help="Slowest imports to list")
+    parser.add_argument("scripts", nargs="*", default=SCRIPTS)
+    args = parser.parse_args()
+
+    failed = False
+    for script in args.scripts:
+        r = measure(script)
+        ok = r["seconds"] <= args.budget and not r["heavy"] and r["returncode"] == 0
+        failed |= not ok
+
+        print(f"{'✅' if ok else '❌'} {script}: {r['seconds']:.2f}s (budget {args.budget:.2f}s)")
+        if r["returncode"] != 0:
+            print(f"   exit code {r['returncode']}")
+        if r["heavy"]:
+            print(f"   heavy imports: {', '.join(r['heavy'])}")
+        for name, us in r["top"][:args.top]:
+            print(f"   {us / 1e6:6.3f}s  {name}")
+
+    sys.exit(1 if failed else 0)
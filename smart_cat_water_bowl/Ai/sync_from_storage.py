@@ -1,69 +1,338 @@
 # sync_from_storage.py
 import os
+import json
+import shutil
+import base64
+import hashlib
 import tempfile
 import argparse
-from firebase_init import bucket
-from register_cat import register_cat
+import itertools
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import numpy as np
+from embeddings import EMBED_BATCH_SIZE
+from embed_cache import cache_version, embed_encoded, read_image
+from register_cat import BASE_DB, ensure_dir, save_cat, drop_cat
+from cat_bank import ensure_bank
 from device import get_or_create_device_id
 
+# Incremental sync: a manifest remembers every blob already embedded
+# {device_db}/
+#   sync/
+#     manifest.json     # {blob_name: {"cat": uid, "generation": .., "md5": ..,
+#                       #              "image": "training_images/..", "emb": "<key>" | null}}
+#     embeddings/<key>.npy   # one embedding per image
+#                            # (key = content md5 + embed_cache.cache_version())
+# Only blobs that are new or whose generation/md5 changed are downloaded
+# and embedded; blobs gone from storage drop their rows. After a model or
+# preprocessing change the stored embeddings no longer match the key, and
+# the local training images are re-embedded (no download). Every cat that
+# changed is rewritten in the bank from its stored per-image embeddings,
+# so untouched images are never re-embedded. With no changes a sync is one
+# list call.
 
-def sync_user_from_storage(user_id):
+SYNC_DIR = "sync"
+MANIFEST_FILE = "manifest.json"
+EMB_DIR = "embeddings"
+SYNC_WORKERS = 8            # parallel downloads
+INFLIGHT_PER_WORKER = 2     # downloads queued / held in memory per worker
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+
+# ---------- manifest ----------
+def load_manifest(path):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(path, manifest):
+    # write + rename: an interrupted sync keeps the previous manifest
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _content_key(blob):
+    """Hex md5 of the blob (from the listing), else name + generation."""
+    if getattr(blob, "md5_hash", None):
+        return base64.b64decode(blob.md5_hash).hex()
+    return hashlib.md5(f"{blob.name}#{blob.generation}".encode("utf-8")).hexdigest()
+
+
+def _emb_key(md5, version):
+    """Name of the stored embedding of an image for one embedding version."""
+    return hashlib.md5(f"{md5}|{version}".encode("utf-8")).hexdigest()
+
+
+def list_remote(bucket, user_id):
+    """One list call -> { blob_name: (cat_uid, filename, blob) }"""
+    remote = {}
+    for blob in bucket.list_blobs(prefix=f"cats/{user_id}/"):
+        parts = blob.name.split("/")  # cats/{user}/{cat_uid}/xxx.jpg
+        if len(parts) != 4:
+            continue
+        _, _, cat_uid, filename = parts
+        if not filename.lower().endswith(IMAGE_EXTS):
+            continue
+        remote[blob.name] = (cat_uid, filename, blob)
+    return remote
+
+
+def plan_sync(remote, manifest, version):
+    """
+    Return (blob names to fetch, blob names deleted from storage,
+    unchanged blob names embedded with another `version`).
+    """
+    fetch, stale = [], []
+    for name, (_, _, blob) in remote.items():
+        known = manifest.get(name)
+        if (
+            known is None
+            or known.get("generation") != getattr(blob, "generation", None)
+            or known.get("md5") != _content_key(blob)
+        ):
+            fetch.append(name)
+        elif known.get("emb") and known["emb"] != _emb_key(known["md5"], version):
+            stale.append(name)
+    deleted = [name for name in manifest if name not in remote]
+    return fetch, deleted, stale
+
+
+# ---------- download (worker threads) ----------
+def _fetch(blob, tmp_dir, dest):
+    """
+    Download + decode one image; the file is moved to `dest` if it decodes.
+    return: (file bytes, BGR image or None)
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix=os.path.splitext(dest)[1])
+    os.close(fd)
+    try:
+        blob.download_to_filename(tmp_path)
+        data, img = read_image(tmp_path)
+        if img is not None:
+            os.replace(tmp_path, dest)
+        return data, img
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _download(pool, jobs, tmp_dir, max_inflight):
     """
-    🔥 ดึงแมวทั้งหมดของ user จาก Firebase Storage
+    Run _fetch over jobs = [(blob, dest, info), ...], at most `max_inflight`
+    at a time, so the decoded images waiting for the CNN stay bounded.
+    yields: (info, future) in completion order
+    """
+    jobs = iter(jobs)
+    futures = {}
+    while True:
+        for blob, dest, info in itertools.islice(jobs, max_inflight - len(futures)):
+            futures[pool.submit(_fetch, blob, tmp_dir, dest)] = info
+        if not futures:
+            return
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for fut in done:
+            yield futures.pop(fut), fut   # nothing keeps a consumed result
+
+
+# ---------- sync ----------
+def sync_user_from_storage(user_id, bucket=None, device_id=None, base_db=BASE_DB,
+                           workers=SYNC_WORKERS):
+    """
+    🔥 ดึงแมวทั้งหมดของ user จาก Firebase Storage (เฉพาะรูปใหม่ / ที่เปลี่ยน)
     โครงสร้างที่คาดหวัง:
     cats/{user_id}/{cat_uid}/*.jpg
+
+    bucket: google.cloud.storage Bucket (default: firebase_init) or a LocalBucket
+    return: summary dict
     """
+    if bucket is None:
+        from firebase_init import get_bucket
+        bucket = get_bucket()
 
-    device_id = get_or_create_device_id()
+    device_id = device_id or get_or_create_device_id()
     print(f"🔗 Sync USER={user_id} DEVICE={device_id}")
 
-    prefix = f"cats/{user_id}/"
-    blobs = bucket.list_blobs(prefix=prefix)
+    device_db = os.path.join(base_db, user_id, "devices", device_id)
+    sync_dir = os.path.join(device_db, SYNC_DIR)
+    emb_dir = os.path.join(sync_dir, EMB_DIR)
+    training_dir = os.path.join(device_db, "training_images")
+    manifest_path = os.path.join(sync_dir, MANIFEST_FILE)
 
-    cats = {}  # cat_uid -> [image paths]
+    manifest = load_manifest(manifest_path)
+    remote = list_remote(bucket, user_id)
+    version = cache_version()
+    fetch, deleted, stale = plan_sync(remote, manifest, version)
 
-    temp_dir = tempfile.mkdtemp()
+    summary = {
+        "listed": len(remote), "downloaded": 0, "embedded": 0,
+        "failed": 0, "deleted": len(deleted), "cats_updated": 0,
+    }
+    if not fetch and not deleted and not stale:
+        print(f"✅ Up to date ({len(remote)} images)")
+        return summary
 
-    for blob in blobs:
-        name = blob.name  # cats/{user}/{cat_uid}/xxx.jpg
-        parts = name.split("/")
+    print(
+        f"🐱 {len(fetch)} new/changed, {len(deleted)} deleted, "
+        f"{len(stale)} to re-embed of {len(remote)} images"
+    )
+    ensure_dir(emb_dir)
+    ensure_dir(training_dir)
+    ensure_bank(device_db)
 
-        if len(parts) < 4:
-            continue
+    changed_cats = set()
 
-        _, uid, cat_uid, filename = parts
+    # ----- deletions -----
+    for name in deleted:
+        entry = manifest.pop(name)
+        changed_cats.add(entry["cat"])
+        _remove_local(device_db, entry)
+        if entry.get("emb"):
+            _remove_emb(device_db, entry["emb"], manifest)
 
-        if not filename.lower().endswith((".jpg", ".jpeg", ".png")):
+    # ----- downloads (pool) overlapped with batched embedding (here) -----
+    pending_datas, pending_imgs, pending_names = [], [], []
+
+    def flush():
+        if not pending_imgs:
+            return
+        # the shared cache still spares the CNN for photos this machine
+        # embedded before (e.g. a wiped manifest, or registered by hand)
+        embs = embed_encoded(pending_datas, pending_imgs, bgr=True)
+        for name, emb in zip(pending_names, embs):
+            key = _emb_key(manifest[name]["md5"], version)
+            np.save(os.path.join(emb_dir, f"{key}.npy"), emb)
+            manifest[name]["emb"] = key
+        summary["embedded"] += len(pending_imgs)
+        pending_datas.clear()
+        pending_imgs.clear()
+        pending_names.clear()
+
+    def queue_embed(name, data, img):
+        pending_datas.append(data)
+        pending_imgs.append(img)
+        pending_names.append(name)
+        if len(pending_imgs) >= EMBED_BATCH_SIZE:
+            flush()
+
+    # ----- unchanged images embedded by another model version -----
+    for name in stale:
+        entry = manifest[name]
+        try:
+            data, img = read_image(os.path.join(device_db, entry["image"]))
+        except OSError:
+            img = None
+        if img is None:
+            fetch.append(name)  # local copy gone: download it again
             continue
+        changed_cats.add(entry["cat"])
+        old_key, entry["emb"] = entry["emb"], None
+        _remove_emb(device_db, old_key, manifest)
+        queue_embed(name, data, img)
 
-        local_path = os.path.join(temp_dir, f"{cat_uid}_{filename}")
-        blob.download_to_filename(local_path)
+    with tempfile.TemporaryDirectory(dir=sync_dir) as tmp_dir, \
+            ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        jobs = []
+        for name in fetch:
+            cat_uid, filename, blob = remote[name]
+            image = os.path.join("training_images", f"{cat_uid}_{filename}")
+            jobs.append((
+                blob, os.path.join(device_db, image),
+                (name, cat_uid, blob, image, manifest.get(name))
+            ))
+        downloads = _download(pool, jobs, tmp_dir, max(1, workers) * INFLIGHT_PER_WORKER)
 
-        cats.setdefault(cat_uid, []).append(local_path)
+        for (name, cat_uid, blob, image, old), fut in downloads:
+            try:
+                data, img = fut.result()
+            except Exception as e:
+                print(f"❌ Download failed: {name} ({e})")
+                summary["failed"] += 1
+                continue  # not in the manifest -> retried next sync
 
-    if not cats:
-        print("❌ No cats found in storage")
-        return
+            summary["downloaded"] += 1
+            changed_cats.add(cat_uid)
+            key = _emb_key(_content_key(blob), version)
+            if old is not None and old.get("emb") and old["emb"] != key:
+                _remove_emb(device_db, old["emb"], manifest, keep=name)
+
+            manifest[name] = {
+                "cat": cat_uid,
+                "generation": getattr(blob, "generation", None),
+                "md5": _content_key(blob),
+                "image": image,
+                "emb": None,
+            }
 
-    print(f"🐱 Found {len(cats)} cats in storage")
+            if img is None:
+                print(f"❌ Cannot read image: {name}")
+                continue
+            if os.path.exists(os.path.join(emb_dir, f"{key}.npy")):
+                manifest[name]["emb"] = key  # same content seen before
+                continue
 
-    for cat_uid, image_paths in cats.items():
-        print(f"➡️ Register CAT={cat_uid} ({len(image_paths)} images)")
-        register_cat(
-            user_id=user_id,
-            device_id=device_id,
-            cat_id=cat_uid,          # 🔥 ใช้ Firestore UID ตรง ๆ
-            image_paths=image_paths,
-            cat_name=cat_uid         # optional
+            queue_embed(name, data, img)
+
+        flush()
+
+    # ----- rewrite the bank rows of every cat that changed -----
+    for cat_uid in sorted(changed_cats):
+        entries = sorted(
+            (name, e) for name, e in manifest.items() if e["cat"] == cat_uid
+        )
+        embs = [
+            np.load(os.path.join(emb_dir, f"{e['emb']}.npy"))
+            for _, e in entries if e.get("emb")
+        ]
+        profile = os.path.join("training_images", f"{cat_uid}_profile.jpg")
+        if not embs:
+            drop_cat(device_db, cat_uid)
+            _remove_local(device_db, {"image": profile})
+            print(f"🗑️ Removed CAT={cat_uid}")
+            continue
+
+        training_files = [e["image"] for _, e in entries if e.get("emb")]
+        shutil.copyfile(
+            os.path.join(device_db, training_files[0]),
+            os.path.join(device_db, profile)
         )
+        n_rows = save_cat(device_db, cat_uid, np.stack(embs), training_files, profile)
+        print(f"➡️ Updated CAT={cat_uid} ({n_rows} images)")
+
+    summary["cats_updated"] = len(changed_cats)
+    save_manifest(manifest_path, manifest)
+    print(f"✅ Sync completed: {summary}")
+    return summary
 
-    print("✅ Sync completed")
+
+def _remove_local(device_db, entry):
+    path = os.path.join(device_db, entry["image"])
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _remove_emb(device_db, key, manifest, keep=None):
+    """Delete embeddings/<key>.npy unless another manifest entry still uses it."""
+    if any(e.get("emb") == key for name, e in manifest.items() if name != keep):
+        return
+    path = os.path.join(device_db, SYNC_DIR, EMB_DIR, f"{key}.npy")
+    if os.path.exists(path):
+        os.remove(path)
 
 
 # ---------- CLI ----------
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--user", required=True, help="Firebase User UID")
+    parser.add_argument("--local-bucket", help="Sync from a local folder instead of Firebase")
+    parser.add_argument("--workers", type=int, default=SYNC_WORKERS, help="Parallel downloads")
     args = parser.parse_args()
 
-    sync_user_from_storage(args.user)
+    bucket = None
+    if args.local_bucket:
+        from local_bucket import LocalBucket
+        bucket = LocalBucket(args.local_bucket)
+
+    sync_user_from_storage(args.user, bucket=bucket, workers=args.workers)
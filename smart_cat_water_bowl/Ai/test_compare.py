@@ -1,22 +1,17 @@
 import os
-import cv2
-import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
-from embeddings import get_embedding
+from embed_cache import embed_files
 
 THRESHOLD = 0.83   # conservative
 
 
 def load_cat_embeddings(cat_dir):
-    embs = []
-    for fn in os.listdir(cat_dir):
-        if fn.lower().endswith((".jpg", ".png")):
-            img = cv2.imread(os.path.join(cat_dir, fn))
-            if img is None:
-                continue
-            rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            embs.append(get_embedding(rgb))
-    return np.array(embs)
+    paths = [
+        os.path.join(cat_dir, fn) for fn in os.listdir(cat_dir)
+        if fn.lower().endswith((".jpg", ".png"))
+    ]
+    embs, _, _ = embed_files(paths, images=False)
+    return embs
 
 
 cat_A = load_cat_embeddings("cat_A")
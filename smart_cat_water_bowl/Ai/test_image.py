@@ -1,186 +1,326 @@
 import cv2
 import os
+import csv
+import glob
 import json
 import time
 import argparse
-import numpy as np
-from ultralytics import YOLO
-from sklearn.metrics.pairwise import cosine_similarity
-from embeddings import get_embedding
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from detector import parse_roi
 from device import get_or_create_device_id
+from identify_service import SERVICE_URL, Identifier, call_service
 
-MODEL_PATH = "yolov8n.pt"
-SIM_THRESHOLD = 0.8
+# Thin client: identification runs in identify_service.py (models warm,
+# banks cached). Without a running service the same code runs in-process,
+# paying the model loads on every call.
+#
+# Batch mode (headless) re-scores directories / globs with a process pool,
+# each worker loading the models once:
+#   python test_image.py --user U --batch "cat_db/users/U/devices/D/camera_images" \
+#       --out results.jsonl --workers 4 --annotate annotated/
 
 BASE_DB = "cat_db/users"
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+BATCH_IMAGES = 32        # images per identify() call in a worker
+DECODE_THREADS = 4       # image decoding threads per worker
+CSV_FIELDS = ["image", "x1", "y1", "x2", "y2", "conf", "quality", "cat_uid", "score", "skipped", "error"]
 
-model = YOLO(MODEL_PATH)
 
-
-# ---------- LOAD USER'S CAT EMBEDDINGS (UID = doc id) ----------
-def load_user_cats(user_id, device_id=None):
-    """Load cat embeddings for a user and optional device.
-    Return: { cat_uid: [emb1, emb2, ...] }
+# ---------- IDENTIFY (service, else in-process) ----------
+def identify_request(payload, server=SERVICE_URL):
+    """
+    Only a service that cannot be reached falls back to in-process; a
+    service that answered with an error or timed out is reported (running
+    the request again here would hide the error / double the wait).
     """
-    base_user = os.path.join(BASE_DB, user_id)
-    device_db = None
-    if device_id:
-        device_db = os.path.join(base_user, "devices", device_id)
+    if server:
+        try:
+            return call_service(server, "/identify", payload)
+        except HTTPError as e:
+            try:
+                detail = json.loads(e.read()).get("error", e.reason)
+            except ValueError:
+                detail = e.reason
+            raise RuntimeError(f"❌ Identification service error {e.code}: {detail}") from e
+        except (URLError, ConnectionError, TimeoutError) as e:
+            # a read timeout comes bare, a connect timeout as URLError.reason
+            if isinstance(e, TimeoutError) or isinstance(getattr(e, "reason", None), TimeoutError):
+                raise RuntimeError(
+                    f"❌ Identification service at {server} timed out (use --local to skip it)"
+                ) from e
+            print(f"ℹ️ No identification service at {server}, running in-process")
+
+    identifier = Identifier(BASE_DB)
+    try:
+        return identifier.handle(payload)
+    finally:
+        identifier.close()
+
+
+def draw_detections(img, detections, roi=None):
+    """Draw identified (green) / unknown (red) boxes; return the found cat UIDs."""
+    found_cats = []
+    for det in detections:
+        if det["skipped"]:
+            continue
+        x1, y1, x2, y2 = det["box"]
+        cat_uid, confidence = det["cat_uid"], det["score"]
+
+        if cat_uid:
+            label = f"{cat_uid} ({confidence:.2f})"
+            color = (0, 255, 0)
+            found_cats.append(cat_uid)
+        else:
+            label = "Unknown"
+            color = (0, 0, 255)
+
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(
+            img,
+            label,
+            (x1, y1 - 10),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.8,
+            color,
+            2
+        )
+
+    zone = parse_roi(roi)
+    if zone is not None:
+        zone.draw(img)
+    return found_cats
 
-    search_paths = []
-    if device_db:
-        search_paths.append(device_db)
-    search_paths.append(base_user)
 
-    cat_embeddings = {}
+# ---------- TEST IMAGE ----------
+def test_image_for_user(user_id, image_path, device_id=None, roi=None, imgsz=None,
+                        server=SERVICE_URL, show=True):
+    if device_id is None:
+        device_id = get_or_create_device_id()
 
-    for root in search_paths:
-        metadata_path = os.path.join(root, "metadata.json")
-        if not os.path.exists(metadata_path):
-            continue
+    img = cv2.imread(image_path)
+    if img is None:
+        print(f"❌ Cannot load image: {image_path}")
+        return
 
-        with open(metadata_path, "r", encoding="utf-8") as f:
-            meta = json.load(f)
+    response = identify_request({
+        "user": user_id,
+        "device": device_id,
+        "roi": roi,
+        "imgsz": imgsz,
+        "save_crops": True,
+        "images": [{"path": os.path.abspath(image_path)}],
+    }, server)
 
-        for cat_uid, entry in meta.items():
-            emb_files = []
-            if isinstance(entry, dict):
-                emb_files = entry.get("embeddings", [])
-            elif isinstance(entry, list):
-                emb_files = entry
+    if not response["cats"]:
+        print(f"❌ No cats registered for USER={user_id}")
+        return
 
-            embs = []
-            for fn in emb_files:
-                path = os.path.join(root, fn)
-                if os.path.exists(path):
-                    try:
-                        embs.append(np.load(path))
-                    except Exception:
-                        continue
+    print(f"✅ Loaded {response['cats']} cats for USER={user_id}")
 
-            if embs:
-                # ✅ เก็บเป็น list (ไม่ใช้ mean)
-                cat_embeddings[cat_uid] = embs
+    detections = response["results"][0].get("detections", [])
+    skipped = sum(d["skipped"] for d in detections)
+    print(f"🔎 Quality gate: {len(detections)} boxes, {skipped} skipped")
 
-        if cat_embeddings:
-            break
+    found_cats = draw_detections(img, detections, roi)
 
-    return cat_embeddings
+    print("\n" + "=" * 50)
+    print(f"🔍 Test Results for USER={user_id}")
+    print("=" * 50)
 
+    if found_cats:
+        for uid in found_cats:
+            print(f"🐱 Found cat UID: {uid}")
+    else:
+        print("❌ No registered cats found")
 
-# ---------- IDENTIFY CAT (MAX SIMILARITY) ----------
-def identify_cat_by_uid(emb, cat_embeddings):
-    best_score, best_cat_uid = 0.0, None
+    print("=" * 50 + "\n")
 
-    for cat_uid, ref_emb_list in cat_embeddings.items():
-        scores = cosine_similarity([emb], ref_emb_list)[0]
-        score = float(np.max(scores))  # ✅ ใช้ค่า max
+    if show:
+        cv2.imshow(f"Test Image - USER={user_id}", img)
+        cv2.waitKey(0)
+        cv2.destroyAllWindows()
+    return response
+
+
+# ---------- BATCH (headless) ----------
+def expand_inputs(inputs):
+    """Directories (recursive) and glob patterns -> sorted image paths."""
+    paths = set()
+    for spec in inputs:
+        if os.path.isdir(spec):
+            for root, _, files in os.walk(spec):
+                paths.update(
+                    os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTS)
+                )
+        else:
+            paths.update(
+                p for p in glob.glob(spec, recursive=True) if p.lower().endswith(IMAGE_EXTS)
+            )
+    return sorted(paths)
 
-        if score > best_score:
-            best_score, best_cat_uid = score, cat_uid
 
-    if best_score >= SIM_THRESHOLD:
-        return best_cat_uid, best_score
+_worker = None   # per-process Identifier (models load once per worker)
 
-    return None, best_score
 
+def _init_worker(base_db, threads=None):
+    global _worker
+    if threads:
+        # before torch / onnxruntime load: N workers must not each use every core
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+        cv2.setNumThreads(threads)
+    _worker = Identifier(base_db)
 
-# ---------- TEST IMAGE ----------
-def test_image_for_user(user_id, image_path, device_id=None):
-    if device_id is None:
-        device_id = get_or_create_device_id()
 
-    cat_embeddings = load_user_cats(user_id, device_id=device_id)
+def _identify_chunk(user_id, paths, device_id, roi, imgsz, annotate_dir):
+    """Decode (threads) + identify one chunk; return (cats, [row per image])."""
+    with ThreadPoolExecutor(max_workers=DECODE_THREADS) as pool:
+        images = list(pool.map(cv2.imread, paths))
 
-    if not cat_embeddings:
-        print(f"❌ No cats registered for USER={user_id}")
-        return
+    response = _worker.identify(user_id, images, device_id=device_id, roi=roi, imgsz=imgsz)
 
-    print(f"✅ Loaded {len(cat_embeddings)} cats for USER={user_id}")
+    rows = []
+    for path, img, result in zip(paths, images, response["results"]):
+        rows.append({"image": path, **result})
+        if annotate_dir and img is not None:
+            draw_detections(img, result["detections"], roi)
+            cv2.imwrite(os.path.join(annotate_dir, _annotated_name(path)), img)
+    return response["cats"], rows
 
-    img = cv2.imread(image_path)
-    if img is None:
-        print(f"❌ Cannot load image: {image_path}")
-        return
 
-    results = model(img, conf=0.4, verbose=False)
-    found_cats = []
+def _annotated_name(path):
+    # keep the parent folder: camera_images of several devices share file names
+    parent = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    return f"{parent}_{os.path.basename(path)}"
 
-    device_db = None
-    if device_id:
-        device_db = os.path.join(BASE_DB, user_id, "devices", device_id)
-        cam_dir = os.path.join(device_db, "camera_images")
-        os.makedirs(cam_dir, exist_ok=True)
-    else:
-        cam_dir = None
-
-    for r in results:
-        for box in r.boxes:
-            if model.names[int(box.cls[0])] != "cat":
-                continue
-
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            crop = img[y1:y2, x1:x2]
-            if crop.size == 0:
-                continue
-
-            rgb = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
-            emb = get_embedding(rgb)
-
-            cat_uid, confidence = identify_cat_by_uid(emb, cat_embeddings)
-
-            if cam_dir:
-                ts = int(time.time() * 1000)
-                name = cat_uid if cat_uid else "unknown"
-                crop_name = f"crop_{name}_{ts}.jpg"
-                try:
-                    cv2.imwrite(os.path.join(cam_dir, crop_name), crop)
-                except Exception:
-                    pass
-
-            if cat_uid:
-                label = f"{cat_uid} ({confidence:.2f})"
-                color = (0, 255, 0)
-                found_cats.append(cat_uid)
-            else:
-                label = "Unknown"
-                color = (0, 0, 255)
-
-            cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
-            cv2.putText(
-                img,
-                label,
-                (x1, y1 - 10),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.8,
-                color,
-                2
-            )
 
-    print("\n" + "=" * 50)
-    print(f"🔍 Test Results for USER={user_id}")
-    print("=" * 50)
+class ResultWriter:
+    """Stream results as JSONL (one line per image) or CSV (one row per box)."""
 
-    if found_cats:
-        for uid in found_cats:
-            print(f"🐱 Found cat UID: {uid}")
-    else:
-        print("❌ No registered cats found")
+    def __init__(self, path):
+        self.csv = path.lower().endswith(".csv")
+        self.f = open(path, "w", encoding="utf-8", newline="")
+        self.writer = csv.DictWriter(self.f, CSV_FIELDS) if self.csv else None
+        if self.writer:
+            self.writer.writeheader()
 
-    print("=" * 50 + "\n")
+    def write(self, row):
+        if not self.csv:
+            self.f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            return
+        if "error" in row:
+            self.writer.writerow({"image": row["image"], "error": row["error"]})
+            return
+        if not row["detections"]:
+            self.writer.writerow({"image": row["image"]})
+        for det in row["detections"]:
+            x1, y1, x2, y2 = det["box"]
+            self.writer.writerow({
+                "image": row["image"], "x1": x1, "y1": y1, "x2": x2, "y2": y2,
+                "conf": det["conf"], "quality": det["quality"],
+                "cat_uid": det["cat_uid"] or "", "score": det["score"],
+                "skipped": int(det["skipped"]),
+            })
 
-    cv2.imshow(f"Test Image - USER={user_id}", img)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
+    def close(self):
+        self.f.close()
+
+
+def test_images_batch(user_id, inputs, out_path, device_id=None, roi=None, imgsz=None,
+                      workers=1, batch=BATCH_IMAGES, annotate_dir=None, base_db=BASE_DB):
+    """
+    Identify every image under `inputs` (directories / globs) without a GUI.
+    workers > 1: a process pool, each process with its own warm Identifier.
+    return: summary dict (images, identified, errors, seconds, images_per_s)
+    """
+    paths = expand_inputs(inputs)
+    if not paths:
+        print(f"❌ No images found in {inputs}")
+        return None
+    if annotate_dir:
+        os.makedirs(annotate_dir, exist_ok=True)
+
+    chunks = [paths[s:s + batch] for s in range(0, len(paths), batch)]
+    workers = max(1, min(workers, len(chunks)))
+    threads = max(1, (os.cpu_count() or 1) // workers) if workers > 1 else None
+    print(f"🗂️ {len(paths)} images in {len(chunks)} chunks, {workers} worker(s)")
+
+    summary = {"images": 0, "identified": 0, "errors": 0}
+    writer = ResultWriter(out_path)
+    t0 = time.perf_counter()
+    try:
+        if workers == 1:
+            _init_worker(base_db)
+            results = (
+                _identify_chunk(user_id, chunk, device_id, roi, imgsz, annotate_dir)
+                for chunk in chunks
+            )
+            _consume(results, writer, summary, user_id)
+            _worker.close()
+        else:
+            with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                     initargs=(base_db, threads)) as pool:
+                futures = [
+                    pool.submit(_identify_chunk, user_id, chunk, device_id, roi, imgsz, annotate_dir)
+                    for chunk in chunks
+                ]
+                _consume((f.result() for f in futures), writer, summary, user_id)
+    finally:
+        writer.close()
+
+    summary["seconds"] = round(time.perf_counter() - t0, 2)
+    summary["images_per_s"] = round(summary["images"] / max(summary["seconds"], 1e-9), 1)
+    print(
+        f"✅ {summary['images']} images ({summary['identified']} with a known cat, "
+        f"{summary['errors']} unreadable) in {summary['seconds']:.1f}s "
+        f"→ {summary['images_per_s']:.1f} images/s → {out_path}"
+    )
+    return summary
+
+
+def _consume(results, writer, summary, user_id):
+    warned = False
+    for cats, rows in results:
+        if not cats and not warned:
+            print(f"⚠️ No cats registered for USER={user_id}: every box is Unknown")
+            warned = True
+        for row in rows:
+            writer.write(row)
+            summary["images"] += 1
+            if "error" in row:
+                summary["errors"] += 1
+            elif any(d["cat_uid"] for d in row["detections"]):
+                summary["identified"] += 1
 
 
 # ---------- RUN ----------
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--user", required=True, help="User ID")
-    parser.add_argument("--image", required=True, help="Path to uploaded image")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--image", help="Path to uploaded image")
+    source.add_argument("--batch", nargs="+", help="Directories / globs to score headless")
     parser.add_argument("--device", required=False, help="Device ID to scope analysis")
+    parser.add_argument("--roi", required=False, help="Bowl zone: 'x1,y1,x2,y2' or 'x,y;x,y;...'")
+    parser.add_argument("--imgsz", type=int, required=False, help="YOLO input size, e.g. 320")
+    parser.add_argument("--server", default=SERVICE_URL, help="identify_service.py URL")
+    parser.add_argument("--local", action="store_true", help="Do not use the service")
+    parser.add_argument("--no-show", action="store_true", help="Do not open a window")
+    parser.add_argument("--out", default="results.jsonl", help="Batch results (.jsonl or .csv)")
+    parser.add_argument("--workers", type=int, default=1, help="Batch worker processes")
+    parser.add_argument("--chunk", type=int, default=BATCH_IMAGES, help="Images per worker task")
+    parser.add_argument("--annotate", required=False, help="Write annotated images to this folder")
     args = parser.parse_args()
 
     device = args.device or get_or_create_device_id()
-    test_image_for_user(args.user, args.image, device_id=device)
+    if args.batch:
+        test_images_batch(
+            args.user, args.batch, args.out, device_id=device, roi=args.roi,
+            imgsz=args.imgsz, workers=args.workers, batch=args.chunk,
+            annotate_dir=args.annotate
+        )
+    else:
+        test_image_for_user(
+            args.user, args.image, device_id=device, roi=args.roi, imgsz=args.imgsz,
+            server=None if args.local else args.server, show=not args.no_show
+        )
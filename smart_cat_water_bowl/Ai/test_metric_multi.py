@@ -1,8 +1,9 @@
 import os
 import cv2
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from embeddings import get_embedding
+from embed_cache import embed_files
+from identify_cat import CatMatcher
 
 # ================= CONFIG =================
 CATS_DIR = "cats"     # โฟลเดอร์รวมแมว
@@ -25,16 +26,14 @@ def load_cat_bank(cat_root):
         if not os.path.isdir(cat_path):
             continue
 
-        embs = []
-        for fn in os.listdir(cat_path):
-            if fn.lower().endswith((".jpg", ".png")):
-                img = cv2.imread(os.path.join(cat_path, fn))
-                if img is None:
-                    continue
-                rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                embs.append(get_embedding(rgb))
+        paths = [
+            os.path.join(cat_path, fn) for fn in os.listdir(cat_path)
+            if fn.lower().endswith((".jpg", ".png"))
+        ]
 
-        if embs:
+        # cached: unchanged photos skip the CNN on every later run
+        embs, _, _ = embed_files(paths, images=False)
+        if len(embs):
             bank[cat_name] = embs
             print(f"📦 Loaded {len(embs)} images for {cat_name}")
 
@@ -42,16 +41,14 @@ def load_cat_bank(cat_root):
 
 
 def identify(query_emb, bank):
-    results = {}
+    matcher = CatMatcher.from_dict(bank)
+    max_scores = matcher.scores(query_emb)[0]
+    mean_scores = matcher.scores(query_emb, reduce="mean")[0]
 
-    for cat, emb_list in bank.items():
-        sims = cosine_similarity([query_emb], emb_list)[0]
-        results[cat] = {
-            "max": float(sims.max()),
-            "mean": float(sims.mean())
-        }
-
-    return results
+    return {
+        cat: {"max": float(mx), "mean": float(mn)}
+        for cat, mx, mn in zip(matcher.cat_uids, max_scores, mean_scores)
+    }
 
 
 # ================= RUN =================
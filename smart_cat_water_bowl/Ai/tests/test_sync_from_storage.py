@@ -0,0 +1,104 @@
+# tests/test_sync_from_storage.py
+#   cd smart_cat_water_bowl/Ai && python -m pytest tests
+import os
+import hashlib
+import cv2
+import numpy as np
+import pytest
+
+import sync_from_storage
+from cat_bank import load_user_bank
+from local_bucket import LocalBucket
+
+USER = "U1"
+DEVICE = "DEV_TEST"
+
+
+def _fake_embed(datas, imgs=None, bgr=True):
+    # deterministic per file content; keeps the CNN out of the test
+    out = np.empty((len(datas), 8), dtype=np.float32)
+    for i, data in enumerate(datas):
+        seed = int.from_bytes(hashlib.md5(data).digest()[:4], "little")
+        out[i] = np.random.default_rng(seed).normal(size=8)
+    return out
+
+
+def _write_photo(bucket_root, cat_uid, name, seed):
+    path = os.path.join(bucket_root, "cats", USER, cat_uid, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    img = np.random.default_rng(seed).integers(0, 255, (32, 32, 3), dtype=np.uint8)
+    cv2.imwrite(path, img)
+    return path
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    monkeypatch.setattr(sync_from_storage, "embed_encoded", _fake_embed)
+    monkeypatch.setattr(sync_from_storage, "cache_version", lambda: "v1")
+    bucket_root = tmp_path / "bucket"
+    base_db = str(tmp_path / "users")
+    for i in range(3):
+        _write_photo(bucket_root, "A", f"a{i}.jpg", seed=i)
+    for i in range(2):
+        _write_photo(bucket_root, "B", f"b{i}.jpg", seed=10 + i)
+    bucket = LocalBucket(str(bucket_root))
+
+    def sync():
+        return sync_from_storage.sync_user_from_storage(
+            USER, bucket=bucket, device_id=DEVICE, base_db=base_db, workers=2
+        )
+
+    def counts():
+        bank = load_user_bank(base_db, USER, DEVICE)
+        return bank.counts() if bank is not None else {}
+
+    return bucket, bucket_root, sync, counts
+
+
+def test_first_sync_embeds_everything(env):
+    bucket, _, sync, counts = env
+    summary = sync()
+    assert summary["downloaded"] == 5 and summary["embedded"] == 5
+    assert counts() == {"A": 3, "B": 2}
+
+
+def test_unchanged_sync_is_one_list_call(env):
+    bucket, _, sync, counts = env
+    sync()
+    lists, downloads = bucket.list_calls, bucket.downloads
+
+    summary = sync()
+    assert bucket.list_calls == lists + 1
+    assert bucket.downloads == downloads
+    assert summary["embedded"] == 0 and summary["cats_updated"] == 0
+    assert counts() == {"A": 3, "B": 2}
+
+
+def test_deleted_blobs_drop_their_rows(env):
+    bucket, bucket_root, sync, counts = env
+    sync()
+    os.remove(os.path.join(bucket_root, "cats", USER, "A", "a0.jpg"))
+    for i in range(2):
+        os.remove(os.path.join(bucket_root, "cats", USER, "B", f"b{i}.jpg"))
+
+    downloads = bucket.downloads
+    summary = sync()
+    assert summary["deleted"] == 3
+    assert bucket.downloads == downloads
+    assert counts() == {"A": 2}
+
+
+def test_new_embedding_version_reembeds_without_downloads(env, monkeypatch, tmp_path):
+    bucket, _, sync, counts = env
+    sync()
+    monkeypatch.setattr(sync_from_storage, "cache_version", lambda: "v2")
+
+    downloads = bucket.downloads
+    summary = sync()
+    assert bucket.downloads == downloads
+    assert summary["embedded"] == 5
+    assert counts() == {"A": 3, "B": 2}
+    assert sync()["embedded"] == 0
+
+    emb_dir = tmp_path / "users" / USER / "devices" / DEVICE / "sync" / "embeddings"
+    assert len(os.listdir(emb_dir)) == 5   # the old version's files are gone
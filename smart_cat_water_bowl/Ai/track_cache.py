@@ -0,0 +1,232 @@
+# track_cache.py
+import time
+import threading
+import numpy as np
+from collections import OrderedDict, defaultdict
+
+# Bounded track_id -> identity cache for the live loop.
+# - each track is identified from up to `budget` embeddings, then frozen,
+#   so CNN calls per track stay capped while one blurry first crop no
+#   longer decides the identity
+# - entries are evicted when DeepSort deletes the track, after `ttl`
+#   seconds without being seen, or (oldest first) above `max_tracks`
+# - "no match" is a candidate of its own: a cat is reported only when it
+#   matched more of the track's frames than came back unknown
+# - the embeddings behind the votes are kept (at most `budget` per track),
+#   so a reloaded cat bank can re-score live tracks without new crops
+
+IDENTITY_BUDGET = 5     # embeddings per track before the identity freezes
+IDENTITY_TTL = 60.0     # seconds a track may go unseen before eviction
+MAX_TRACKS = 256
+# once a track has voted, later crops must reach this fraction of its best
+# crop quality so far (identity is refined with the best crops only)
+QUALITY_KEEP_RATIO = 0.8
+
+
+class TrackEntry:
+    __slots__ = (
+        "votes", "counts", "unknown", "observed", "best_raw",
+        "best_quality", "pending", "frozen", "last_seen", "embs"
+    )
+
+    def __init__(self, now):
+        self.votes = defaultdict(float)   # cat_uid -> summed score
+        self.counts = defaultdict(int)    # cat_uid -> matching frames
+        self.unknown = 0                  # frames that matched no cat
+        self.observed = 0
+        self.best_raw = None              # best score seen when nothing matched
+        self.best_quality = None          # best crop quality submitted so far
+        self.pending = False
+        self.frozen = False
+        self.last_seen = now
+        self.embs = []                    # embeddings that were voted on
+
+    def add_vote(self, cat_uid, score):
+        if cat_uid is not None:
+            self.votes[cat_uid] += score
+            self.counts[cat_uid] += 1
+            return
+        self.unknown += 1
+        if score is not None:
+            self.best_raw = score if self.best_raw is None else max(self.best_raw, score)
+
+    def clear_votes(self):
+        self.votes.clear()
+        self.counts.clear()
+        self.unknown = 0
+        self.best_raw = None
+
+    def identity(self):
+        if not self.votes:
+            return None, self.best_raw
+        cat_uid = max(self.votes, key=self.votes.get)
+        if self.counts[cat_uid] <= self.unknown:
+            # one match in five frames must not beat four "unknown" votes
+            return None, self.best_raw
+        return cat_uid, self.votes[cat_uid] / self.counts[cat_uid]
+
+
+class TrackIdentityCache:
+    def __init__(
+        self,
+        budget=IDENTITY_BUDGET,
+        ttl=IDENTITY_TTL,
+        max_tracks=MAX_TRACKS,
+        keep_ratio=QUALITY_KEEP_RATIO
+    ):
+        self.budget = max(1, budget)
+        self.keep_ratio = keep_ratio
+        self.ttl = ttl
+        self.max_tracks = max_tracks
+        self.evicted = 0
+        self._entries = OrderedDict()  # least recently seen first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, track_id):
+        return track_id in self._entries
+
+    # ---------- frame loop ----------
+    def touch(self, track_id, now=None):
+        """Mark a track as seen this frame (creates its entry)."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(track_id)
+            if entry is None:
+                entry = self._entries[track_id] = TrackEntry(now)
+            else:
+                entry.last_seen = now
+                self._entries.move_to_end(track_id)
+
+            while len(self._entries) > self.max_tracks:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def wants(self, track_id):
+        """True if the track still needs embeddings (not frozen/pending)."""
+        with self._lock:
+            entry = self._entries.get(track_id)
+            return entry is not None and not entry.frozen and not entry.pending
+
+    def request(self, track_id, quality=None):
+        """True if this crop should be embedded for the track (marks it pending).
+
+        With `quality`, crops clearly worse than the track's best so far
+        are refused.
+        """
+        with self._lock:
+            entry = self._entries.get(track_id)
+            if entry is None or entry.frozen or entry.pending:
+                return False
+            if quality is not None:
+                best = entry.best_quality
+                if best is not None and quality < best * self.keep_ratio:
+                    return False
+                entry.best_quality = quality if best is None else max(best, quality)
+            entry.pending = True
+            return True
+
+    def cancel(self, track_id):
+        """A requested embedding was dropped; allow a new request."""
+        with self._lock:
+            entry = self._entries.get(track_id)
+            if entry is not None:
+                entry.pending = False
+
+    def vote(self, track_id, cat_uid, score, emb=None):
+        """Add one identification result for the track (`emb`: the query)."""
+        with self._lock:
+            entry = self._entries.get(track_id)
+            if entry is None:
+                return  # evicted while the job was in flight
+
+            entry.pending = False
+            entry.observed += 1
+            entry.add_vote(cat_uid, score)
+            if emb is not None:
+                entry.embs.append(emb)
+
+            if entry.observed >= self.budget:
+                entry.frozen = True
+
+    # ---------- bank reload ----------
+    def rescore(self, identify_batch, affected=()):
+        """
+        Re-vote every track against a new cat bank.
+
+        identify_batch: embs (N, dim) -> [(cat_uid or None, score), ...]
+        affected: cat UIDs that were removed or replaced; tracks that
+                  point at one but have no stored embeddings are reset
+        Return: track ids whose identity changed.
+        """
+        with self._lock:
+            snapshot = [
+                (track_id, entry, list(entry.embs), entry.identity())
+                for track_id, entry in self._entries.items()
+                if entry.observed
+            ]
+
+        # GEMM outside the lock: the frame loop keeps running meanwhile
+        results = {
+            track_id: identify_batch(np.stack(embs))
+            for track_id, _, embs, _ in snapshot if embs
+        }
+
+        changed = []
+        with self._lock:
+            for track_id, entry, embs, before in snapshot:
+                if self._entries.get(track_id) is not entry:
+                    continue  # evicted / replaced meanwhile
+
+                if track_id in results:
+                    if len(entry.embs) != len(embs):
+                        continue  # voted again meanwhile, already current
+                    entry.clear_votes()
+                    for cat_uid, score in results[track_id]:
+                        entry.add_vote(cat_uid, score)
+                elif before[0] in affected:
+                    self._reset(entry)
+                else:
+                    continue
+
+                if entry.identity()[0] != before[0]:
+                    changed.append(track_id)
+
+        return changed
+
+    def invalidate(self, track_ids):
+        """Forget the identity of these tracks; they collect new crops."""
+        with self._lock:
+            for track_id in track_ids:
+                entry = self._entries.get(track_id)
+                if entry is not None:
+                    self._reset(entry)
+
+    @staticmethod
+    def _reset(entry):
+        entry.clear_votes()
+        entry.embs.clear()
+        entry.observed = 0
+        entry.best_quality = None
+        entry.frozen = False
+
+    def get(self, track_id):
+        """Return (cat_uid, score); (None, None) until the first vote."""
+        with self._lock:
+            entry = self._entries.get(track_id)
+            if entry is None or entry.observed == 0:
+                return None, None
+            return entry.identity()
+
+    # ---------- eviction ----------
+    def retain(self, active_track_ids, now=None):
+        """Drop tracks DeepSort deleted and tracks unseen for `ttl` seconds."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for track_id in list(self._entries):
+                entry = self._entries[track_id]
+                if track_id not in active_track_ids or now - entry.last_seen > self.ttl:
+                    del self._entries[track_id]
+                    self.evicted += 1
@@ -1,73 +1,51 @@
 import argparse
-import os, json, uuid
+import os, uuid
 import cv2
 import numpy as np
-from Ai.test_ai.embeddings import get_embedding
+from embeddings import EMBED_BATCH_SIZE
+from embed_cache import embed_files
+from catalog import catalog_for
 
 CAT_DB = "cat_db"
-METADATA = f"{CAT_DB}/metadata.json"
 IMAGES_DIR = f"{CAT_DB}/images"
 
-
-def load_meta():
-    if os.path.exists(METADATA):
-        with open(METADATA, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
-
-
-def save_meta(meta):
-    with open(METADATA, 'w', encoding='utf-8') as f:
-        json.dump(meta, f, ensure_ascii=False, indent=2)
+# cats live in the catalog (cat_db/catalog.db, unscoped); an old
+# cat_db/metadata.json is imported on first use
 
 
 def add_images(name, image_paths, set_profile=False):
-    meta = load_meta()
-    entry = meta.get(name)
-    if entry is None:
+    catalog, user_id, device_id = catalog_for(CAT_DB)
+    if catalog.get_cat(user_id, device_id, name) is None:
         print(f"No cat named {name} in metadata. Create it first using register_cat.py")
         return
 
     img_folder = os.path.join(IMAGES_DIR, name)
     os.makedirs(img_folder, exist_ok=True)
 
-    for p in image_paths:
-        img = cv2.imread(p)
-        if img is None:
-            print(f"Failed to read {p}")
-            continue
-        try:
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        except Exception:
-            img_rgb = img
-
-        emb = get_embedding(img_rgb)
-        emb_fn = f"{name}_{uuid.uuid4().hex}.npy"
-        np.save(os.path.join(CAT_DB, emb_fn), emb)
-
-        img_fn = f"{name}_{uuid.uuid4().hex}.jpg"
-        img_path = os.path.join(img_folder, img_fn)
-        cv2.imwrite(img_path, img)
-        rel_img = os.path.relpath(img_path, start=CAT_DB)
-
-        # ensure dict format
-        if isinstance(entry, list):
-            entry = {"embeddings": entry, "images": [], "profile": None}
-
-        entry.setdefault("embeddings", []).append(emb_fn)
-        entry.setdefault("images", []).append(rel_img)
-        if set_profile:
-            entry["profile"] = rel_img
-
-    meta[name] = entry
-    save_meta(meta)
+    added = []
+    # one EMBED_BATCH_SIZE chunk of decoded photos in memory at a time
+    for start in range(0, len(image_paths), EMBED_BATCH_SIZE):
+        embs, images, _ = embed_files(image_paths[start:start + EMBED_BATCH_SIZE])
+
+        for img, emb in zip(images, embs):
+            emb_fn = f"{name}_{uuid.uuid4().hex}.npy"
+            np.save(os.path.join(CAT_DB, emb_fn), emb)
+
+            img_fn = f"{name}_{uuid.uuid4().hex}.jpg"
+            img_path = os.path.join(img_folder, img_fn)
+            cv2.imwrite(img_path, img)
+            rel_img = os.path.relpath(img_path, start=CAT_DB)
+            added.append((rel_img, None, emb_fn))
+
+    catalog.add_images(user_id, device_id, name, added, bank_rows=len(added))
+    if set_profile and added:
+        catalog.set_profile(user_id, device_id, name, added[-1][0])
     print(f"Added {len(image_paths)} images to {name}")
 
 
 def set_profile(name, image_path):
-    meta = load_meta()
-    entry = meta.get(name)
-    if entry is None:
+    catalog, user_id, device_id = catalog_for(CAT_DB)
+    if catalog.get_cat(user_id, device_id, name) is None:
         print(f"No cat named {name} in metadata.")
         return
 
@@ -83,13 +61,8 @@ def set_profile(name, image_path):
     cv2.imwrite(img_path, img)
     rel_img = os.path.relpath(img_path, start=CAT_DB)
 
-    if isinstance(entry, list):
-        entry = {"embeddings": entry, "images": [], "profile": None}
-
-    entry["profile"] = rel_img
-    entry.setdefault("images", []).append(rel_img)
-    meta[name] = entry
-    save_meta(meta)
+    catalog.add_images(user_id, device_id, name, [(rel_img, None, None)])
+    catalog.set_profile(user_id, device_id, name, rel_img)
     print(f"Set profile for {name} -> {rel_img}")
 
 
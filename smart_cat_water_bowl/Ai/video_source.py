@@ -0,0 +1,149 @@
+# video_source.py
+import os
+import abc
+import time
+import cv2
+
+# Frame sources for main.py --source:
+#   0, 1, ...              camera index                     (live)
+#   rtsp://..., http://... network stream                   (live)
+#   clip.mp4               recorded video file              (replay)
+#   frames/                directory of images, name order  (replay)
+#
+# read() -> (ok, frame) like cv2.VideoCapture; timestamp() is the capture
+# time of the last frame read. Live sources stamp wall-clock time.
+# Recorded sources stamp media time (seconds into the footage), so a
+# replay produces the same timestamps every run. They are read as fast as
+# possible, or paced to real time with realtime=True.
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+SEQUENCE_FPS = 10.0     # frame rate assumed for image directories
+
+
+class FrameSource(abc.ABC):
+    live = True
+
+    def __init__(self, name, fps):
+        self.name = name
+        self.fps = fps
+        self.frames = 0
+
+    @abc.abstractmethod
+    def read(self):
+        """(ok, frame) like cv2.VideoCapture.read()"""
+
+    def timestamp(self):
+        return time.time()
+
+    def release(self):
+        pass
+
+
+class _Pacer:
+    """Sleep so frame n is delivered no earlier than n / fps after the first."""
+
+    def __init__(self, fps):
+        self.interval = 1.0 / fps if fps else 0.0
+        self.start = None
+
+    def wait(self, media_ts):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now - media_ts
+            return
+        delay = self.start + media_ts - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class VideoSource(FrameSource):
+    """Camera, stream or video file through cv2.VideoCapture."""
+
+    def __init__(self, spec, live, realtime=False):
+        self.cap = cv2.VideoCapture(spec)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"❌ Cannot open source: {spec}")
+        fps = self.cap.get(cv2.CAP_PROP_FPS) or 0.0
+        # some containers / cameras report nonsense (0, 1000, 90000)
+        fps = fps if 1.0 <= fps <= 240.0 else (SEQUENCE_FPS if not live else 0.0)
+        super().__init__(str(spec), fps)
+        self.live = live
+        if live:
+            # hold at most one buffered frame: the pipeline wants the latest
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self._ts = 0.0
+        self._pacer = _Pacer(self.fps) if realtime and not live else None
+
+    def read(self):
+        ok, frame = self.cap.read()
+        if not ok:
+            return False, None
+        if self.live:
+            self._ts = time.time()
+        else:
+            # frame index, not CAP_PROP_POS_MSEC: the latter is unreliable
+            # for some codecs and must be identical across runs
+            self._ts = self.frames / self.fps
+            if self._pacer is not None:
+                self._pacer.wait(self._ts)
+        self.frames += 1
+        return True, frame
+
+    def timestamp(self):
+        return self._ts
+
+    def release(self):
+        self.cap.release()
+
+
+class ImageSequenceSource(FrameSource):
+    """Every image in a directory, in file-name order, as a recorded clip."""
+
+    live = False
+
+    def __init__(self, directory, fps=SEQUENCE_FPS, realtime=False):
+        self.paths = sorted(
+            os.path.join(directory, f) for f in os.listdir(directory)
+            if f.lower().endswith(IMAGE_EXTS)
+        )
+        if not self.paths:
+            raise RuntimeError(f"❌ No images in {directory}")
+        super().__init__(directory, fps)
+        self._ts = 0.0
+        self._pacer = _Pacer(fps) if realtime else None
+
+    def read(self):
+        while self.frames < len(self.paths):
+            frame = cv2.imread(self.paths[self.frames])
+            self._ts = self.frames / self.fps
+            self.frames += 1
+            if frame is None:
+                print(f"⚠️ Cannot read image: {self.paths[self.frames - 1]}")
+                continue
+            if self._pacer is not None:
+                self._pacer.wait(self._ts)
+            return True, frame
+        return False, None
+
+    def timestamp(self):
+        return self._ts
+
+
+def open_source(spec, realtime=False, fps=None):
+    """
+    spec: camera index (int or digits), URL, video file or image directory
+    realtime: pace recorded sources to their frame rate (default: max speed)
+    fps: frame rate of an image directory (default SEQUENCE_FPS)
+    """
+    if isinstance(spec, int) or str(spec).isdigit():
+        return VideoSource(int(spec), live=True)
+    spec = str(spec)
+    if "://" in spec:
+        return VideoSource(spec, live=True)
+    if os.path.isdir(spec):
+        return ImageSequenceSource(spec, fps or SEQUENCE_FPS, realtime)
+    if os.path.isfile(spec):
+        return VideoSource(spec, live=False, realtime=realtime)
+    raise RuntimeError(f"❌ Cannot open source: {spec}")
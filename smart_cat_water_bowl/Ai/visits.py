@@ -0,0 +1,180 @@
+# visits.py
+import os
+import json
+import uuid
+import hashlib
+import threading
+from collections import Counter
+import cv2
+import numpy as np
+
+# One record per cat visit instead of one file per frame.
+# A visit opens when a DeepSort track is first confirmed and closes when the
+# tracker drops the track. Records are appended to visits.jsonl:
+# {
+#   "visit_id": "...", "track_id": "3", "cat_uid": "abc" | null,
+#   "start_ts": 1700000000.123, "end_ts": 1700000012.456, "duration_s": 12.3,
+#   "frames": 250, "score": {"min": .., "max": .., "mean": ..},
+#   "best_crop": "visits/<visit_id>.jpg"
+# }
+# With several cameras in one process each stream has its own tracker
+# (track ids overlap), so records also carry "camera": "cam1".
+# Live visit ids are random; a replay derives them from (camera, track_id,
+# start_ts), so replaying the same footage writes the same records.
+
+VISITS_FILE = "visits.jsonl"
+VISIT_CROPS_DIR = "visits"
+
+# one lock per visits.jsonl: trackers of several cameras append to it
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+
+def _file_lock(path):
+    with _file_locks_guard:
+        return _file_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def replay_visit_id(camera, track_id, start_ts):
+    key = f"{camera or ''}|{track_id}|{start_ts:.3f}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=6).hexdigest()
+
+
+class Visit:
+    def __init__(self, track_id, ts, visit_id=None):
+        self.visit_id = visit_id or uuid.uuid4().hex[:12]
+        self.track_id = track_id
+        self.start_ts = ts
+        self.end_ts = ts
+        self.frames = 0
+        self.scores = []
+        self.identities = Counter()
+        self.best_quality = -1.0
+        self.best_crop = None
+
+    def update(self, ts, cat_uid, score, crop, quality):
+        self.end_ts = ts
+        self.frames += 1
+        if score is not None:
+            self.scores.append(float(score))
+        if cat_uid:
+            self.identities[cat_uid] += 1
+
+        if quality > self.best_quality:
+            self.best_quality = quality
+            self.best_crop = crop.copy()
+
+    def record(self):
+        cat_uid = self.identities.most_common(1)[0][0] if self.identities else None
+        scores = np.asarray(self.scores) if self.scores else None
+        return {
+            "visit_id": self.visit_id,
+            "track_id": str(self.track_id),
+            "cat_uid": cat_uid,
+            "start_ts": round(self.start_ts, 3),
+            "end_ts": round(self.end_ts, 3),
+            "duration_s": round(self.end_ts - self.start_ts, 3),
+            "frames": self.frames,
+            "score": None if scores is None else {
+                "min": round(float(scores.min()), 4),
+                "max": round(float(scores.max()), 4),
+                "mean": round(float(scores.mean()), 4),
+            },
+            "best_crop": None,
+        }
+
+
+class VisitTracker:
+    """Sessionise confirmed tracks into visits.
+
+    update()  : call once per processed frame with the visible tracks
+    close()   : call on shutdown to flush every open visit
+    """
+
+    def __init__(self, device_db, crop_writer=None, min_frames=1, camera=None,
+                 replay=False):
+        """replay: visit ids from (camera, track_id, start_ts), not random"""
+        self.device_db = device_db
+        self.path = os.path.join(device_db, VISITS_FILE)
+        self.crop_writer = crop_writer
+        self.min_frames = min_frames
+        self.camera = camera
+        self.replay = replay
+        self.open = {}  # track_id -> Visit
+        self.closed = 0
+        self._lock = _file_lock(self.path)
+        os.makedirs(os.path.join(device_db, VISIT_CROPS_DIR), exist_ok=True)
+
+    def update(self, ts, observations, active_track_ids):
+        """
+        observations: [(track_id, cat_uid, score, crop, quality), ...]
+                      for this frame (quality from crop_quality.score_boxes)
+        active_track_ids: every track id DeepSort still holds (any state)
+        """
+        for track_id, cat_uid, score, crop, quality in observations:
+            visit = self.open.get(track_id)
+            if visit is None:
+                visit_id = replay_visit_id(self.camera, track_id, ts) if self.replay else None
+                visit = self.open[track_id] = Visit(track_id, ts, visit_id)
+            visit.update(ts, cat_uid, score, crop, quality)
+
+        for track_id in list(self.open):
+            if track_id not in active_track_ids:
+                self._finish(self.open.pop(track_id))
+
+    def close(self):
+        for track_id in list(self.open):
+            self._finish(self.open.pop(track_id))
+
+    def _finish(self, visit):
+        if visit.frames < self.min_frames:
+            return
+
+        rec = visit.record()
+        if self.camera is not None:
+            rec["camera"] = self.camera
+        if visit.best_crop is not None:
+            rel = os.path.join(VISIT_CROPS_DIR, f"{visit.visit_id}.jpg")
+            path = os.path.join(self.device_db, rel)
+            if self.crop_writer is not None:
+                # lossless queue: the file exists once the writer catches up
+                self.crop_writer.save(os.path.abspath(path), visit.best_crop)
+                saved = True
+            else:
+                saved = cv2.imwrite(path, visit.best_crop)
+            if saved:
+                rec["best_crop"] = rel.replace("\\", "/")
+
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self.closed += 1
+
+        name = rec["cat_uid"] or "unknown"
+        print(
+            f"🐾 Visit {name} track={rec['track_id']} "
+            f"{rec['duration_s']:.1f}s frames={rec['frames']}"
+        )
+
+
+def load_visits(device_db, since_ts=None, cat_uid=None, camera=None):
+    """Read visit records back (optionally filtered)."""
+    path = os.path.join(device_db, VISITS_FILE)
+    if not os.path.exists(path):
+        return []
+
+    visits = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            rec = json.loads(line)
+            if since_ts is not None and rec["end_ts"] < since_ts:
+                continue
+            if cat_uid is not None and rec["cat_uid"] != cat_uid:
+                continue
+            if camera is not None and rec.get("camera") != camera:
+                continue
+            visits.append(rec)
+    return visits